@@ -1,14 +1,21 @@
 import numpy as np
-from collections import defaultdict
 import matplotlib.pyplot as plt
 import matplotlib.colors as colors
 import matplotlib.colorbar as colorbar
 import matplotlib.ticker as ticker
 
+from .core.utils import Measurement
+
 class MeasurementProcessor(object):
 	""" Class to handle binning measurements, discarding low score measurements
 		and determining regions of low measurement availability
 
+		Kept measurements are stored as flat arrays (points, vectors, scores
+		and cells) ordered by cell, cells in the order they were first
+		seen, and by insertion within each cell. Each cell keeps its
+		_maxMeasurementsPerCell highest scoring measurements, the newer one
+		winning ties, which is what pruning the worst (oldest on ties)
+		measurement after every single insertion amounts to
 
 		todo: need valid bounds/region abstraction to be used across all code
 	"""
@@ -30,7 +37,8 @@ class MeasurementProcessor(object):
 
 		self._maxMeasurementsPerCell = 2
 
-		self._measurementBins = defaultdict(list)
+		self._cellRanks = {}
+		self.clearMeasurements()
 
 		plt.ion()
 		self._fig = plt.figure(figsize=(14, 10), dpi=100)
@@ -65,51 +73,106 @@ class MeasurementProcessor(object):
 
 
 	def addMeasurements(self, measurements):
-		# Todo accept track as input? 
-		# Or since measurements come in agregated by track they are from use this 
-		# for faster lookups
+		if (len(measurements) < 1):
+			return
 
-		#print("Filtering ", len(measurements), " measurements")
+		points = [m.point for m in measurements]
+		vectors = [m.vector for m in measurements]
+		scores = [m.score for m in measurements]
 
-		for m in measurements:
-			self.addMeasurement(m)
+		self.addMeasurementArrays(points, vectors, scores)
 
 	def addMeasurement(self, measurement):
-		coordinates = self.binMeasurement(measurement)
-		#print("Adding measurment to cell ", coordinates)
+		self.addMeasurements([measurement])
 
-		self._measurementBins[coordinates].append(measurement)
-		measurementBin = self._measurementBins[coordinates]
-		numMeasurements = len(measurementBin)
+	def addMeasurementArrays(self, points, vectors, scores):
+		""" Bins Nx2 points and vectors with their N scores (or a single
+			score for all) in bulk, pruning every cell back to its best
+			measurements
 
-		if (numMeasurements > self._maxMeasurementsPerCell):
-			# Trigger pruning
+		"""
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 2)
+		scores = np.broadcast_to(np.asarray(scores, dtype=np.float64), (len(points),))
+		numAdded = len(points)
+
+		if (numAdded < 1):
+			return
+
+		cells = self.binPoints(points)
+		order = np.arange(self._numAdded, self._numAdded + numAdded)
+		self._numAdded += numAdded
+
+		points = np.concatenate((self._points, points))
+		vectors = np.concatenate((self._vectors, vectors))
+		scores = np.concatenate((self._scores, scores))
+		cells = np.concatenate((self._cells, cells))
+		ranks = np.concatenate((self._ranks, self._rankCells(cells[len(self._ranks):])))
+		order = np.concatenate((self._order, order))
+
+		# Rank measurements within each cell, best (and newest on ties) first
+		byScore = np.lexsort((-order, -scores, ranks))
+		sortedRanks = ranks[byScore]
+		groupStarts = np.flatnonzero(np.r_[True, sortedRanks[1:] != sortedRanks[:-1]])
+		groupSizes = np.diff(np.r_[groupStarts, len(byScore)])
+		withinCell = np.arange(len(byScore)) - np.repeat(groupStarts, groupSizes)
+
+		kept = byScore[withinCell < self._maxMeasurementsPerCell]
+		kept = kept[np.lexsort((order[kept], ranks[kept]))]
+
+		self._points = points[kept]
+		self._vectors = vectors[kept]
+		self._scores = scores[kept]
+		self._cells = cells[kept]
+		self._ranks = ranks[kept]
+		self._order = order[kept]
+
+	def _rankCells(self, cells):
+		""" Returns the rank of each cell in the order cells were first seen
 
-			worstMeasurement = None
-			minScoreIndex = None
+		"""
+		uniqueCells, firstIndices, inverse = np.unique(cells, axis=0,
+			return_index=True, return_inverse=True)
 
-			for index in range(0, numMeasurements):
-				#print(measurementBin[index].score)
-				if (worstMeasurement is None or measurementBin[index] < worstMeasurement):
-					minScoreIndex = index
-					worstMeasurement = measurementBin[index]
+		uniqueRanks = np.empty(len(uniqueCells), dtype=np.int64)
+		for index in np.argsort(firstIndices):
+			cell = tuple(uniqueCells[index])
+			uniqueRanks[index] = self._cellRanks.setdefault(cell, len(self._cellRanks))
 
-			del self._measurementBins[coordinates][minScoreIndex]
+		return uniqueRanks[inverse.reshape(-1)]
 
 	def getMeasurements(self):
-		measurements = []
+		return [Measurement(tuple(p), tuple(v), s) for p, v, s in
+				zip(self._points.tolist(), self._vectors.tolist(), self._scores.tolist())]
 
-		for key in self._measurementBins:
-			measurements.extend(self._measurementBins[key])
+	def getMeasurementArrays(self):
+		""" Returns copies of the kept (points, vectors, scores)
 
-		return measurements
+		"""
+		return (self._points.copy(), self._vectors.copy(), self._scores.copy())
+
+	def cellCenters(self):
+		""" Returns Nx2 array of the centers of cells holding measurements,
+			e.g. as inducing inputs of a SparseGPApproximator
+
+		"""
+		cells = np.unique(self._cells, axis=0)
+
+		return (cells + 0.5) * (self._xCellWidth, self._yCellWidth)
 
 	def clearMeasurements(self):
 		""" Should rarely be used but implemented for now to simplify running simulations
 			where intermediate results are desired
 
 		"""
-		self._measurementBins.clear()
+		self._points = np.empty((0, 2), dtype=np.float64)
+		self._vectors = np.empty((0, 2), dtype=np.float64)
+		self._scores = np.empty(0, dtype=np.float64)
+		self._cells = np.empty((0, 2), dtype=np.int64)
+		self._ranks = np.empty(0, dtype=np.int64)
+		self._order = np.empty(0, dtype=np.int64)
+		self._numAdded = 0
+		self._cellRanks.clear()
 
 	def binMeasurement(self, measurement):
 		""" Determine which cell the measurement should go in
@@ -122,26 +185,46 @@ class MeasurementProcessor(object):
 
 		return (xCell, yCell)
 
+	def binPoints(self, points):
+		""" Returns (xCell, yCell) of each of the Nx2 points as Nx2 array
+
+		"""
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+		xCells = np.floor(points[:, 0] / self._xCellWidth)
+		yCells = np.floor(points[:, 1] / self._yCellWidth)
+
+		return np.stack((xCells, yCells), axis=-1).astype(np.int64)
+
 	def drawMeasurementGrid(self):
 		# Need this to actually get the plots to update
 		plt.pause(0.0001)
 
 		grid = np.zeros((self._yCellCount, self._xCellCount), dtype=np.float64)
 
-		for (x,y) in self._measurementBins:
-			if (0 > x or x >= self._xCellCount):
-				print("x index of measurement out of bounds: ", (x,y))
-				continue
-			if (0 > y or y >= self._yCellCount):
-				print("y index of measurement out of bounds: ", (x,y))
-				continue
-			if (self._measurementBins[(x,y)] is not None):
-				# use number of measurements in cell
-				#grid[y, x] = len(self._measurementBins[(x,y)])
-
-				# use avg of scores in cell
-				grid[y, x] = sum(self._measurementBins[(x,y)]) / len(self._measurementBins[(x,y)])
-				#print(grid[y,x])
+		x = self._cells[:, 0]
+		y = self._cells[:, 1]
+		xValid = (0 <= x) & (x < self._xCellCount)
+		yValid = (0 <= y) & (y < self._yCellCount)
+
+		# Measurements are grouped by cell, report each bad cell once
+		firstInCell = np.r_[True, self._ranks[1:] != self._ranks[:-1]]
+		for index in np.flatnonzero(firstInCell & ~(xValid & yValid)):
+			cell = (int(x[index]), int(y[index]))
+
+			if (not xValid[index]):
+				print("x index of measurement out of bounds: ", cell)
+			else:
+				print("y index of measurement out of bounds: ", cell)
+
+		valid = xValid & yValid
+
+		# use avg of scores in cell
+		scoreSums = np.zeros_like(grid)
+		counts = np.zeros_like(grid)
+		np.add.at(scoreSums, (y[valid], x[valid]), self._scores[valid])
+		np.add.at(counts, (y[valid], x[valid]), 1)
+		np.divide(scoreSums, counts, out=grid, where=counts > 0)
 
 		#print(grid)
 		self._ax.grid(which='both', alpha=1.0, color='white', linewidth=1)
@@ -1,13 +1,581 @@
 import GPy
 import numpy as np
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from scipy.linalg import solve_triangular, qr
+from scipy.cluster.vq import vq
+
+from GPy.inference.latent_function_inference.exact_gaussian_inference import ExactGaussianInference
+from GPy.inference.latent_function_inference.posterior import PosteriorExact
+from GPy.util.linalg import jitchol, dpotrs
 
 from ..core import vf
 from .base import VectorFieldApproximator
 
+class IncrementalExactInference(ExactGaussianInference):
+	""" Exact Gaussian inference which remembers the Cholesky factor of the
+		last inference so that, while updates are allowed (see
+		allowUpdates), it can be extended for measurements appended to the
+		inputs instead of refactorizing, as long as the kernel and
+		likelihood parameters are unchanged
+
+		Extending the factor by k rows costs O(N^2 k) instead of O(N^3).
+		Rows of the last inference missing from the new inputs (e.g.
+		measurements pruned by MeasurementProcessor) are removed from the
+		factor without refactorizing, see alignInputs. Used by
+		IncrementalGPRegression
+
+	"""
+
+	def __init__(self):
+		super().__init__()
+		self._allowUpdates = False
+		self._X = None
+		self._K = None
+		self._LW = None
+		self._parameters = None
+
+		# Updates (while allowed) which extended the factor or fell back to
+		# full inference
+		self._numExtended = 0
+		self._numRefactorized = 0
+
+	def allowUpdates(self, allow=True):
+		self._allowUpdates = allow
+
+	def inference(self, kern, X, likelihood, Y, mean_function=None, Y_metadata=None, K=None, variance=None, Z_tilde=None):
+		customized = (K is not None or variance is not None or Z_tilde is not None)
+
+		if (K is None):
+			K = kern.K(X)
+
+		posterior, logMarginal, gradients = super().inference(kern, X, likelihood, Y, mean_function, Y_metadata, K, variance, Z_tilde)
+
+		if (customized):
+			# Custom covariance or noise, cannot be extended later
+			self._X = None
+		else:
+			self._store(kern, X, likelihood, K, posterior.woodbury_chol)
+
+		if (getattr(self, '_allowUpdates', False)):
+			self._numRefactorized = getattr(self, '_numRefactorized', 0) + 1
+
+		return (posterior, logMarginal, gradients)
+
+	def canExtend(self, kern, X, likelihood):
+		if (not self._allowUpdates or self._X is None):
+			return False
+
+		numOld = len(self._X)
+		if (len(X) < numOld or not np.array_equal(X[:numOld], self._X)):
+			return False
+
+		kernParams, likelihoodParams = self._parameters
+
+		return (np.array_equal(kern.param_array, kernParams) and
+				np.array_equal(likelihood.param_array, likelihoodParams))
+
+	def extend(self, kern, X, likelihood, Y, mean_function=None, Y_metadata=None):
+		""" Returns (posterior, log marginal likelihood) for inputs X which
+			extend those of the last inference (see canExtend). Gradients
+			are not computed
+
+		"""
+		numOld = len(self._X)
+		newX = X[numOld:]
+		variance = likelihood.gaussian_variance(Y_metadata)
+
+		if (len(newX) > 0):
+			K12 = kern.K(self._X, newX)
+			K22 = kern.K(newX)
+
+			# [L11 0; B^T L22] factors [K11 K12; K12^T K22] (plus noise)
+			B = solve_triangular(self._LW, K12, lower=True)
+			noisyK22 = K22 + (variance + 1e-8) * np.eye(len(newX))
+			L22 = jitchol(noisyK22 - B.T.dot(B))
+
+			# GPy's LAPACK wrappers expect Fortran ordered factors
+			LW = np.asfortranarray(np.block([[self._LW, np.zeros((numOld, len(newX)))], [B.T, L22]]))
+			K = np.block([[self._K, K12], [K12.T, K22]])
+		else:
+			LW = self._LW
+			K = self._K
+
+		m = 0 if mean_function is None else mean_function.f(X)
+		YYT_factor = Y - m
+
+		alpha, _ = dpotrs(LW, YYT_factor, lower=1)
+
+		logdet = 2.0 * np.sum(np.log(np.diag(LW)))
+		logMarginal = 0.5 * (-Y.size * np.log(2 * np.pi) - Y.shape[1] * logdet - np.sum(alpha * YYT_factor))
+
+		self._store(kern, X, likelihood, K, LW)
+		self._numExtended = getattr(self, '_numExtended', 0) + 1
+
+		return (PosteriorExact(woodbury_chol=LW, woodbury_vector=alpha, K=K), logMarginal)
+
+	def alignInputs(self, X):
+		""" Matches the rows of X to those of the last inference by value
+			and deletes unmatched rows of the last inference from the
+			stored factor, so that X[order] extends it (see canExtend)
+
+			Returns order, retained rows first (in their previous order)
+			followed by the new rows
+		"""
+		X = np.asarray(X)
+		if (self._X is None):
+			return np.arange(len(X))
+
+		# Previous row indices by value, duplicated inputs matched in order
+		previous = {}
+		for index, row in enumerate(map(tuple, self._X)):
+			previous.setdefault(row, []).append(index)
+
+		matched = np.full(len(X), -1, dtype=np.int64)
+		for index, row in enumerate(map(tuple, X)):
+			indices = previous.get(row)
+			if (indices):
+				matched[index] = indices.pop(0)
+
+		isMatched = matched >= 0
+		newIndices = np.flatnonzero(isMatched)
+		retained = newIndices[np.argsort(matched[isMatched], kind='stable')]
+		order = np.concatenate((retained, np.flatnonzero(~isMatched)))
+
+		kept = np.sort(matched[isMatched])
+
+		if (len(kept) < len(self._X)):
+			self._LW = _choleskyRestrict(self._LW, kept)
+			self._X = self._X[kept]
+			self._K = self._K[np.ix_(kept, kept)]
+
+		return order
+
+	def _store(self, kern, X, likelihood, K, LW):
+		self._X = np.array(X)
+		self._K = K
+		self._LW = LW
+		self._parameters = (kern.param_array.copy(), likelihood.param_array.copy())
+
+	@property
+	def updateCounts(self):
+		""" (extended, refactorized) numbers of updates while allowed
+
+		"""
+		return (getattr(self, '_numExtended', 0), getattr(self, '_numRefactorized', 0))
+
+def _choleskyRestrict(L, kept):
+	""" Returns the lower Cholesky factor of A[kept][:, kept] given that of
+		A, for sorted kept indices. Rows before the first removed index are
+		unchanged, the trailing block is refactored by a QR decomposition
+		of the retained rows of L, without forming A
+
+	"""
+	first = np.flatnonzero(np.arange(len(kept)) != kept)
+	if (len(first) < 1):
+		return np.asfortranarray(L[np.ix_(kept, kept)])
+
+	first = first[0]
+	tail = kept[first:]
+
+	# Retained trailing rows of L, their Gram matrix is the trailing block
+	R = qr(L[tail, first:].T, mode='r')[0][:len(tail)]
+
+	result = np.zeros((len(kept), len(kept)), order='F')
+	result[:first, :first] = L[:first, :first]
+	result[first:, :first] = L[tail, :first]
+	result[first:, first:] = R.T * np.sign(np.diag(R))
+
+	return result
+
+class IncrementalGPRegression(GPy.models.GPRegression):
+	""" GPRegression whose posterior is extended rather than recomputed when
+		measurements are appended with set_XY while updates are allowed
+		(see IncrementalExactInference). Gradients are left stale on that
+		path, they are recomputed as soon as parameters change, e.g. on
+		the first step of an optimization
+
+	"""
+
+	def __init__(self, X, Y, kernel=None, normalizer=None, mean_function=None):
+		super().__init__(X, Y, kernel, normalizer=normalizer, mean_function=mean_function)
+		self.inference_method = IncrementalExactInference()
+
+	def parameters_changed(self):
+		inference = self.inference_method
+
+		if (isinstance(inference, IncrementalExactInference) and inference.canExtend(self.kern, self.X, self.likelihood)):
+			self.posterior, self._log_marginal_likelihood = inference.extend(self.kern, self.X,
+				self.likelihood, self.Y_normalized, self.mean_function, self.Y_metadata)
+			return
+
+		super().parameters_changed()
+
+def updateModel(model, x, y, driftThreshold=0.05, optimizer='lbfgsb', maxIters=300):
+	""" Replaces the data of an already optimized model with x, y, keeping
+		its hyperparameters as a warm start. Measurements appended to the
+		previous data are added with a Cholesky update for an
+		IncrementalGPRegression model
+
+		Drift is the decrease of the log likelihood per measurement caused
+		by the new data. Within driftThreshold the hyperparameters are kept,
+		otherwise they are optimized once from the warm start
+
+		Rows of x are matched to the previous data by value, not position,
+		so pruned or reordered measurements still take the Cholesky update
+		path. The model stores them reordered, retained rows first
+
+		Returns 'kept', 'optimized' or 'refit', the latter if drift still
+		exceeds driftThreshold after optimization, in which case the model
+		should be refit from random restarts
+	"""
+	previousLikelihood = model.log_likelihood() / model.X.shape[0]
+
+	inference = model.inference_method
+	if (isinstance(inference, IncrementalExactInference)):
+		order = inference.alignInputs(x)
+		x = x[order]
+		y = y[order]
+		inference.allowUpdates(True)
+
+	try:
+		model.set_XY(x, y)
+	finally:
+		if (isinstance(inference, IncrementalExactInference)):
+			inference.allowUpdates(False)
+
+	if (previousLikelihood - model.log_likelihood() / len(x) <= driftThreshold):
+		return 'kept'
+
+	model.optimize(optimizer=optimizer, messages=False, max_iters=maxIters)
+
+	if (previousLikelihood - model.log_likelihood() / len(x) <= driftThreshold):
+		return 'optimized'
+
+	return 'refit'
+
+def _optimizeRestart(job):
+	""" Runs a single optimization restart of a GP model. Defined at module
+		level so it can be sent to worker processes. Random starts are drawn
+		from the global numpy generator if no seed is given
+
+		Returns (objective, optimizer array, function evaluations, seconds)
+		of the optimized model, None if the optimization failed
+	"""
+	model, optimizer, maxIters, seed, randomize = job
+
+	if (randomize):
+		if (seed is None):
+			model.randomize()
+		else:
+			model.randomize(np.random.default_rng(seed).normal)
+
+	start = perf_counter()
+
+	try:
+		model.optimize(optimizer=optimizer, messages=False, max_iters=maxIters)
+	except Exception as e:
+		print("Warning: Optimization restart failed ", e)
+		return None
+
+	run = model.optimization_runs[-1]
+
+	return (run.f_opt, run.x_opt, run.funct_eval or 0, perf_counter() - start)
+
+class OptimizationPolicy(object):
+	""" Schedule and budget for optimizing the hyperparameters of GP models
+
+		Each (optimizer, maxIters) stage of the schedule runs numRestarts
+		optimizations of every model, the first continuing from the current
+		parameters and the others from random starts, and keeps the best
+		(lowest objective), like optimize_restarts(robust=True). Without
+		budgets or tolerances this is exactly randomize followed by
+		optimize_restarts for each stage
+
+		Budgets (both optional) cap a whole optimize call:
+			timeBudget: wall clock seconds, a deadline for real time use
+			evaluationBudget: total objective evaluations (max_iters of the
+				GPy optimizers) over all models, stages and restarts
+		Before every run the remaining budget is shared out between the runs
+		still planned to set its max_iters, using the time per evaluation
+		measured so far for the time budget. Runs already started are not
+		interrupted, so the deadline can be overrun by about one evaluation
+		per model
+
+		Early stopping (both optional):
+			tolerance: a model is done once a stage improves its objective
+				(negative log marginal likelihood) by less than tolerance
+			restartTolerance: once two restarts of a model reach objectives
+				within restartTolerance, its remaining restarts (in this and
+				later stages) are skipped. With a process pool all restarts of
+				a stage run at once, so this only affects later stages
+
+		Timings of each stage of the last optimize call are kept in timings
+		as (optimizer, seconds, evaluations)
+
+	"""
+
+	def __init__(self, schedule=(('lbfgsb', 300), ('scg', 300)), numRestarts=2, timeBudget=None,
+		evaluationBudget=None, tolerance=None, restartTolerance=None):
+		self._schedule = tuple(schedule)
+		self._numRestarts = max(1, numRestarts)
+		self._timeBudget = timeBudget
+		self._evaluationBudget = evaluationBudget
+		self._tolerance = tolerance
+		self._restartTolerance = restartTolerance
+
+		self._timings = []
+		self._elapsed = 0.0
+		self._evaluations = 0
+
+	def optimize(self, models, numProcesses=1, seed=None, randomize=True):
+		""" Optimizes models (randomized first unless randomize is False)
+
+			numProcesses other than 1 (None for one per core) runs restarts of
+			all models of a stage concurrently in a process pool. With a seed
+			(or a pool) each restart draws its random start from its own child
+			of a SeedSequence, so results only depend on seed, not on the
+			number of processes or scheduling
+
+		"""
+		self._start = perf_counter()
+		self._timings = []
+		self._evaluations = 0
+
+		seeds = None
+		if (seed is not None or numProcesses != 1):
+			seeds = iter(np.random.SeedSequence(seed).spawn(len(models) * (1 + len(self._schedule) * self._numRestarts)))
+
+		# Time of one objective evaluation, first measured on randomization
+		self._evaluationTime = 0.0
+		for model in models:
+			evaluationStart = perf_counter()
+
+			if (not randomize):
+				if (self._timeBudget is not None):
+					# Assigning parameters triggers an evaluation
+					model.optimizer_array = model.optimizer_array
+			elif (seeds is None):
+				model.randomize()
+			else:
+				model.randomize(np.random.default_rng(next(seeds)).normal)
+
+			self._evaluationTime = max(self._evaluationTime, perf_counter() - evaluationStart)
+
+		self._restarts = [self._numRestarts] * len(models)
+		self._active = list(range(len(models)))
+		bestObjectives = [None] * len(models)
+
+		numWorkers = 1
+		executor = None
+		if (numProcesses != 1):
+			executor = ProcessPoolExecutor(max_workers=numProcesses)
+			numWorkers = numProcesses or os.cpu_count()
+
+		try:
+			for stage, (optimizer, maxIters) in enumerate(self._schedule):
+				if (len(self._active) < 1):
+					break
+
+				stageStart = perf_counter()
+				stageEvaluations = self._evaluations
+				startArrays = [models[i].optimizer_array.copy() for i in self._active]
+
+				if (executor is None):
+					results, exhausted = self._runSerial(models, optimizer, maxIters, stage, seeds)
+				else:
+					results, exhausted = self._runParallel(models, optimizer, maxIters, stage, seeds, executor, numWorkers)
+
+				done = []
+				for index, startArray, runs in zip(self._active, startArrays, results):
+					model = models[index]
+
+					if (len(runs) < 1):
+						# All restarts failed (or none fit in the budget)
+						model.optimizer_array = startArray
+						continue
+
+					runs.sort(key=lambda run: run[0])
+					model.optimizer_array = runs[0][1]
+
+					if (self._restartTolerance is not None and len(runs) > 1 and
+						runs[1][0] - runs[0][0] <= self._restartTolerance):
+						self._restarts[index] = 1
+
+					previous = bestObjectives[index]
+					bestObjectives[index] = runs[0][0] if previous is None else min(previous, runs[0][0])
+
+					if (self._tolerance is not None and previous is not None and
+						previous - runs[0][0] < self._tolerance):
+						done.append(index)
+
+				self._active = [i for i in self._active if i not in done]
+				self._timings.append((optimizer, perf_counter() - stageStart, self._evaluations - stageEvaluations))
+
+				if (exhausted):
+					break
+		finally:
+			if (executor is not None):
+				executor.shutdown()
+
+			self._elapsed = perf_counter() - self._start
+
+	def _runSerial(self, models, optimizer, maxIters, stage, seeds):
+		""" Runs the restarts of stage model after model. Returns the
+			successful runs of each active model and whether the budget was
+			exhausted
+
+		"""
+		results = []
+
+		for position, index in enumerate(self._active):
+			runs = []
+			restart = 0
+			laterRuns = sum(self._restarts[i] for i in self._active[position + 1:])
+
+			while (restart < self._restarts[index]):
+				iterations = self._iterationCap(maxIters, stage, self._restarts[index] - restart + laterRuns, 1)
+
+				if (iterations < 1):
+					results.append(runs)
+					results.extend([] for _ in self._active[position + 1:])
+					return (results, True)
+
+				seed = None if seeds is None else next(seeds)
+				run = _optimizeRestart((models[index], optimizer, iterations, seed, restart > 0))
+				restart += 1
+
+				if (run is None):
+					continue
+
+				self._record(run)
+				runs.append(run)
+
+				if (self._restartTolerance is not None and len(runs) > 1 and
+					abs(run[0] - min(r[0] for r in runs[:-1])) <= self._restartTolerance):
+					# Restarts agree, skip the rest
+					break
+
+			# Keep seeds of skipped restarts aligned with the parallel order
+			if (seeds is not None):
+				for _ in range(restart, self._numRestarts):
+					next(seeds)
+
+			results.append(runs)
+
+		return (results, False)
+
+	def _runParallel(self, models, optimizer, maxIters, stage, seeds, executor, numWorkers):
+		""" Runs all restarts of stage at once in executor. Returns the
+			successful runs of each active model and whether the budget was
+			exhausted
+
+		"""
+		jobs = []
+		jobModels = []
+
+		for index in self._active:
+			for restart in range(self._numRestarts):
+				seed = next(seeds)
+
+				if (restart < self._restarts[index]):
+					jobs.append((index, seed, restart > 0))
+
+		iterations = self._iterationCap(maxIters, stage, len(jobs), numWorkers)
+		if (iterations < 1):
+			return ([[] for _ in self._active], True)
+
+		jobArgs = [(models[index], optimizer, iterations, seed, randomize) for index, seed, randomize in jobs]
+
+		results = {index:[] for index in self._active}
+		for (index, _, _), run in zip(jobs, executor.map(_optimizeRestart, jobArgs)):
+			if (run is not None):
+				self._record(run)
+				results[index].append(run)
+
+		return ([results[index] for index in self._active], False)
+
+	def _record(self, run):
+		self._evaluations += run[2]
+
+		if (run[2] > 0):
+			self._evaluationTime = run[3] / run[2]
+
+	def _iterationCap(self, maxIters, stage, stageRuns, numWorkers):
+		""" Returns max_iters for the next run(s) of stage, sharing the
+			remaining budget out between the stageRuns runs left in this
+			stage and those planned for later stages. Less than 1 when the
+			budget is exhausted
+
+		"""
+		if (self._timeBudget is None and self._evaluationBudget is None):
+			return maxIters
+
+		plannedRuns = sum(self._restarts[i] for i in self._active)
+		laterStages = len(self._schedule) - stage - 1
+
+		if (self._evaluationBudget is not None):
+			remaining = self._evaluationBudget - self._evaluations
+			maxIters = min(maxIters, remaining // (stageRuns + laterStages * plannedRuns))
+
+		if (self._timeBudget is not None and self._evaluationTime > 0):
+			# Runs execute in rounds of numWorkers concurrent runs
+			rounds = int(np.ceil(stageRuns / numWorkers)) + laterStages * int(np.ceil(plannedRuns / numWorkers))
+			remaining = self._timeBudget - (perf_counter() - self._start)
+			maxIters = min(maxIters, int(remaining / (rounds * self._evaluationTime)))
+
+		return maxIters
+
+	@property
+	def schedule(self):
+		return self._schedule
+
+	@property
+	def timings(self):
+		""" (optimizer, seconds, evaluations) of each stage run by the last
+			optimize call
+
+		"""
+		return self._timings
+
+	@property
+	def elapsed(self):
+		return self._elapsed
+
+	@property
+	def evaluations(self):
+		return self._evaluations
+
 class GPApproximator(VectorFieldApproximator):
 
-	def __init__(self, kernel=None):
+	# Optimizer stages (optimizer, max iterations), each with random restarts
+	_optimizationSchedule = (('tnc', 500), ('lbfgsb', 500), ('scg', 500))
+	_numRestarts = 2
+
+	def __init__(self, kernel=None, numProcesses=1, seed=None, incremental=False, driftThreshold=0.05, policy=None):
+		""" policy (OptimizationPolicy) sets the optimizer schedule, budget
+			and early stopping, by default the schedule below without budget
+
+			numProcesses > 1 (or None for one per core) optimizes the X and Y
+			models and their restarts in parallel worker processes. Setting
+			seed makes the optimization deterministic (also with a single
+			process), independent of the number of processes
+
+			In incremental mode each approximation after the first reuses
+			the previous models as a warm start (see updateModel), only
+			refitting from random restarts if the log likelihood per
+			measurement has degraded by more than driftThreshold
+
+		"""
 		self._measurements = []
+		self._numProcesses = numProcesses
+		self._seed = seed
+		self._incremental = incremental
+		self._driftThreshold = driftThreshold
+		self._lastUpdate = None
+		self._policy = policy
 
 		if (kernel is None):
 			# Default kernel
@@ -56,22 +624,32 @@ class GPApproximator(VectorFieldApproximator):
 		y1 = np.reshape(y1, (len(vX),1))
 		y2 = np.reshape(y2, (len(vY),1))
 
-		meanFuncX = GPy.mappings.Constant(2, 1, np.mean(y1))
-		meanFuncY = GPy.mappings.Constant(2, 1, np.mean(y2))
+		incremental = getattr(self, '_incremental', False)
 
-		self._gpModelX = GPy.models.GPRegression(x, y1, self._Kx, normalizer=True, mean_function=meanFuncX)
-		self._gpModelY = GPy.models.GPRegression(x, y2, self._Ky, normalizer=True, mean_function=meanFuncY)
+		if (incremental and self._gpModelX is not None):
+			self._lastUpdate = (updateModel(self._gpModelX, x, y1, self._driftThreshold),
+								updateModel(self._gpModelY, x, y2, self._driftThreshold))
+
+			models = [model for model, update in zip((self._gpModelX, self._gpModelY), self._lastUpdate)
+					if update == 'refit']
+		else:
+			meanFuncX = GPy.mappings.Constant(2, 1, np.mean(y1))
+			meanFuncY = GPy.mappings.Constant(2, 1, np.mean(y2))
+
+			if (incremental):
+				modelType = IncrementalGPRegression
+			else:
+				modelType = GPy.models.GPRegression
+
+			self._gpModelX = modelType(x, y1, self._Kx, normalizer=True, mean_function=meanFuncX)
+			self._gpModelY = modelType(x, y2, self._Ky, normalizer=True, mean_function=meanFuncY)
+
+			self._lastUpdate = ('refit', 'refit')
+			models = [self._gpModelX, self._gpModelY]
 
 		#print(self._gpModelX)
 		#print(self._gpModelY)
-		self._gpModelX.randomize()
-		self._gpModelY.randomize()
-		self._gpModelX.optimize_restarts(messages=False, optimizer='tnc', robust=True, num_restarts=2, max_iters=500)
-		self._gpModelY.optimize_restarts(messages=False, optimizer='tnc', robust=True, num_restarts=2, max_iters=500)
-		self._gpModelX.optimize_restarts(messages=False, optimizer='lbfgsb', robust=True, num_restarts=2, max_iters=500)
-		self._gpModelY.optimize_restarts(messages=False, optimizer='lbfgsb', robust=True, num_restarts=2, max_iters=500)
-		self._gpModelX.optimize_restarts(messages=False, optimizer='scg', robust=True, num_restarts=2, max_iters=500)
-		self._gpModelY.optimize_restarts(messages=False, optimizer='scg', robust=True, num_restarts=2, max_iters=500)
+		self._optimize(models)
 
 		#print(self._gpModelX)
 		#print(self._gpModelY)
@@ -82,11 +660,56 @@ class GPApproximator(VectorFieldApproximator):
 
 		return vf.fields.VectorField(vfRep)
 
+	def _optimize(self, models):
+		""" Randomizes models and optimizes them with restarts following the
+			optimization policy
+
+		"""
+		if (len(models) < 1):
+			return
+
+		numProcesses = getattr(self, '_numProcesses', 1)
+		seed = getattr(self, '_seed', None)
+
+		self.optimizationPolicy.optimize(models, numProcesses, seed)
+
+	@property
+	def optimizationPolicy(self):
+		if (getattr(self, '_policy', None) is None):
+			self._policy = OptimizationPolicy(self._optimizationSchedule, self._numRestarts)
+
+		return self._policy
+
+	@property
+	def lastUpdate(self):
+		""" How the X and Y models were updated by the last approximation:
+			'kept', 'optimized' or 'refit'
+
+		"""
+		return getattr(self, '_lastUpdate', None)
+
+	@property
+	def updateCounts(self):
+		""" (extended, refactorized) numbers of incremental updates of the
+			X and Y models combined, see IncrementalExactInference
+
+		"""
+		counts = [getattr(model.inference_method, 'updateCounts', (0, 0))
+					for model in (self._gpModelX, self._gpModelY) if model is not None]
+
+		return tuple(int(sum(count)) for count in zip((0, 0), *counts))
+
 class IntegralGPApproximator(VectorFieldApproximator):
 	""" Does not seem to work reliably at the moment
 	"""
-	def __init__(self, kernel=None):
+
+	# Optimizer stages (optimizer, max iterations), each with random restarts
+	_optimizationSchedule = (('lbfgsb', 10000),)
+	_numRestarts = 2
+
+	def __init__(self, kernel=None, policy=None):
 		self._measurements = []
+		self._policy = policy
 
 		if (kernel is None):
 			# Default kernel
@@ -143,11 +766,7 @@ class IntegralGPApproximator(VectorFieldApproximator):
 
 		#print(self._gpModelX)
 		#print(self._gpModelY)
-		self._gpModelX.randomize()
-		self._gpModelY.randomize()
-
-		self._gpModelX.optimize_restarts(messages=False, optimizer='lbfgsb', robust=True, num_restarts=2, max_iters=10000)
-		self._gpModelY.optimize_restarts(messages=False, optimizer='lbfgsb', robust=True, num_restarts=2, max_iters=10000)
+		self.optimizationPolicy.optimize([self._gpModelX, self._gpModelY])
 		#self._gpModelX.optimize_SGD()
 		#self._gpModelY.optimize_SGD()
 		#print(self._gpModelX)
@@ -159,10 +778,187 @@ class IntegralGPApproximator(VectorFieldApproximator):
 
 		return vf.fields.VectorField(vfRep)
 
+	@property
+	def optimizationPolicy(self):
+		if (getattr(self, '_policy', None) is None):
+			self._policy = OptimizationPolicy(self._optimizationSchedule, self._numRestarts)
+
+		return self._policy
+
+def placeInducingInputs(x, method='kmeans', spacing=None, numInducing=100, maxInducing=500, rng=None):
+	""" Places inducing inputs of a sparse GP over the Nx2 inputs x
+
+		Given a spacing (in input units) the count scales with the data
+		extent, one inducing input per spacing x spacing cell of the
+		bounding box of x, otherwise numInducing are placed. The count is
+		limited to maxInducing and the number of distinct inputs. Methods:
+			'kmeans': k-means centroids of the inputs
+			'cells': centers of the spacing sized cells containing inputs,
+				binned like MeasurementProcessor, merged by k-means if
+				there are more than maxInducing
+			'random': random subset of the inputs
+
+		Returns Mx2 array of inducing inputs
+	"""
+	rng = np.random.default_rng(rng)
+	points = np.unique(np.asarray(x, dtype=np.float64).reshape(-1, 2), axis=0)
+	extent = np.ptp(points, axis=0)
+
+	if (spacing is None):
+		count = numInducing
+		spacing = defaultInducingSpacing(points, numInducing)
+	else:
+		count = int(np.prod(np.maximum(np.ceil(extent / spacing), 1)))
+
+	count = max(1, min(count, maxInducing, len(points)))
+
+	if (method == 'cells'):
+		cells = np.unique(np.floor(points / spacing), axis=0)
+		centers = (cells + 0.5) * spacing
+
+		if (len(centers) > maxInducing):
+			centers = _kmeans(centers, maxInducing, rng)
+
+		return centers
+	elif (method == 'random'):
+		return points[rng.choice(len(points), count, replace=False)]
+	elif (method != 'kmeans'):
+		print("Warning: Unknown inducing input placement ", method, ", using k-means")
+
+	return _kmeans(points, count, rng)
+
+def defaultInducingSpacing(x, numInducing=100):
+	""" Side of the square cells of which numInducing cover the bounding
+		box of the Nx2 inputs x
+
+	"""
+	extent = np.ptp(np.asarray(x, dtype=np.float64).reshape(-1, 2), axis=0)
+
+	return np.sqrt(max(np.prod(extent), 1e-12) / numInducing)
+
+def initializeLengthscales(kernel, lengthscale):
+	""" Sets every lengthscale parameter of kernel (and its parts)
+
+	"""
+	for param in kernel.flattened_parameters:
+		if (param.name == 'lengthscale'):
+			param[:] = lengthscale
+
+def _kmeans(points, k, rng, iterations=20):
+	""" Lloyd's k-means of the Nx2 points from k distinct random points,
+		clusters which lose all their points keep their last centroid
+
+	"""
+	centroids = points[rng.choice(len(points), k, replace=False)]
+
+	for _ in range(iterations):
+		labels, _ = vq(points, centroids)
+		counts = np.bincount(labels, minlength=k)
+		occupied = counts > 0
+
+		updated = centroids.copy()
+		for dim in range(points.shape[1]):
+			sums = np.bincount(labels, weights=points[:, dim], minlength=k)
+			updated[occupied, dim] = sums[occupied] / counts[occupied]
+
+		if (np.allclose(updated, centroids)):
+			break
+
+		centroids = updated
+
+	return centroids
+
+def optimizeMiniBatch(model, x, y, batchSize, iterations=2000, learningRate=0.01, rng=None):
+	""" Stochastic variational (SVI) optimization of a GPy SVGP model with
+		Adam on random mini-batches of x, y, so memory and cost per
+		iteration only depend on batchSize and the number of inducing
+		inputs, not the number of measurements. Continues from the current
+		parameters, so it can be called again on new data as a warm start
+
+		The model is left holding the last mini-batch, predictions only
+		depend on the variational posterior and hyperparameters
+
+		Returns the objective on the last mini-batch
+	"""
+	rng = np.random.default_rng(rng)
+	batchSize = min(batchSize, len(x))
+
+	# Scales the mini-batch likelihood to the full data
+	model.X_all, model.Y_all = x, y
+
+	params = model.optimizer_array.copy()
+	firstMoment = np.zeros_like(params)
+	secondMoment = np.zeros_like(params)
+	beta1, beta2, eps = 0.9, 0.999, 1e-8
+
+	for step in range(1, iterations + 1):
+		batch = rng.integers(len(x), size=batchSize)
+		model.set_data(x[batch], y[batch])
+
+		gradient = model._grads(params)
+		firstMoment = beta1 * firstMoment + (1 - beta1) * gradient
+		secondMoment = beta2 * secondMoment + (1 - beta2) * gradient**2
+
+		params -= (learningRate * (firstMoment / (1 - beta1**step)) /
+					(np.sqrt(secondMoment / (1 - beta2**step)) + eps))
+
+	model.optimizer_array = params
+
+	return model.objective_function()
+
 class SparseGPApproximator(VectorFieldApproximator):
 
-	def __init__(self, kernel=None):
+	# Optimizer stages (optimizer, max iterations), each with random restarts
+	_optimizationSchedule = (('lbfgsb', 300), ('scg', 300))
+	_numRestarts = 2
+
+	# Inducing inputs placed without an inducingSpacing
+	_numInducing = 100
+
+	def __init__(self, kernel=None, incremental=False, driftThreshold=0.05, policy=None,
+		inducing='kmeans', inducingSpacing=None, maxInducing=500, optimizeInducing=False,
+		batchSize=None, batchIterations=2000, learningRate=0.01, seed=None):
+		""" policy (OptimizationPolicy) sets the optimizer schedule, budget
+			and early stopping, by default the schedule below without budget
+
+			Inducing inputs are placed by placeInducingInputs with the
+			inducing method ('kmeans', 'cells' or 'random'), or given as an
+			Mx2 array, e.g. MeasurementProcessor.cellCenters(). Given an
+			inducingSpacing the count scales with the extent of the
+			measurements up to maxInducing, otherwise 100 are placed. They
+			are held fixed unless optimizeInducing, random restarts would
+			otherwise scatter them and the optimizer often collapses the
+			model onto the noise. The lengthscales of the default kernel
+			start at the same spacing (see _spacing)
+
+			With a batchSize the models are trained by stochastic
+			variational inference on mini-batches (see optimizeMiniBatch)
+			for batchIterations Adam steps instead of by the policy, so
+			memory and cost per step stay bounded as measurements grow.
+			seed makes placement, restarts and mini-batches deterministic
+
+			In incremental mode each approximation after the first reuses
+			the previous models (including inducing inputs) as a warm start,
+			see GPApproximator. Sparse inference is linear in the number of
+			measurements, so the data is simply replaced. Mini-batch models
+			continue training on the new measurements
+
+		"""
 		self._measurements = []
+		self._incremental = incremental
+		self._driftThreshold = driftThreshold
+		self._lastUpdate = None
+		self._policy = policy
+
+		self._inducing = inducing
+		self._inducingSpacing = inducingSpacing
+		self._maxInducing = maxInducing
+		self._optimizeInducing = optimizeInducing
+		self._batchSize = batchSize
+		self._batchIterations = batchIterations
+		self._learningRate = learningRate
+		self._seed = seed
+		self._defaultKernel = kernel is None
 
 		if (kernel is None):
 			# Default kernel
@@ -214,19 +1010,58 @@ class SparseGPApproximator(VectorFieldApproximator):
 		y2 = np.reshape(y2, (len(vY),1))
 
 
-		self._gpModelX = GPy.models.SparseGPRegression(x, y1, self._Kx, normalizer=True, num_inducing=100)
-		self._gpModelY = GPy.models.SparseGPRegression(x, y2, self._Ky, normalizer=True, num_inducing=100)
+		rng = np.random.default_rng(getattr(self, '_seed', None))
+		batchSize = getattr(self, '_batchSize', None)
+		incremental = getattr(self, '_incremental', False) and self._gpModelX is not None
+		randomize = True
+
+		if (incremental and batchSize is not None):
+			for model, y in ((self._gpModelX, y1), (self._gpModelY, y2)):
+				optimizeMiniBatch(model, x, model.normalizer.normalize(y), batchSize,
+								self._batchIterations, self._learningRate, rng)
+
+			self._lastUpdate = ('optimized', 'optimized')
+			models = []
+		elif (incremental):
+			self._lastUpdate = (updateModel(self._gpModelX, x, y1, self._driftThreshold),
+								updateModel(self._gpModelY, x, y2, self._driftThreshold))
+
+			models = [model for model, update in zip((self._gpModelX, self._gpModelY), self._lastUpdate)
+					if update == 'refit']
+		else:
+			Z = self._inducingInputs(x, rng)
+
+			if (getattr(self, '_defaultKernel', False)):
+				# Default unit lengthscales are far below the extent of a
+				# survey, start from the inducing input spacing instead
+				spacing = self._spacing(x)
+				initializeLengthscales(self._Kx, spacing)
+				initializeLengthscales(self._Ky, spacing)
+
+				# Restart 0 starts from these lengthscales, only the
+				# following restarts are randomized
+				randomize = False
+
+			if (batchSize is None):
+				self._gpModelX = GPy.models.SparseGPRegression(x, y1, self._Kx, Z=Z.copy(), normalizer=True)
+				self._gpModelY = GPy.models.SparseGPRegression(x, y2, self._Ky, Z=Z.copy(), normalizer=True)
+				models = [self._gpModelX, self._gpModelY]
+
+				if (not getattr(self, '_optimizeInducing', True)):
+					for model in models:
+						model.Z.fix()
+			else:
+				self._gpModelX = self._miniBatchModel(x, y1, Z, self._Kx, rng)
+				self._gpModelY = self._miniBatchModel(x, y2, Z, self._Ky, rng)
+				models = []
+
+			self._lastUpdate = ('refit', 'refit')
+
 		#print(self._gpModelX['inducing_inputs'])
 		#print(self._gpModelX)
 		#print(self._gpModelY)
-		self._gpModelX.randomize()
-		self._gpModelY.randomize()
-
-		self._gpModelX.optimize_restarts(messages=False, optimizer='lbfgsb', robust=True, num_restarts=2, max_iters=300)
-		self._gpModelY.optimize_restarts(messages=False, optimizer='lbfgsb', robust=True, num_restarts=2, max_iters=300)
-
-		self._gpModelX.optimize_restarts(messages=False, optimizer='scg', robust=True, num_restarts=2, max_iters=300)
-		self._gpModelY.optimize_restarts(messages=False, optimizer='scg', robust=True, num_restarts=2, max_iters=300)
+		if (len(models) > 0):
+			self.optimizationPolicy.optimize(models, seed=getattr(self, '_seed', None), randomize=randomize)
 
 		#print(self._gpModelX)
 		#print(self._gpModelY)
@@ -237,11 +1072,74 @@ class SparseGPApproximator(VectorFieldApproximator):
 
 		return vf.fields.VectorField(vfRep)
 
+	def _inducingInputs(self, x, rng):
+		inducing = getattr(self, '_inducing', 'random')
+
+		if (not isinstance(inducing, str)):
+			return np.asarray(inducing, dtype=np.float64).reshape(-1, 2)
+
+		return placeInducingInputs(x, inducing, getattr(self, '_inducingSpacing', None),
+									numInducing=self._numInducing, maxInducing=getattr(self, '_maxInducing', 500), rng=rng)
+
+	def _spacing(self, x):
+		""" Spacing of the inducing inputs, inducingSpacing if set, else
+			that placeInducingInputs derives for the number of inducing
+			inputs (given ones or the default count)
+
+		"""
+		spacing = getattr(self, '_inducingSpacing', None)
+
+		if (spacing is not None):
+			return spacing
+
+		inducing = getattr(self, '_inducing', 'random')
+		if (not isinstance(inducing, str)):
+			return defaultInducingSpacing(x, len(np.asarray(inducing).reshape(-1, 2)))
+
+		return defaultInducingSpacing(x, self._numInducing)
+
+	def _miniBatchModel(self, x, y, Z, kernel, rng):
+		""" Builds an SVGP model on standardized y and trains it on mini-batches
+
+		"""
+		normalizer = GPy.util.normalizer.Standardize()
+		normalizer.scale_by(y)
+		yNormalized = normalizer.normalize(y)
+
+		# Starts from a mini-batch, optimizeMiniBatch swaps in the others
+		batch = rng.integers(len(x), size=min(self._batchSize, len(x)))
+		model = GPy.core.SVGP(x[batch], yNormalized[batch], Z.copy(), kernel, GPy.likelihoods.Gaussian())
+		model.normalizer = normalizer
+
+		if (not self._optimizeInducing):
+			model.Z.fix()
+
+		optimizeMiniBatch(model, x, yNormalized, self._batchSize, self._batchIterations,
+						self._learningRate, rng)
+
+		return model
+
+	@property
+	def optimizationPolicy(self):
+		if (getattr(self, '_policy', None) is None):
+			self._policy = OptimizationPolicy(self._optimizationSchedule, self._numRestarts)
+
+		return self._policy
+
+	@property
+	def lastUpdate(self):
+		return getattr(self, '_lastUpdate', None)
+
 
 class CoregionalizedGPApproximator(VectorFieldApproximator):
 
-	def __init__(self):
+	# Optimizer stages (optimizer, max iterations), each with random restarts
+	_optimizationSchedule = (('lbfgsb', 300), ('scg', 300))
+	_numRestarts = 1
+
+	def __init__(self, policy=None):
 		self._measurements = []
+		self._policy = policy
 
 
 		# Bias Kernel
@@ -309,9 +1207,174 @@ class CoregionalizedGPApproximator(VectorFieldApproximator):
 
 		#print(self._gpModel)
 
-		self._gpModel.optimize_restarts(num_restarts=1, robust=True, max_iters=300, optimizer='lbfgsb')
-		self._gpModel.optimize_restarts(num_restarts=1, robust=True, max_iters=300, optimizer='scg')
+		# Already randomized before constraints were set
+		self.optimizationPolicy.optimize([self._gpModel], randomize=False)
 		#print(self._gpModel)
 		vfRep = vf.gp_representation.CoregionalizedGPFieldRepresentation(self._gpModel, fieldExtents)
 
-		return vf.fields.VectorField(vfRep)
\ No newline at end of file
+		return vf.fields.VectorField(vfRep)
+
+	@property
+	def optimizationPolicy(self):
+		if (getattr(self, '_policy', None) is None):
+			self._policy = OptimizationPolicy(self._optimizationSchedule, self._numRestarts)
+
+		return self._policy
+
+def _fitTile(job):
+	""" Fits the local approximator of one tile. Defined at module level so
+		it can be sent to worker processes
+
+		Returns the field representation of the tile, None if fitting failed
+	"""
+	approximatorFactory, measurements, tileExtents = job
+
+	approximator = approximatorFactory()
+	approximator.addMeasurements(measurements)
+
+	try:
+		field = approximator.approximate(tileExtents)
+	except Exception as e:
+		print("Warning: Tile fit failed ", e)
+		return None
+
+	if (field is None):
+		return None
+
+	return field.representation
+
+class PartitionedGPApproximator(VectorFieldApproximator):
+	""" Approximates the field by independent local GPs on overlapping tiles
+		of the field extents, blended by partition of unity weights (see
+		PartitionedVectorFieldRepresentation)
+
+		Each local GP only sees the measurements on its tile, so fitting
+		costs O(N^3 / T^2) over T tiles instead of O(N^3) and predictions
+		only involve the tiles containing the query point
+
+	"""
+
+	def __init__(self, tiles=(2, 2), tileSize=None, overlap=0.25, approximatorFactory=GPApproximator,
+		minMeasurements=20, numProcesses=1):
+		""" The extents are split into tiles (xCount, yCount) of equal size
+			or, given a tileSize (in field units), into as many as needed
+			for tiles no larger than tileSize. Tiles are grown by overlap
+			(fraction of the tile size) across each edge shared with a
+			neighbour, the local GP of a tile is fit to the measurements on
+			the grown tile
+
+			approximatorFactory is called without arguments to build the
+			approximator of each tile, e.g. functools.partial(GPApproximator,
+			seed=1), and must be picklable if numProcesses != 1. Tiles with
+			fewer than minMeasurements are fit to the minMeasurements
+			closest to the tile center instead. numProcesses > 1 (or None
+			for one per core) fits tiles in parallel worker processes
+
+		"""
+		self._measurements = []
+		self._tiles = tiles
+		self._tileSize = tileSize
+		self._overlap = overlap
+		self._approximatorFactory = approximatorFactory
+		self._minMeasurements = minMeasurements
+		self._numProcesses = numProcesses
+
+	def addMeasurement(self, measurement):
+		super().addMeasurement(measurement)
+
+	def addMeasurements(self, measurements):
+		super().addMeasurements(measurements)
+
+	def clearMeasurements(self):
+		super().clearMeasurements()
+
+	def approximate(self, fieldExtents=None):
+		""" Tiles fieldExtents, by default the bounding box of the
+			measurements, the field is undefined outside of it
+
+		"""
+		if (len(self._measurements) < 1):
+			print("No Measurements Available")
+			return None
+
+		print("Processing ", len(self._measurements), " Measurements")
+
+		points = np.asarray([m.point for m in self._measurements], dtype=np.float64)
+
+		if (fieldExtents is None or fieldExtents.xRange is None):
+			xMin, yMin = points.min(axis=0)
+			xMax, yMax = points.max(axis=0)
+			fieldExtents = vf.extents.FieldExtents((float(xMin), float(xMax)), (float(yMin), float(yMax)))
+
+		jobs = []
+		tiles = []
+
+		for tileExtents, taper, grownExtents in self._partition(fieldExtents):
+			selected = np.flatnonzero(grownExtents.containPoints(points))
+
+			if (len(selected) < self._minMeasurements):
+				print("Warning: Tile ", tileExtents.xRange, tileExtents.yRange, " only contains ",
+						len(selected), " measurements, using closest ", self._minMeasurements)
+
+				center = (np.mean(tileExtents.xRange), np.mean(tileExtents.yRange))
+				distances = np.hypot(points[:, 0] - center[0], points[:, 1] - center[1])
+				selected = np.argsort(distances, kind='stable')[:self._minMeasurements]
+
+			jobs.append((self._approximatorFactory, [self._measurements[i] for i in selected], grownExtents))
+			tiles.append((grownExtents, taper))
+
+		if (self._numProcesses == 1):
+			tileFields = [_fitTile(job) for job in jobs]
+		else:
+			with ProcessPoolExecutor(max_workers=self._numProcesses) as executor:
+				tileFields = list(executor.map(_fitTile, jobs))
+
+		fittedTiles = []
+		for (grownExtents, taper), tileField in zip(tiles, tileFields):
+			if (tileField is None):
+				print("Warning: Tile ", grownExtents.xRange, grownExtents.yRange, " could not be fit")
+				continue
+
+			fittedTiles.append((grownExtents, taper, tileField))
+
+		vfRep = vf.partition_representation.PartitionedVectorFieldRepresentation(fittedTiles, fieldExtents)
+
+		return vf.fields.VectorField(vfRep)
+
+	def _partition(self, fieldExtents):
+		""" Splits fieldExtents into tiles with xSplit and ySplit, returns
+			(tileExtents, taper, grownExtents) of each tile
+
+		"""
+		(xMin, xMax), (yMin, yMax) = fieldExtents.xRange, fieldExtents.yRange
+
+		if (self._tileSize is None):
+			xCount, yCount = self._tiles
+		else:
+			xCount = int(np.ceil(fieldExtents.xDist / self._tileSize))
+			yCount = int(np.ceil(fieldExtents.yDist / self._tileSize))
+
+		xCount = max(1, xCount)
+		yCount = max(1, yCount)
+
+		xAxes = [xMin + fieldExtents.xDist * i / xCount for i in range(1, xCount)]
+		yAxes = [yMin + fieldExtents.yDist * j / yCount for j in range(1, yCount)]
+
+		partition = []
+
+		for column in fieldExtents.xSplit(*xAxes):
+			for tileExtents in column.ySplit(*yAxes):
+				(x0, x1), (y0, y1) = tileExtents.xRange, tileExtents.yRange
+				xOverlap = self._overlap * tileExtents.xDist
+				yOverlap = self._overlap * tileExtents.yDist
+
+				# Only edges shared with a neighbouring tile are grown and tapered
+				grow = (xOverlap * (x0 > xMin), xOverlap * (x1 < xMax),
+						yOverlap * (y0 > yMin), yOverlap * (y1 < yMax))
+
+				grownExtents = vf.extents.FieldExtents((x0 - grow[0], x1 + grow[1]), (y0 - grow[2], y1 + grow[3]))
+				taper = tuple(2.0 * g for g in grow)
+
+				partition.append((tileExtents, taper, grownExtents))
+
+		return partition
@@ -1,19 +1,578 @@
 import yaml
 import os
 import glob
+import pickle
+import shutil
 import cv2
+import numpy as np
+
+from queue import Queue, Empty, Full
+from threading import Thread, Condition, Semaphore
+from time import perf_counter
+
+class PrefetchingReader(object):
+	""" Decodes a sequence of image files ahead of the consumer on a pool of
+		decoder threads and delivers them in order
+
+		At most bufferSize frames are decoded or being decoded ahead of the
+		consumer; decoder threads block (without spinning) until the
+		consumer frees a slot. Files which fail to decode are skipped (and
+		counted in framesSkipped). read returns None (the end of dataset
+		sentinel) once all frames have been delivered or the reader has
+		been stopped.
+
+	"""
+
+	def __init__(self, fileNames, numThreads=2, bufferSize=128, decoder=cv2.imread):
+		self._fileNames = list(fileNames)
+		self._decoder = decoder
+		self._numThreads = max(1, numThreads)
+
+		# Each slot is one frame decoded or in flight but not yet read
+		self._slots = Semaphore(max(1, bufferSize))
+		self._condition = Condition()
+		self._decoded = {}
+
+		self._nextDecodeIndex = 0
+		self._nextReadIndex = 0
+		self._stopped = False
+		self._threads = []
+
+		# Counters
+		self._framesDecoded = 0
+		self._totalDecodeTime = 0.0
+		self._maxDecodeTime = 0.0
+		self._totalWaitTime = 0.0
+		self._maxQueueDepth = 0
+		self._framesSkipped = 0
+
+	def start(self):
+		if (len(self._threads) > 0):
+			return
+
+		for _ in range(self._numThreads):
+			thread = Thread(target=self._decodeLoop, args=())
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	def read(self):
+		""" Returns the next frame in order, blocking until it is decoded.
+			Frames which could not be decoded are skipped. Returns None at
+			the end of the sequence
+
+		"""
+		img = None
+
+		while (img is None):
+			with self._condition:
+				index = self._nextReadIndex
+
+				if (index >= len(self._fileNames)):
+					return None
+
+				waitStart = perf_counter()
+				while (index not in self._decoded and not self._stopped):
+					self._condition.wait()
+				self._totalWaitTime += perf_counter() - waitStart
+
+				if (index not in self._decoded):
+					# Stopped before this frame was decoded
+					return None
+
+				img = self._decoded.pop(index)
+				self._nextReadIndex += 1
+
+				if (img is None):
+					self._framesSkipped += 1
+
+			self._slots.release()
+
+		return img
+
+	def __iter__(self):
+		img = self.read()
+
+		while (img is not None):
+			yield img
+			img = self.read()
+
+	def stop(self):
+		""" Stops decoding, frames not yet read are discarded
+
+		"""
+		with self._condition:
+			self._stopped = True
+			self._decoded.clear()
+			self._condition.notify_all()
+
+		# Wake decoders blocked waiting for a free slot
+		for _ in self._threads:
+			self._slots.release()
+
+	def close(self):
+		""" Stops decoding and waits for decoder threads to exit
+
+		"""
+		self.stop()
+
+		for thread in self._threads:
+			thread.join()
+
+		self._threads = []
+
+	def _decodeLoop(self):
+		while True:
+			self._slots.acquire()
+
+			with self._condition:
+				if (self._stopped or self._nextDecodeIndex >= len(self._fileNames)):
+					# Pass the slot on to any other waiting decoder
+					self._slots.release()
+					return
+
+				index = self._nextDecodeIndex
+				self._nextDecodeIndex += 1
+
+			decodeStart = perf_counter()
+			img = self._decoder(self._fileNames[index])
+			decodeTime = perf_counter() - decodeStart
+
+			if (img is None):
+				print("Error: Could not decode ", self._fileNames[index])
+
+			with self._condition:
+				if (self._stopped):
+					return
+
+				self._decoded[index] = img
+				self._framesDecoded += 1
+				self._totalDecodeTime += decodeTime
+				self._maxDecodeTime = max(self._maxDecodeTime, decodeTime)
+				self._maxQueueDepth = max(self._maxQueueDepth, len(self._decoded))
+				self._condition.notify_all()
+
+	@property
+	def queueDepth(self):
+		""" Number of decoded frames waiting to be read
+
+		"""
+		return len(self._decoded)
+
+	@property
+	def maxQueueDepth(self):
+		return self._maxQueueDepth
+
+	@property
+	def framesDecoded(self):
+		return self._framesDecoded
+
+	@property
+	def framesSkipped(self):
+		""" Number of files read past because they could not be decoded
+
+		"""
+		return self._framesSkipped
+
+	@property
+	def framesRead(self):
+		""" Number of files consumed by read, including skipped ones
+
+		"""
+		return self._nextReadIndex
+
+	@property
+	def meanDecodeLatency(self):
+		if (self._framesDecoded < 1):
+			return 0.0
+
+		return self._totalDecodeTime / self._framesDecoded
+
+	@property
+	def maxDecodeLatency(self):
+		return self._maxDecodeTime
+
+	@property
+	def readWaitTime(self):
+		""" Total time the consumer spent blocked waiting for frames
+
+		"""
+		return self._totalWaitTime
+
+
+class VideoFrameSource(object):
+	""" Decodes frames straight from a video file on a background thread
+
+		Frames are delivered as (timestamp, frame) tuples, timestamp being
+		the container presentation time in seconds. Backends which do not
+		report presentation times fall back to frameIndex / fps. read
+		returns None (the end of dataset sentinel) after frame end - 1 or
+		once the source has been stopped.
+
+	"""
+
+	def __init__(self, fileName, start=0, end=None, bufferSize=128):
+		self._fileName = fileName
+		self._startFrame = start
+		self._endFrame = end
+
+		self._queue = Queue(maxsize=max(1, bufferSize))
+		self._stopped = False
+		self._finished = False
+		self._thread = None
+		self._capture = None
+
+		self._fps = 0.0
+		self._frameCount = 0
+
+		# Counters
+		self._framesDecoded = 0
+		self._totalDecodeTime = 0.0
+		self._maxDecodeTime = 0.0
+		self._maxQueueDepth = 0
+
+	def start(self):
+		""" Opens the video, seeks to the start frame and starts decoding
+
+		"""
+		if (self._thread is not None):
+			return True
+
+		self._capture = cv2.VideoCapture(self._fileName)
+
+		if (not self._capture.isOpened()):
+			print("Error: Could not open video ", self._fileName)
+			return False
+
+		self._fps = self._capture.get(cv2.CAP_PROP_FPS)
+		self._frameCount = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+		# Frame count is unknown (0) for some containers, decode to the end
+		if (self._frameCount > 0 and (self._endFrame is None or self._endFrame > self._frameCount)):
+			self._endFrame = self._frameCount
+
+		self._seek(self._startFrame)
+
+		self._thread = Thread(target=self._decodeLoop, args=())
+		self._thread.daemon = True
+		self._thread.start()
+
+		return True
+
+	def _seek(self, frameIndex):
+		""" Positions the capture at frameIndex before decoding starts
+
+		"""
+		if (frameIndex < 1):
+			return
+
+		if (not self._capture.set(cv2.CAP_PROP_POS_FRAMES, frameIndex)):
+			# Backend cannot seek, skip frames without decoding them
+			for _ in range(frameIndex):
+				if (not self._capture.grab()):
+					break
+
+	def read(self):
+		""" Returns next (timestamp, frame), blocking until it is decoded.
+			Returns None at the end of the video
+
+		"""
+		if (self._thread is None):
+			print("Error: Video source must be started before reading")
+			return None
+
+		if (self._stopped or self._finished):
+			return None
+
+		item = self._queue.get()
+
+		if (item is None):
+			# Sentinel is only queued once, later reads return it directly
+			self._finished = True
+
+		return None if self._stopped else item
+
+	def __iter__(self):
+		item = self.read()
+
+		while (item is not None):
+			yield item
+			item = self.read()
+
+	def stop(self):
+		""" Stops decoding, frames not yet read are discarded
+
+		"""
+		self._stopped = True
+		self._drain()
+
+		# Release a reader blocked on an empty queue
+		try:
+			self._queue.put_nowait(None)
+		except Full:
+			pass
+
+	def close(self):
+		""" Stops decoding, waits for the decoding thread and releases the video
+
+		"""
+		self.stop()
+
+		if (self._thread is not None):
+			# Keep draining in case the decoder refilled the buffer after stop
+			while (self._thread.is_alive()):
+				self._drain()
+				self._thread.join(0.05)
+
+		if (self._capture is not None):
+			self._capture.release()
+			self._capture = None
+
+	def _drain(self):
+		try:
+			while True:
+				self._queue.get_nowait()
+		except Empty:
+			pass
+
+	def _decodeLoop(self):
+		frameIndex = self._startFrame
+		prevTimestamp = None
+
+		while (not self._stopped and (self._endFrame is None or frameIndex < self._endFrame)):
+			decodeStart = perf_counter()
+			ok, frame = self._capture.read()
+			decodeTime = perf_counter() - decodeStart
+
+			if (not ok):
+				break
+
+			timestamp = self._capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+			# Some backends do not report presentation times
+			if (prevTimestamp is not None and timestamp <= prevTimestamp and self._fps > 0):
+				timestamp = frameIndex / self._fps
+
+			prevTimestamp = timestamp
+			frameIndex += 1
+
+			self._framesDecoded += 1
+			self._totalDecodeTime += decodeTime
+			self._maxDecodeTime = max(self._maxDecodeTime, decodeTime)
+
+			# Blocks while the buffer is full, stop drains it to unblock
+			self._queue.put((timestamp, frame))
+			self._maxQueueDepth = max(self._maxQueueDepth, self._queue.qsize())
+
+		if (not self._stopped):
+			# End of video sentinel
+			self._queue.put(None)
+
+	@property
+	def fps(self):
+		return self._fps
+
+	@property
+	def frameCount(self):
+		return self._frameCount
+
+	@property
+	def endFrame(self):
+		return self._endFrame
+
+	@property
+	def queueDepth(self):
+		return self._queue.qsize()
+
+	@property
+	def maxQueueDepth(self):
+		return self._maxQueueDepth
+
+	@property
+	def framesDecoded(self):
+		return self._framesDecoded
+
+	@property
+	def meanDecodeLatency(self):
+		if (self._framesDecoded < 1):
+			return 0.0
+
+		return self._totalDecodeTime / self._framesDecoded
+
+	@property
+	def maxDecodeLatency(self):
+		return self._maxDecodeTime
+
+
+class FrameCache(object):
+	""" On-disk cache of preprocessed frames in a single memory mapped uint8
+		array of shape (numFrames, height, width) stored as fileName (.npy)
+
+		The index (frame timestamps and the parameters the cache was built
+		with) is pickled alongside it in fileName.meta. Frames are returned
+		as read-only views into the memory map, so repeated passes over a
+		dataset neither decode nor copy them.
+
+	"""
+
+	def __init__(self, fileName):
+		self._fileName = fileName
+
+		with open(fileName + '.meta', 'rb') as f:
+			self._index = pickle.load(f)
+
+		self._frames = np.load(fileName, mmap_mode='r')
+
+	@classmethod
+	def build(cls, fileName, images, numFrames, transform=None, scale=1.0, key=None):
+		""" Preprocesses images and writes them to a new cache
+
+		Args:
+			fileName (string): path of the .npy file to create
+			images (iterable): BGR frames, or (timestamp, frame) tuples
+			numFrames (int): maximum number of frames to store, None (or not
+				positive) if unknown to store all frames of images
+			transform (func): applied to each BGR frame first (e.g. undistortion)
+			scale (double): downscale factor applied after grayscale conversion
+			key: identifies the source and preprocessing, checked by matches
+
+		"""
+		# Without a frame count the memory map cannot be sized up front,
+		# frames are streamed to a raw file and wrapped in a .npy at the end
+		unknownCount = numFrames is None or numFrames < 1
+
+		frames = None
+		rawFile = None
+		frameShape = None
+		timestamps = []
+		count = 0
+
+		for item in images:
+			if (not unknownCount and count >= numFrames):
+				break
+
+			if (isinstance(item, tuple)):
+				timestamp, img = item
+			else:
+				timestamp, img = np.nan, item
+
+			img = cls._preprocess(img, transform, scale)
+
+			if (unknownCount):
+				if (rawFile is None):
+					rawFile = open(fileName + '.part', 'wb')
+					frameShape = img.shape
+
+				rawFile.write(np.ascontiguousarray(img, dtype=np.uint8).tobytes())
+			else:
+				if (frames is None):
+					frames = np.lib.format.open_memmap(fileName, mode='w+', dtype=np.uint8,
+						shape=(numFrames,) + img.shape)
+
+				frames[count] = img
+
+			timestamps.append(timestamp)
+			count += 1
+
+		if (count < 1):
+			print("Error: No frames to cache")
+			return None
+
+		if (unknownCount):
+			rawFile.close()
+			cls._wrapRaw(fileName, (count,) + frameShape)
+		else:
+			frames.flush()
+			del frames
+
+		index = {'count':count, 'timestamps':np.array(timestamps, dtype=np.float64), 'scale':scale, 'key':key}
+
+		with open(fileName + '.meta', 'wb') as f:
+			pickle.dump(index, f)
+
+		return cls(fileName)
+
+	@staticmethod
+	def _wrapRaw(fileName, shape):
+		""" Writes fileName as a .npy of the uint8 frames streamed to
+			fileName.part, then removes the raw file
+
+		"""
+		header = {'descr':np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+			'fortran_order':False, 'shape':shape}
+
+		with open(fileName, 'wb') as f, open(fileName + '.part', 'rb') as raw:
+			np.lib.format.write_array_header_1_0(f, header)
+			shutil.copyfileobj(raw, f)
+
+		os.remove(fileName + '.part')
+
+	@staticmethod
+	def _preprocess(img, transform, scale):
+		if (transform is not None):
+			img = transform(img)
+
+		if (img.ndim == 3):
+			img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+		if (scale != 1.0):
+			img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+		return img
+
+	def matches(self, scale=1.0, key=None):
+		return self._index['scale'] == scale and self._index['key'] == key
+
+	def frame(self, index):
+		""" Returns read-only view of cached frame at index
+
+		"""
+		if (index < 0):
+			index += len(self)
+
+		if (index < 0 or index >= len(self)):
+			raise IndexError('Frame index out of range of cache')
+
+		return self._frames[index]
+
+	def timestamp(self, index):
+		""" Timestamp of frame at index, nan if the source had no timestamps
+
+		"""
+		return self._index['timestamps'][index]
+
+	def __len__(self):
+		return self._index['count']
+
+	def __getitem__(self, index):
+		return self.frame(index)
+
+	def __iter__(self):
+		for index in range(len(self)):
+			yield self._frames[index]
+
+	@property
+	def fileName(self):
+		return self._fileName
+
+	@property
+	def timestamps(self):
+		return self._index['timestamps']
+
+	@property
+	def shape(self):
+		return self._frames.shape[1:]
 
-from queue import Queue
-from threading import Thread
 
 class Dataset(yaml.YAMLObject):
 	""" Object representing a dataset
 
-		self._location: Location of dataset on disk
+		self._location: Location of dataset on disk, a directory of frame
+			images or a video file
 		self._startFrame: First frame of dataset
 		self._endFrame: Last frame of dataset
 		self._currFrameIndex: Current frame that will be read
-		self._bufferFrameIndex: Next frame to load into buffer
+		self._reader: Prefetching reader decoding frames ahead of read
 
 	"""
 	yaml_tag = '!LSPIV_Dataset'
@@ -23,7 +582,7 @@ class Dataset(yaml.YAMLObject):
 		with open(file, mode='r') as f:
 			return yaml.load(f)
 
-	def __init__(self, location=None, start=0, end=0, cam=None):
+	def __init__(self, location=None, start=0, end=0, cam=None, decoderThreads=2, bufferSize=128):
 		# Location of dataset on disk
 		self._location = location
 
@@ -42,18 +601,14 @@ class Dataset(yaml.YAMLObject):
 		# Init frame index to dataset start frame
 		self._currFrameIndex = start
 
-		# Init buffer frame index to start frame
-		self._bufferFrameIndex = start
+		# Frames are decoded ahead of read once the dataset is loaded
+		self._decoderThreads = decoderThreads
+		self._bufferSize = bufferSize
+		self._reader = None
+		self._timestamp = None
 
-		# Set image buffering to stopped
-		self._bufferThreadStopped = True
-
-		# Init image buffer
-		self._imgBuffer = Queue(maxsize=128)
-
-		# Setup buffering thread
-		self._bufferingThread = Thread(target=self._bufferUpdate, args=())
-		self._bufferingThread.daemon = True
+		# Optional memory mapped cache of preprocessed frames
+		self._cache = None
 
 	def save(self, filename):
 		with open(filename, 'w') as f:
@@ -63,14 +618,46 @@ class Dataset(yaml.YAMLObject):
 		return self._currFrameIndex < self._endFrame
 
 	def read(self):
-		print("reading image")
-		self._currFrameIndex += 1
-		return self._imgBuffer.get()
+		""" Returns the next frame, None at the end of the dataset
+
+		"""
+		if (self._reader is None):
+			print("Error: Dataset must be loaded before reading")
+			return None
+
+		img = self._reader.read()
+
+		if (self._isVideo()):
+			if (img is not None):
+				# Video frames carry their container timestamp
+				self._timestamp, img = img
+				self._currFrameIndex += 1
+		else:
+			# Frames skipped by the reader (undecodable files) count as read
+			self._currFrameIndex = self._startFrame + self._reader.framesRead
+
+		return img
+
+	def __iter__(self):
+		img = self.read()
+
+		while (img is not None):
+			yield img
+			img = self.read()
+
+	def stop(self):
+		if (self._reader is not None):
+			self._reader.stop()
+
+	def close(self):
+		if (self._reader is not None):
+			self._reader.close()
+			self._reader = None
 
 	def load(self):
 		""" Load bulky components of dataset
 
-			Loads image file names, start image buffer, etc
+			Loads image file names (or opens video), start image buffer, etc
 		"""
 
 		# Check if dataset location exists
@@ -78,6 +665,19 @@ class Dataset(yaml.YAMLObject):
 			print("Error: Dataset location does not exist")
 			return
 
+		self._currFrameIndex = self._startFrame
+
+		if (self._isVideo()):
+			# Decode straight from the video file, start and end frames are
+			# handled by seeking
+			end = self._endFrame if self._endFrame > 0 else None
+			self._reader = VideoFrameSource(self._location, self._startFrame, end,
+				bufferSize=self._bufferSize)
+
+			if (self._reader.start() and self._reader.endFrame is not None):
+				self._endFrame = self._reader.endFrame
+			return
+
 		self._frames = sorted(glob.glob(self._location + '/frame*.jpg'))
 
 		# Check if startFrame is beyond dataset bounds
@@ -88,30 +688,81 @@ class Dataset(yaml.YAMLObject):
 		# Check if endFrame is beyond dataset bounds
 		if (self._endFrame > len(self._frames)):
 			print("Warning: End frame beyond dataset bounds, setting to end of dataset")
+			self._endFrame = len(self._frames)
 
-		# Start buffering threads
-		self._bufferThreadStopped = False
-		self._bufferingThread.start()
+		# Start decoder threads
+		self._reader = PrefetchingReader(self._frames[self._startFrame:self._endFrame],
+			numThreads=self._decoderThreads, bufferSize=self._bufferSize)
+		self._reader.start()
 
+	def useCache(self, fileName, transform=None, scale=1.0, transformKey=None):
+		""" Backs frame(i) with a memory mapped cache of grayscale frames,
+			building it from the dataset if it does not exist yet or was
+			built from a different dataset range, scale or transformKey
 
-	def _bufferUpdate(self):
-		while True:
-			if (self._bufferThreadStopped):
-				return
-
-			if (not self._imgBuffer.full()):
-				# Load next image into buffer
-				print("loading img into buffer")
-				img = cv2.imread(self._frames[self._bufferFrameIndex])
-				self._imgBuffer.put(img)
-
-				if (self._bufferFrameIndex >= self._endFrame):
-					# Reached end of dataset, stop buffering
-					self._bufferThreadStopped = True
-				else:
-					self._bufferFrameIndex += 1
-			else:
-				print("buffer full")
+		Args:
+			fileName (string): cache file (.npy)
+			transform (func): applied to each frame before caching (e.g.
+				FrameTransformation.transformImg for undistorted frames)
+			scale (double): downscale factor of the cached frames
+			transformKey: identifies transform (e.g. calibration file name)
+
+		"""
+		key = (self._location, self._startFrame, self._endFrame, transformKey)
+
+		if (os.path.exists(fileName) and os.path.exists(fileName + '.meta')):
+			cache = FrameCache(fileName)
+
+			if (cache.matches(scale, key)):
+				self._cache = cache
+				return cache
+
+			print("Warning: Frame cache does not match dataset, rebuilding")
+
+		# Cache is built from a fresh pass over the whole dataset range
+		self.close()
+		self.load()
+
+		if (self._reader is None):
+			return None
+
+		# Frame count of some videos is unknown, cache them to the end
+		numFrames = self._endFrame - self._startFrame if self._endFrame > self._startFrame else None
+		self._cache = FrameCache.build(fileName, self._reader, numFrames, transform, scale, key)
+
+		self.close()
+
+		return self._cache
+
+	def frame(self, index):
+		""" Random access, zero copy view of cached frame index (relative to
+			the dataset start frame). Requires useCache
+
+		"""
+		if (self._cache is None):
+			print("Error: Dataset frame cache has not been set up, call useCache")
+			return None
+
+		return self._cache.frame(index)
+
+	@property
+	def cache(self):
+		return self._cache
+
+	def _isVideo(self):
+		return self._location is not None and os.path.isfile(self._location)
+
+	@property
+	def timestamp(self):
+		""" Container timestamp of the last frame read from a video dataset,
+			None for image datasets
+
+		"""
+		return self._timestamp
+
+	@property
+	def reader(self):
+		return self._reader
 
 	def construct(self, location, cam, start=0, end=None):
 		print("Constructing")
@@ -149,6 +149,8 @@ class OverlayFieldView(object):
 		self._clim = None
 		self._annotation = ""
 
+		self._showUncertainty = False
+
 	def updateImage(self, img):
 		self._img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 		self._img = np.flipud(self._img)
@@ -166,6 +168,12 @@ class OverlayFieldView(object):
 	def setAnnotation(self, text):
 		self._annotation = text
 
+	def setShowUncertainty(self, show):
+		""" Shade the standard deviation of the field under the quiver plot
+
+		"""
+		self._showUncertainty = show
+
 	def quiver(self):
 		if (self._field is None or self._grid is None):
 			return
@@ -182,9 +190,15 @@ class OverlayFieldView(object):
 		#self._ax.grid(True)
 
 		xGrid, yGrid = self._grid.mgrid
-		xSamples, ySamples = self._field.sampleAtGrid(xGrid, yGrid)
+
+		# Mean and variance come from a single batched prediction
+		xSamples, ySamples, xVar, yVar = self._field.predictAtGrid(xGrid, yGrid)
 		magnitudes = np.sqrt(xSamples**2 + ySamples**2)
 
+		if (self._showUncertainty):
+			stdDev = np.sqrt(xVar + yVar)
+			self._ax.contourf(xGrid, yGrid, stdDev, alpha=0.4, cmap=plt.cm.gray)
+
 		if (self._clim is None):
 			self._clim = [magnitudes.min(), magnitudes.max()]
 
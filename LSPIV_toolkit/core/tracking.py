@@ -1,26 +1,38 @@
 import numpy as np
 
+from time import time as currentTime
+
 from .utils import Measurement
 
 class Track(object):
-	""" Represents a single particle/point on an object tracked over some 
+	""" Represents a single particle/point on an object tracked over some
 		period of time. Can be used to produce vector field measurements
 
-		self._positions holds particle locations in 2-Space
+		self._positions holds particle locations in 2-Space, as rows of a
+		growable Nx2 buffer of which only the first self._count rows are valid
 		self._times holds the times the particle was seen at the location
 
 	"""
 
-	def __init__(self, position=None, time=None):
-		self._positions = []
-		self._times = []
+	_initialCapacity = 8
+
+	def __init__(self, position=None, time=None, trackId=None):
+		self._positions = np.empty((self._initialCapacity, 2), dtype=np.float64)
+		self._times = np.empty(self._initialCapacity, dtype=np.float64)
+		self._count = 0
+
+		# Incremented on every change, used to invalidate cached measurements
+		self._version = 0
+		self._measurementCache = None
+
+		# Number of observations already emitted in incremental mode
+		self._emittedCount = 0
+
+		# Id of the tracked feature, set for tracks materialized from a TrackStore
+		self._trackId = trackId
 
 		if (position is not None):
-			self._positions.append(position)
-			if (time is None):
-				self._times.append(time.time())
-			else:
-				self._times.append(time)
+			self.addObservation(position, time)
 
 	def __getitem__(self, index):
 		""" Overrides [] operator to return the observation at index
@@ -29,97 +41,154 @@ class Track(object):
 			(time, position) where position is (x,y) tuple
 
 		"""
-		if (index >= len(self._positions)):
+		if (index < 0):
+			index += self._count
+
+		if (index < 0 or index >= self._count):
 			# Index out of bounds
 			return None
 
-		return (self._times[index], self._positions[index])
+		return (self._times[index], tuple(self._positions[index]))
 
 	def addObservation(self, position, time=None):
 		if (time is None):
-			time = time.time()
+			time = currentTime()
+
+		self._reserve(self._count + 1)
 
-		self._positions.append(position)
-		self._times.append(time)
+		self._positions[self._count] = position
+		self._times[self._count] = time
+		self._count += 1
+		self._version += 1
 
 	def addObservations(self, position, time):
-		self._positions.extend(position)
-		self._times.extend(time)
+		positions = np.asarray(position, dtype=np.float64).reshape(-1, 2)
+		times = np.asarray(time, dtype=np.float64).reshape(-1)
+		numAdded = len(positions)
+
+		self._reserve(self._count + numAdded)
+
+		self._positions[self._count:self._count + numAdded] = positions
+		self._times[self._count:self._count + numAdded] = times
+		self._count += numAdded
+		self._version += 1
+
+	def _reserve(self, capacity):
+		""" Grows buffers by doubling so appends are amortized constant time
+
+		"""
+		if (capacity <= len(self._times)):
+			return
+
+		newCapacity = max(capacity, 2 * len(self._times))
+
+		positions = np.empty((newCapacity, 2), dtype=np.float64)
+		positions[:self._count] = self._positions[:self._count]
+		times = np.empty(newCapacity, dtype=np.float64)
+		times[:self._count] = self._times[:self._count]
+
+		self._positions = positions
+		self._times = times
 
 	def getLastObservation(self):
 		""" Currently just returns the position of the last observation
 
 		"""
-		if (len(self._positions) < 1):
+		if (self._count < 1):
 			return (None, None)
 
-		return (self._times[-1], self._positions[-1])
+		return (self._times[self._count - 1], tuple(self._positions[self._count - 1]))
 
 	def size(self):
-		return len(self._positions)
+		return self._count
 
 	def age(self):
 		return self._time()
 
 	def getPointSequence(self):
-		# Todo: change return format for easy plotting
-		return self._positions
+		""" Returns Nx2 array (view) of the observed positions
+
+		"""
+		return self._positions[:self._count]
 
 	def updatePointSequence(self, points):
 		""" For used in applying bulk transforms to all points in track
 
 		"""
-		self._positions = points
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+		self._reserve(len(points))
+		self._positions[:len(points)] = points
+		self._count = len(points)
+		self._version += 1
 
 	def smoothTrack(self, smoothingFactor=3):
 		newPoints = []
 
 
-	def getMeasurements(self, method='midpoint', scoring='time'):
+	def getMeasurements(self, method='midpoint', scoring='time', incremental=False):
 		""" Returns list of measurements representing velocity of particle
 			localizing the measurement using the method specified. Velocity
 			is computed by comparing pairs on consecutive points.
 
-			midpoint: localize the measurement on the midpoint of the segment 
+			midpoint: localize the measurement on the midpoint of the segment
 			between two consecutive particle locations
 			front: localize measurement on first point of consecutive point pairs
 			end: localize measurement on second point of consecutive point pairs
 
 			Should return empty list of measurements if 0 or 1 observations
 
-			Todo: Don't recalculate measurements if track has not changed since last
-			function call
+			Measurements are cached until the track changes. In incremental
+			mode only measurements for observations added since the last
+			incremental call are returned, scored at the time of the call.
+		"""
+		if (incremental):
+			firstIndex = max(self._emittedCount - 1, 0)
+			self._emittedCount = self._count
+			return self._buildMeasurements(method, scoring, firstIndex)
+
+		key = (method, scoring, self._version)
+		if (self._measurementCache is not None and self._measurementCache[0] == key):
+			return list(self._measurementCache[1])
+
+		measurements = self._buildMeasurements(method, scoring, 0)
+		self._measurementCache = (key, measurements)
+
+		return list(measurements)
+
+	def getMeasurementArrays(self, method='midpoint', firstIndex=0):
+		""" Vectorized measurement computation over observations from firstIndex
+			onwards
+
+			Returns (points, vectors) as Mx2 arrays, one row per pair of
+			consecutive observations
 		"""
 		methodFuncName = "_" + method
 		methodFunc = getattr(self, methodFuncName, lambda p1, p2: p1)
-		scoringFuncName = "_" + scoring
-		scoringFunc = getattr(self, scoringFuncName, lambda: 0.0)
-
-		score = scoringFunc()
 
-		measurements = []
+		positions = self._positions[firstIndex:self._count]
+		times = self._times[firstIndex:self._count]
 
-		prevPoint = None
-		prevTime = None
+		if (len(positions) < 2):
+			return (np.empty((0, 2)), np.empty((0, 2)))
 
-		for timestamp, point in zip(self._times, self._positions):
-			if prevPoint is not None:
-				deltaT = timestamp - prevTime
-				#print(point, prevPoint)
+		deltaT = np.diff(times)[:, np.newaxis]
+		vectors = np.diff(positions, axis=0) / deltaT
+		points = methodFunc(positions[:-1], positions[1:])
 
-				xVel = (point[0] - prevPoint[0]) / deltaT
-				yVel = (point[1] - prevPoint[1]) / deltaT
-				vel = (xVel, yVel)
+		return (points, vectors)
 
-				measurementPoint = methodFunc(prevPoint, point)
+	def _buildMeasurements(self, method, scoring, firstIndex):
+		scoringFuncName = "_" + scoring
+		scoringFunc = getattr(self, scoringFuncName, lambda: 0.0)
 
-				m = Measurement(measurementPoint, vel, score)
-				measurements.append(m)
+		if (self._count - firstIndex < 2):
+			return []
 
-			prevPoint = point
-			prevTime = timestamp
+		score = scoringFunc()
+		points, vectors = self.getMeasurementArrays(method, firstIndex)
 
-		return measurements
+		return [Measurement(tuple(p), tuple(v), score) for p, v in zip(points.tolist(), vectors.tolist())]
 
 	# Method Functions
 	def _first(self, p1, p2):
@@ -129,14 +198,15 @@ class Track(object):
 		return p2
 
 	def _midpoint(self, p1, p2):
-		x = (p1[0] + p2[0]) / 2
-		y = (p1[1] + p2[1]) / 2
-		return (x, y)
-	
+		return (p1 + p2) / 2
+
 	# Scoring Functinns
 	def _time(self):
 		# Length of track in time
-		return self._times[-1] - self._times[0]
+		if (self._count < 1):
+			return 0.0
+
+		return self._times[self._count - 1] - self._times[0]
 
 	def _length(self):
 		# Length of track in number of measurements
@@ -147,16 +217,20 @@ class Track(object):
 
 	@property
 	def positions(self):
-		return self._positions
+		return self._positions[:self._count]
 
 	@property
 	def times(self):
-		return self._times
+		return self._times[:self._count]
+
+	@property
+	def trackId(self):
+		return getattr(self, '_trackId', None)
 
 	def __sub__(self, other):
 		# Only subtracts matching times
 		differences = []
-		for t1, pt1, t2, pt2 in zip(self._times, self._positions, other.times, other.positions):
+		for t1, pt1, t2, pt2 in zip(self.times, self.positions, other.times, other.positions):
 			if (t1 == t2):
 				differences.append((pt1[0]-pt2[0], pt1[1]-pt2[1]))
 
@@ -164,8 +238,251 @@ class Track(object):
 
 	def __rsub__(self, other):
 		differences = []
-		for t1, pt1, t2, pt2 in zip(other.times, other.positions, self._times, self._positions):
+		for t1, pt1, t2, pt2 in zip(other.times, other.positions, self.times, self.positions):
 			if (t1 == t2):
 				differences.append((pt1[0]-pt2[0], pt1[1]-pt2[1]))
 
-		return differences
\ No newline at end of file
+		return differences
+
+
+class TrackStore(object):
+	""" Columnar (structure of arrays) storage for many concurrent tracks
+
+		Per track state lives in parallel arrays indexed by slot: a unique
+		track id, an alive flag, the last observed position/time, the start
+		time and the number of observations. The full history of all tracks
+		is a single ragged buffer of observations tagged with their slot.
+		Track objects are only materialized on demand.
+
+		Slots of dead tracks are reclaimed by compact, which renumbers the
+		remaining slots, so slots should not be held across calls to compact.
+
+	"""
+
+	def __init__(self, capacity=1024, retainLost=False):
+		self._ids = np.empty(capacity, dtype=np.int64)
+		self._alive = np.zeros(capacity, dtype=bool)
+		self._lastPositions = np.empty((capacity, 2), dtype=np.float64)
+		self._lastTimes = np.empty(capacity, dtype=np.float64)
+		self._startTimes = np.empty(capacity, dtype=np.float64)
+		self._lengths = np.zeros(capacity, dtype=np.int64)
+		self._numSlots = 0
+		self._nextId = 0
+
+		# Ragged history buffer of observations from all tracks
+		self._obsPositions = np.empty((4 * capacity, 2), dtype=np.float64)
+		self._obsTimes = np.empty(4 * capacity, dtype=np.float64)
+		self._obsSlots = np.empty(4 * capacity, dtype=np.int64)
+		self._numObs = 0
+
+		# Materialized tracks dropped by compact, only kept if retainLost
+		self._retainLost = retainLost
+		self._lostTracks = []
+
+	def addTracks(self, positions, timestamp):
+		""" Starts a new track at each of the Nx2 positions, returns their slots
+
+		"""
+		positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+		numAdded = len(positions)
+
+		self._reserveSlots(self._numSlots + numAdded)
+		slots = np.arange(self._numSlots, self._numSlots + numAdded)
+
+		self._ids[slots] = np.arange(self._nextId, self._nextId + numAdded)
+		self._alive[slots] = True
+		self._startTimes[slots] = timestamp
+		self._lengths[slots] = 0
+		self._numSlots += numAdded
+		self._nextId += numAdded
+
+		self.extendTracks(slots, positions, timestamp)
+
+		return slots
+
+	def extendTracks(self, slots, positions, timestamp):
+		""" Appends an observation at timestamp to each of the tracks in slots
+
+		"""
+		slots = np.asarray(slots, dtype=np.int64)
+		positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+		numAdded = len(slots)
+
+		self._reserveObservations(self._numObs + numAdded)
+		end = self._numObs + numAdded
+
+		self._obsPositions[self._numObs:end] = positions
+		self._obsTimes[self._numObs:end] = timestamp
+		self._obsSlots[self._numObs:end] = slots
+		self._numObs = end
+
+		self._lastPositions[slots] = positions
+		self._lastTimes[slots] = timestamp
+		self._lengths[slots] += 1
+
+	def killTracks(self, slots):
+		self._alive[slots] = False
+
+	def activeSlots(self):
+		return np.flatnonzero(self._alive[:self._numSlots])
+
+	def endpoints(self, slots=None):
+		""" Returns last positions (Nx2) of the tracks in slots, all active
+			tracks in slot order by default
+
+		"""
+		if (slots is None):
+			slots = self.activeSlots()
+
+		return self._lastPositions[slots]
+
+	def ages(self, slots=None):
+		if (slots is None):
+			slots = self.activeSlots()
+
+		return self._lastTimes[slots] - self._startTimes[slots]
+
+	def ids(self, slots=None):
+		if (slots is None):
+			slots = self.activeSlots()
+
+		return self._ids[slots]
+
+	def getTrack(self, slot):
+		indices = np.flatnonzero(self._obsSlots[:self._numObs] == slot)
+
+		track = Track(trackId=int(self._ids[slot]))
+		track.addObservations(self._obsPositions[indices], self._obsTimes[indices])
+
+		return track
+
+	def getTracks(self):
+		""" Materializes Track objects for all active tracks, in slot order
+
+		"""
+		return self._materialize(self.activeSlots())
+
+	def getLostTracks(self):
+		""" Materializes Track objects for killed tracks. Tracks dropped by
+			compact are only available if the store retains lost tracks
+
+		"""
+		lostSlots = np.flatnonzero(~self._alive[:self._numSlots])
+
+		return self._lostTracks + self._materialize(lostSlots)
+
+	def history(self, slots=None):
+		""" Returns the observations of the tracks in (ascending) slots, all
+			active tracks by default, as flat arrays grouped by track in
+			slot order and by time within each track
+
+			Returns (positions, times, lengths), lengths holding the number
+			of observations of each track
+		"""
+		if (slots is None):
+			slots = self.activeSlots()
+
+		selected = np.zeros(self._numSlots, dtype=bool)
+		selected[slots] = True
+
+		# Group observations of selected tracks by slot, preserving time order
+		obsSlots = self._obsSlots[:self._numObs]
+		selectedIndices = np.flatnonzero(selected[obsSlots])
+		order = np.argsort(obsSlots[selectedIndices], kind='stable')
+		indices = selectedIndices[order]
+
+		return (self._obsPositions[indices], self._obsTimes[indices], self._lengths[slots])
+
+	def _materialize(self, slots):
+		""" Builds Track objects for the given (ascending) slots
+
+		"""
+		if (len(slots) < 1):
+			return []
+
+		positions, times, lengths = self.history(slots)
+		splits = np.cumsum(lengths)[:-1]
+
+		tracks = []
+		for trackId, trackPositions, trackTimes in zip(self._ids[slots],
+			np.split(positions, splits), np.split(times, splits)):
+			track = Track(trackId=int(trackId))
+			track.addObservations(trackPositions, trackTimes)
+			tracks.append(track)
+
+		return tracks
+
+	def compact(self, force=False):
+		""" Drops history and slots of dead tracks once they make up most of
+			the store (or always if force is set). Renumbers remaining slots
+
+		"""
+		numSlots = self._numSlots
+		alive = self._alive[:numSlots]
+		deadObservations = self._numObs - np.sum(self._lengths[:numSlots][alive])
+
+		if (not force and deadObservations <= self._numObs // 2):
+			return
+
+		if (self._retainLost):
+			self._lostTracks.extend(self._materialize(np.flatnonzero(~alive)))
+
+		keptSlots = np.flatnonzero(alive)
+		newSlotIndex = np.full(numSlots, -1, dtype=np.int64)
+		newSlotIndex[keptSlots] = np.arange(len(keptSlots))
+
+		keptObs = np.flatnonzero(alive[self._obsSlots[:self._numObs]])
+		numKeptObs = len(keptObs)
+
+		self._obsPositions[:numKeptObs] = self._obsPositions[keptObs]
+		self._obsTimes[:numKeptObs] = self._obsTimes[keptObs]
+		self._obsSlots[:numKeptObs] = newSlotIndex[self._obsSlots[keptObs]]
+		self._numObs = numKeptObs
+
+		numKept = len(keptSlots)
+		for column in (self._ids, self._lastPositions, self._lastTimes, self._startTimes, self._lengths):
+			column[:numKept] = column[keptSlots]
+
+		self._alive[:numKept] = True
+		self._alive[numKept:numSlots] = False
+		self._numSlots = numKept
+
+	def _reserveSlots(self, capacity):
+		if (capacity <= len(self._ids)):
+			return
+
+		newCapacity = max(capacity, 2 * len(self._ids))
+
+		self._ids = self._grow(self._ids, newCapacity)
+		self._alive = self._grow(self._alive, newCapacity, fill=False)
+		self._lastPositions = self._grow(self._lastPositions, newCapacity)
+		self._lastTimes = self._grow(self._lastTimes, newCapacity)
+		self._startTimes = self._grow(self._startTimes, newCapacity)
+		self._lengths = self._grow(self._lengths, newCapacity, fill=0)
+
+	def _reserveObservations(self, capacity):
+		if (capacity <= len(self._obsTimes)):
+			return
+
+		newCapacity = max(capacity, 2 * len(self._obsTimes))
+
+		self._obsPositions = self._grow(self._obsPositions, newCapacity)
+		self._obsTimes = self._grow(self._obsTimes, newCapacity)
+		self._obsSlots = self._grow(self._obsSlots, newCapacity)
+
+	def _grow(self, column, capacity, fill=None):
+		grown = np.empty((capacity,) + column.shape[1:], dtype=column.dtype)
+		grown[:len(column)] = column
+
+		if (fill is not None):
+			grown[len(column):] = fill
+
+		return grown
+
+	@property
+	def numActive(self):
+		return int(np.count_nonzero(self._alive[:self._numSlots]))
+
+	@property
+	def numObservations(self):
+		return self._numObs
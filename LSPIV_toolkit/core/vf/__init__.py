@@ -1,6 +1,10 @@
 import numpy as np
 
+from . import cache
+from . import index
 from . import gp_representation
+from . import raster_representation
+from . import partition_representation
 from . import representation
 from . import extents
 from . import fields
\ No newline at end of file
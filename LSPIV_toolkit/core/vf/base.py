@@ -1,5 +1,7 @@
 from abc import ABCMeta, abstractmethod
 
+import numpy as np
+
 class FieldRepresentation(metaclass=ABCMeta):
 
 	@abstractmethod
@@ -15,6 +17,24 @@ class FieldRepresentation(metaclass=ABCMeta):
 		"""
 		pass
 
+	def sampleAtPoints(self, points):
+		"""Method to sample field at a batch of points
+
+		Subclasses should override this with a native batch implementation,
+		the default falls back to sampling each point individually
+
+		Args:
+			points (ndarray): Nx2 array of points at which to sample the field
+
+		Returns:
+			values (ndarray): Nx2 array of values sampled from field
+
+		"""
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		values = [self[(x, y)] for x, y in points]
+
+		return np.asarray(values, dtype=np.float64).reshape(len(points), -1)
+
 	@property
 	@abstractmethod
 	def validExtents(self):
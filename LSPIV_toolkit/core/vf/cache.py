@@ -0,0 +1,114 @@
+import numpy as np
+
+from collections import OrderedDict
+
+class PredictionCache(object):
+	""" Bounded LRU cache of field predictions keyed on quantized query points
+
+		Query points are snapped to a lattice with spacing equal to the
+		tolerance, so points closer than the tolerance share a cache entry.
+		The cache is tied to a model state token and is cleared whenever the
+		token changes (i.e. the underlying model has been re-optimized)
+
+	"""
+
+	def __init__(self, maxSize=4096, tolerance=1e-6):
+		self._maxSize = maxSize
+		self._tolerance = tolerance
+
+		self._entries = OrderedDict()
+		self._state = None
+
+		self._hits = 0
+		self._misses = 0
+
+	def predict(self, points, predictFunc, state=None):
+		""" Returns cached (mean, var) for each point, calling predictFunc
+			once on the batch of points that are not in the cache
+
+		Args:
+			points (ndarray): Nx2 array of query points
+			predictFunc (func): maps an Mx2 array to Mx2 (mean, var) arrays
+			state: token identifying the current model state
+
+		"""
+		self.validate(state)
+
+		numPoints = len(points)
+		mean = np.empty((numPoints, 2), dtype=np.float64)
+		var = np.empty((numPoints, 2), dtype=np.float64)
+
+		keys = self.quantize(points)
+		missIndices = []
+
+		for index, key in enumerate(keys):
+			entry = self._entries.get(key)
+
+			if (entry is None):
+				missIndices.append(index)
+			else:
+				self._entries.move_to_end(key)
+				mean[index], var[index] = entry
+
+		self._hits += numPoints - len(missIndices)
+		self._misses += len(missIndices)
+
+		if (len(missIndices) > 0):
+			missMean, missVar = predictFunc(points[missIndices])
+			mean[missIndices] = missMean
+			var[missIndices] = missVar
+
+			for index, m, v in zip(missIndices, missMean, missVar):
+				self._insert(keys[index], (m, v))
+
+		return (mean, var)
+
+	def quantize(self, points):
+		quantized = np.round(np.asarray(points, dtype=np.float64) / self._tolerance)
+		return [tuple(key) for key in quantized.astype(np.int64)]
+
+	def validate(self, state):
+		""" Clears the cache if the model state token has changed
+
+		"""
+		if (state is None or self._state is None or state != self._state):
+			if (len(self._entries) > 0):
+				self._entries.clear()
+
+		self._state = state
+
+	def clear(self):
+		self._entries.clear()
+		self._state = None
+
+	def resetStats(self):
+		self._hits = 0
+		self._misses = 0
+
+	def _insert(self, key, value):
+		self._entries[key] = value
+		self._entries.move_to_end(key)
+
+		while (len(self._entries) > self._maxSize):
+			# Evict least recently used entry
+			self._entries.popitem(last=False)
+
+	@property
+	def hits(self):
+		return self._hits
+
+	@property
+	def misses(self):
+		return self._misses
+
+	@property
+	def size(self):
+		return len(self._entries)
+
+	@property
+	def maxSize(self):
+		return self._maxSize
+
+	@property
+	def tolerance(self):
+		return self._tolerance
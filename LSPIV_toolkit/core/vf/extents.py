@@ -1,3 +1,5 @@
+import numpy as np
+
 class FieldExtents(object):
 	"""Class representing the valid extents of a 2D field
 
@@ -34,6 +36,22 @@ class FieldExtents(object):
 
 		return False
 
+	def containPoints(self, points):
+		"""Vectorized version of contain
+
+		Args:
+			points (ndarray): Nx2 array of points to check
+
+		Returns:
+			mask (ndarray): boolean array of length N, True where point is contained
+
+		"""
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		x = points[:, 0]
+		y = points[:, 1]
+
+		return (self._xMin <= x) & (x <= self._xMax) & (self._yMin <= y) & (y <= self._yMax)
+
 	def xSplit(self, *args):
 		subExtents = []
 
@@ -120,6 +138,14 @@ class PiecewiseExtents(FieldExtents):
 
 		return False
 
+	def containPoints(self, points):
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		mask = np.zeros(len(points), dtype=bool)
+
+		for extents in self._subExtents:
+			mask |= extents.containPoints(points)
+
+		return mask
 
 	@property
 	def xRange(self):
@@ -183,6 +209,10 @@ class InfiniteExtents(FieldExtents):
 	def contain(self, point):
 		return True
 
+	def containPoints(self, points):
+		points = np.asarray(points).reshape(-1, 2)
+		return np.ones(len(points), dtype=bool)
+
 	@property
 	def xRange(self):
 		return None
@@ -221,4 +251,8 @@ class NullExtents(FieldExtents):
 
 	def contain(self, point):
 		# For efficiency, should return False with super class contain method
-		return False
\ No newline at end of file
+		return False
+
+	def containPoints(self, points):
+		points = np.asarray(points).reshape(-1, 2)
+		return np.zeros(len(points), dtype=bool)
\ No newline at end of file
@@ -2,6 +2,7 @@ import numpy as np
 import pickle
 
 from . import representation as vf_rep
+from . import raster_representation as vf_raster
 from . import extents
 from .base import Field
 from ..utils import Measurement
@@ -33,28 +34,66 @@ class VectorField(Field):
 
 	def sampleAtPoints(self, points):
 		""" Returns the value of the vector field at each
-			of the points in the list provided
+			of the points provided as an Nx2 array
 
 		"""
-		return map(self.sampleAtPoint, points)
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		return self._fieldRep.sampleAtPoints(points)
 
 	def sampleAtGrid(self, gridX, gridY):
 		""" Returns a sampling of the vector field 
 			at each point in the grid provided
 
 		"""
-		wrapper = lambda x,y: self.sampleAtPoint((x,y))
-		vectorizedField = np.vectorize(wrapper)
+		gridX = np.asarray(gridX)
+		gridY = np.asarray(gridY)
+		points = np.column_stack((gridX.ravel(), gridY.ravel()))
 
-		return vectorizedField(gridX, gridY)
+		samples = self.sampleAtPoints(points)
 
+		return (samples[:, 0].reshape(gridX.shape), samples[:, 1].reshape(gridY.shape))
 
-	def sampleVarAtGrid(self, gridX, gridY):
 
-		wrapper = lambda x,y: self.sampleVarAtPoint((x,y))
-		vectorizedField = np.vectorize(wrapper)
+	def predictAtPoints(self, points):
+		""" Returns the mean and variance of the vector field at each of
+			the points provided as a pair of Nx2 arrays. Fields without
+			a notion of uncertainty report zero variance
+
+		"""
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
 
-		return vectorizedField(gridX, gridY)
+		if (hasattr(self._fieldRep, 'predict')):
+			return self._fieldRep.predict(points)
+
+		mean = self._fieldRep.sampleAtPoints(points)
+		return (mean, np.zeros_like(mean))
+
+	def predictAtGrid(self, gridX, gridY):
+		""" Returns mean and variance grids for both components of the
+			vector field as (xMean, yMean, xVar, yVar)
+
+		"""
+		gridX = np.asarray(gridX)
+		gridY = np.asarray(gridY)
+		points = np.column_stack((gridX.ravel(), gridY.ravel()))
+
+		mean, var = self.predictAtPoints(points)
+		shape = gridX.shape
+
+		return (mean[:, 0].reshape(shape), mean[:, 1].reshape(shape),
+				var[:, 0].reshape(shape), var[:, 1].reshape(shape))
+
+	def predictGrid(self, grid):
+		xGrid, yGrid = grid.mgrid
+		return self.predictAtGrid(xGrid, yGrid)
+
+	def sampleVarAtPoints(self, points):
+		mean, var = self.predictAtPoints(points)
+		return var
+
+	def sampleVarAtGrid(self, gridX, gridY):
+		xMean, yMean, xVar, yVar = self.predictAtGrid(gridX, gridY)
+		return (xVar, yVar)
 
 
 	def sampleVarGrid(self, grid):
@@ -88,22 +127,22 @@ class VectorField(Field):
 		""" Return a list of tuples representing points and vectors at
 			those points on a grid
 		"""
-		measurements = []
 		xRange, yRange = grid.arange
+		points = [(x, y) for x in xRange for y in yRange]
 
-		for x in xRange:
-			for y in yRange:
-				point = (x, y)
-				vector = self.sampleAtPoint(point)
-				measurements.append(Measurement(point, vector))
-
-		return measurements
+		return self.measureAtPoints(points)
 
 	def measureAtPoint(self, point):
 		return Measurement(point, self.sampleAtPoint(point))
 
 	def measureAtPoints(self, points):
-		return map(self.measureAtPoint, points)
+		points = list(points)
+		if (len(points) < 1):
+			return []
+
+		vectors = self.sampleAtPoints(points)
+
+		return [Measurement(p, tuple(v)) for p, v in zip(points, vectors)]
 
 	@property
 	def representation(self):
@@ -147,9 +186,18 @@ class UniformVectorField(VectorField):
 		if (fieldExtents is None):
 			fieldExtents = extents.InfiniteExtents()
 
-		vfFunc = lambda x,y: flowVector
+		self._flowVector = flowVector
 
-		self._fieldRep = vf_rep.VectorFieldRepresentation(vfFunc, fieldExtents)
+		self._fieldRep = vf_rep.VectorFieldRepresentation(self.kernel, fieldExtents, vectorized=True)
+
+	def kernel(self, x, y):
+		"""Evaluates the field (ignoring extents) on coordinate arrays x and y
+
+		"""
+		shape = np.broadcast(x, y).shape
+
+		return (np.full(shape, self._flowVector[0], dtype=np.float64),
+				np.full(shape, self._flowVector[1], dtype=np.float64))
 
 class DevelopedPipeFlowField(VectorField):
 	""" Standard vector field representing fully developed pipe flow in channel
@@ -169,10 +217,23 @@ class DevelopedPipeFlowField(VectorField):
 			yRange = (offset[1], offset[1] + channelWidth)
 			fieldExtents = extents.FieldExtents(xRange, yRange)
 
-		vfFunc = lambda x,y: (0,
-			((4 * (x - offset[0]) / channelWidth - 4 * (x - offset[0])**2 / channelWidth**2) * vMax))
+		self._channelWidth = channelWidth
+		self._vMax = vMax
+		self._offset = offset
+
+		self._fieldRep = vf_rep.VectorFieldRepresentation(self.kernel, fieldExtents, vectorized=True)
+
+	def kernel(self, x, y):
+		"""Evaluates the field (ignoring extents) on coordinate arrays x and y
+
+		"""
+		x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), y)
+		width = self._channelWidth
+		dx = x - self._offset[0]
+
+		vy = (4 * dx / width - 4 * dx**2 / width**2) * self._vMax
 
-		self._fieldRep = vf_rep.VectorFieldRepresentation(vfFunc, fieldExtents)
+		return (np.zeros_like(vy), vy)
 
 class DivergingFlowField(VectorField):
 	""" A flow field diverging from a given central axis
@@ -183,32 +244,41 @@ class DivergingFlowField(VectorField):
 	"""
 
 	def __init__(self, flowMag, centerAxis, fieldExtents, decay='none'):
-		axisX, axisY = centerAxis
+		self._flowMag = flowMag
+		self._axisX, self._axisY = centerAxis
+		self._extents = fieldExtents
 		
 		vfDecayFuncName = '_' + decay
-		vfDecayFunc = getattr(self, vfDecayFuncName, lambda x,y,ax,extents: 1)
-		vfFunc = lambda x,y: (flowMag * vfDecayFunc(x,y,axisX, fieldExtents), 0)
+		self._decayFunc = getattr(self, vfDecayFuncName, self._constant)
+
+		self._fieldRep = vf_rep.VectorFieldRepresentation(self.kernel, fieldExtents, vectorized=True)
+
+	def kernel(self, x, y):
+		"""Evaluates the field (ignoring extents) on coordinate arrays x and y
+
+		"""
+		x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), y)
+		decay = self._decayFunc(x, y, self._axisX, self._extents)
+
+		return (self._flowMag * decay, np.zeros_like(decay))
 
-		self._fieldRep = vf_rep.VectorFieldRepresentation(vfFunc, fieldExtents)
+	def _constant(self, x, y, ax, extents):
+		return np.ones_like(x)
 
 	def _none(self, x, y, ax, extents):
-		if (x < ax):
-			return -1.0
-		elif (x > ax):
-			return 1.0
-		else:
-			return 0.0
+		return np.sign(x - ax)
 
 	def _linear(self, x, y, ax, extents):
 		xMin, xMax = extents.xRange
 		leftPartition = ax - xMin
 		rightPartition = xMax - ax
-		if (x < ax):
-			return (xMin - x) / leftPartition
-		elif (x > ax):
-			return (xMax - x) / rightPartition
-		else:
-			return 0.0
+
+		# Both branches are evaluated, ignore division on empty partitions
+		with np.errstate(divide='ignore', invalid='ignore'):
+			left = (xMin - x) / leftPartition
+			right = (xMax - x) / rightPartition
+
+		return np.where(x < ax, left, np.where(x > ax, right, 0.0))
 
 
 
@@ -221,33 +291,115 @@ class ConvergingFlowField(VectorField):
 	"""
 
 	def __init__(self, flowMag, centerAxis, fieldExtents, decay='none'):
-		axisX, axisY = centerAxis
+		self._flowMag = flowMag
+		self._axisX, self._axisY = centerAxis
+		self._extents = fieldExtents
 		
 		vfDecayFuncName = '_' + decay
-		vfDecayFunc = getattr(self, vfDecayFuncName, lambda x,y,ax,extents: 1)
-		vfFunc = lambda x,y: (flowMag * vfDecayFunc(x,y,axisX, fieldExtents), 0)
+		self._decayFunc = getattr(self, vfDecayFuncName, self._constant)
 
-		self._fieldRep = vf_rep.VectorFieldRepresentation(vfFunc, fieldExtents)
+		self._fieldRep = vf_rep.VectorFieldRepresentation(self.kernel, fieldExtents, vectorized=True)
 
+	def kernel(self, x, y):
+		"""Evaluates the field (ignoring extents) on coordinate arrays x and y
+
+		"""
+		x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), y)
+		decay = self._decayFunc(x, y, self._axisX, self._extents)
+
+		return (self._flowMag * decay, np.zeros_like(decay))
+
+	def _constant(self, x, y, ax, extents):
+		return np.ones_like(x)
 
 	def _none(self, x, y, ax, extents):
-		if (x < ax):
-			return 1.0
-		elif (x > ax):
-			return -1.0
-		else:
-			return 0.0
+		return np.sign(ax - x)
 
 	def _linear(self, x, y, ax, extents):
 		xMin, xMax = extents.xRange
 		leftPartition = ax - xMin
 		rightPartition = xMax - ax
-		if (x < ax):
-			return (x - xMin) / leftPartition
-		elif (x > ax):
-			return (x - xMax) / rightPartition
-		else:
-			return 0.0
+
+		# Both branches are evaluated, ignore division on empty partitions
+		with np.errstate(divide='ignore', invalid='ignore'):
+			left = (x - xMin) / leftPartition
+			right = (x - xMax) / rightPartition
+
+		return np.where(x < ax, left, np.where(x > ax, right, 0.0))
+
+
+class RasterizedVectorField(VectorField):
+	""" Caches any vector field as samples on a regular lattice so repeated
+	point and batch queries cost an interpolation instead of a full
+	evaluation of the source field
+
+	"""
+
+	def __init__(self, sourceField, resolution=1.0, fieldExtents=None,
+		interpolation='bilinear', estimateError=True):
+		"""Samples sourceField once on a lattice spanning fieldExtents (the source
+		extents if not provided) with node spacing of at most resolution
+
+		Args:
+			sourceField (VectorField): field to rasterize
+			resolution (double or 2-Tuple): maximum node spacing (dx, dy)
+			fieldExtents (FieldExtents): finite extents to rasterize over
+			interpolation (string): 'bilinear' or 'bicubic'
+			estimateError (bool): measure interpolation error against the source
+				at all cell midpoints (one extra batch sampling of the source)
+
+		"""
+		if (fieldExtents is None):
+			fieldExtents = sourceField.extents
+
+		xRange = fieldExtents.xRange
+		yRange = fieldExtents.yRange
+
+		if (xRange is None or yRange is None):
+			raise ValueError("Rasterization requires finite field extents")
+
+		if (np.isscalar(resolution)):
+			resolution = (resolution, resolution)
+
+		xCount = int(np.ceil((xRange[1] - xRange[0]) / resolution[0])) + 1
+		yCount = int(np.ceil((yRange[1] - yRange[0]) / resolution[1])) + 1
+
+		xNodes = np.linspace(xRange[0], xRange[1], max(xCount, 2))
+		yNodes = np.linspace(yRange[0], yRange[1], max(yCount, 2))
+		xGrid, yGrid = np.meshgrid(xNodes, yNodes, indexing='ij')
+
+		xSamples, ySamples = sourceField.sampleAtGrid(xGrid, yGrid)
+		lattice = np.ascontiguousarray(np.stack((xSamples, ySamples), axis=-1), dtype=np.float32)
+
+		self._fieldRep = vf_raster.RasterizedFieldRepresentation(lattice, xRange, yRange,
+			interpolation)
+
+		if (estimateError):
+			xMid = (xNodes[:-1] + xNodes[1:]) / 2.0
+			yMid = (yNodes[:-1] + yNodes[1:]) / 2.0
+			xGrid, yGrid = np.meshgrid(xMid, yMid, indexing='ij')
+			midpoints = np.column_stack((xGrid.ravel(), yGrid.ravel()))
+
+			error = np.abs(self.sampleAtPoints(midpoints) - sourceField.sampleAtPoints(midpoints))
+			self._fieldRep.setErrorBound(float(error.max()))
+
+	def save(self, fileName):
+		self._fieldRep.save(fileName)
+
+	@classmethod
+	def load(cls, fileName, mmap=True):
+		""" Loads a saved lattice, memory mapped read-only by default so that
+			multiple processes can share it
+
+		"""
+		field = cls.__new__(cls)
+		VectorField.__init__(field, vf_raster.RasterizedFieldRepresentation.load(fileName, mmap))
+
+		return field
+
+	@property
+	def errorBound(self):
+		return self._fieldRep.errorBound
 
 
 class CompoundVectorField(VectorField):
@@ -2,32 +2,87 @@ import GPy
 import numpy as np
 
 from . import extents
+from .cache import PredictionCache
 from .base import FieldRepresentation
 
 class GPVectorFieldRepresentation(FieldRepresentation):
 
-	def __init__(self, xModel, yModel, fieldExtents, undefinedValue=(0,0)):
+	def __init__(self, xModel, yModel, fieldExtents, undefinedValue=(0,0), cacheSize=None, cacheTolerance=1e-6):
 		self._xComponentGPModel = xModel
 		self._yComponentGPModel = yModel
 		self._validExtents = fieldExtents
 		self._undefinedVal = undefinedValue
 
+		self._cache = None
+		if (cacheSize is not None):
+			self.enableCache(cacheSize, cacheTolerance)
+
 	def __getitem__(self, index):
-		# Todo: add Memoization
-		testPoint = np.asarray([index])
+		mean, var = self.predict([index])
+
+		return (mean[0][0], mean[0][1])
 
-		muX, varX = self._xComponentGPModel.predict_noiseless(testPoint)
-		muY, varY = self._yComponentGPModel.predict_noiseless(testPoint)
+	def sampleAtPoints(self, points):
+		mean, var = self.predict(points)
 
-		return (muX[0][0], muY[0][0])
+		return mean
 
 	def getVar(self, index):
-		testPoint = np.asarray([index])
+		mean, var = self.predict([index])
+
+		return (var[0][0], var[0][1])
+
+	def predict(self, points):
+		""" Predicts mean and variance of both field components at each point
+
+			Makes a single prediction call per component model so the
+			posterior factorization cached by the model is shared across
+			the whole batch
+
+		Args:
+			points (ndarray): Nx2 array of points at which to predict
+
+		Returns:
+			mean (ndarray): Nx2 array of predicted (x, y) components
+			var (ndarray): Nx2 array of variances of the (x, y) components
+
+		"""
+		testPoints = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+		# Representations unpickled from older scenario files have no cache
+		cache = getattr(self, '_cache', None)
+		if (cache is None):
+			return self._predict(testPoints)
+
+		return cache.predict(testPoints, self._predict, self._modelState())
+
+	def _predict(self, testPoints):
+		muX, varX = self._xComponentGPModel.predict_noiseless(testPoints)
+		muY, varY = self._yComponentGPModel.predict_noiseless(testPoints)
+
+		return (np.hstack((muX, muY)), np.hstack((varX, varY)))
+
+	def _modelState(self):
+		# GPy replaces the posterior whenever parameters or data change
+		return (self._xComponentGPModel.posterior, self._yComponentGPModel.posterior)
+
+	def enableCache(self, maxSize=4096, tolerance=1e-6):
+		""" Memoize predictions in a bounded LRU cache. Query points closer
+			than tolerance share a cache entry
 
-		muX, varX = self._xComponentGPModel.predict_noiseless(testPoint)
-		muY, varY = self._yComponentGPModel.predict_noiseless(testPoint)
+		"""
+		self._cache = PredictionCache(maxSize, tolerance)
 
-		return (varX[0][0], varY[0][0])
+	def disableCache(self):
+		self._cache = None
+
+	def invalidateCache(self):
+		if (getattr(self, '_cache', None) is not None):
+			self._cache.clear()
+
+	@property
+	def cache(self):
+		return getattr(self, '_cache', None)
 
 	def isDefinedAt(self, point):
 		return self._validExtents.contain(point)
@@ -43,20 +98,35 @@ class CoregionalizedGPFieldRepresentation(FieldRepresentation):
 		self._validExtents = fieldExtents
 
 	def __getitem__(self, index):
-		x, y = index
-		newX = np.asarray([[x]])
-		newY = np.asarray([[y]])
-		newInputX = np.hstack([newX, newY, np.zeros_like(newX)])
-		newInputY = np.hstack([newX, newY, np.ones_like(newX)])
-		
+		mean, var = self.predict([index])
+
+		return (mean[0][0], mean[0][1])
+
+	def sampleAtPoints(self, points):
+		mean, var = self.predict(points)
+
+		return mean
+
+	def getVar(self, index):
+		mean, var = self.predict([index])
+
+		return (var[0][0], var[0][1])
+
+	def predict(self, points):
+		testPoints = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		outputIndex = np.zeros((len(testPoints), 1))
+
+		newInputX = np.hstack([testPoints, outputIndex])
+		newInputY = np.hstack([testPoints, outputIndex + 1])
+
 		muX, varX = self._gpModel.predict_noiseless(newInputX)
 		muY, varY = self._gpModel.predict_noiseless(newInputY)
-		
-		return (muX[0][0], muY[0][0])
+
+		return (np.hstack((muX, muY)), np.hstack((varX, varY)))
 
 	def isDefinedAt(self, point):
 		return self._validExtents.contain(point)
 
 	@property
 	def validExtents(self):
-		return self._validExtents	
\ No newline at end of file
+		return self._validExtents
\ No newline at end of file
@@ -4,32 +4,75 @@ import GPflow
 import numpy as np
 
 from . import extents
+from .cache import PredictionCache
 from .base import FieldRepresentation
 
 class GPFlowVectorFieldRepresentation(FieldRepresentation):
 
-	def __init__(self, xModel, yModel, fieldExtents, undefinedValue=(0,0)):
+	def __init__(self, xModel, yModel, fieldExtents, undefinedValue=(0,0), cacheSize=None, cacheTolerance=1e-6):
 		self._xComponentGPModel = xModel
 		self._yComponentGPModel = yModel
 		self._validExtents = fieldExtents
 		self._undefinedVal = undefinedValue
 
+		self._cache = None
+		if (cacheSize is not None):
+			self.enableCache(cacheSize, cacheTolerance)
+
 	def __getitem__(self, index):
-		# Todo: add Memoization
-		testPoint = np.asarray([index])
+		mean, var = self.predict([index])
+
+		return (mean[0][0], mean[0][1])
 
-		muX, varX = self._xComponentGPModel.predict_y(testPoint)
-		muY, varY = self._yComponentGPModel.predict_y(testPoint)
+	def sampleAtPoints(self, points):
+		mean, var = self.predict(points)
 
-		return (muX[0][0], muY[0][0])
+		return mean
 
 	def getVar(self, index):
-		testPoint = np.asarray([index])
+		mean, var = self.predict([index])
+
+		return (var[0][0], var[0][1])
+
+	def predict(self, points):
+		testPoints = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+		# Representations unpickled from older scenario files have no cache
+		cache = getattr(self, '_cache', None)
+		if (cache is None):
+			return self._predict(testPoints)
+
+		return cache.predict(testPoints, self._predict, self._modelState())
+
+	def _predict(self, testPoints):
+		muX, varX = self._xComponentGPModel.predict_y(testPoints)
+		muY, varY = self._yComponentGPModel.predict_y(testPoints)
 
-		muX, varX = self._xComponentGPModel.predict_y(testPoint)
-		muY, varY = self._yComponentGPModel.predict_y(testPoint)
+		return (np.hstack((muX, muY)), np.hstack((varX, varY)))
 
-		return (varX[0][0], varY[0][0])
+	def _modelState(self):
+		xState = np.asarray(self._xComponentGPModel.get_free_state())
+		yState = np.asarray(self._yComponentGPModel.get_free_state())
+
+		return (xState.tobytes(), yState.tobytes())
+
+	def enableCache(self, maxSize=4096, tolerance=1e-6):
+		""" Memoize predictions in a bounded LRU cache. Query points closer
+			than tolerance share a cache entry
+
+		"""
+		self._cache = PredictionCache(maxSize, tolerance)
+
+	def disableCache(self):
+		self._cache = None
+
+	def invalidateCache(self):
+		if (getattr(self, '_cache', None) is not None):
+			self._cache.clear()
+
+	@property
+	def cache(self):
+		return getattr(self, '_cache', None)
 
 	def isDefinedAt(self, point):
 		return self._validExtents.contain(point)
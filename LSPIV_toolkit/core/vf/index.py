@@ -0,0 +1,143 @@
+import numpy as np
+
+class ExtentsBucketIndex(object):
+	"""Uniform bucket grid over the extents of a group of component fields
+
+	Each bucket stores the indices of the components whose extents overlap
+	it, so a query only needs to visit the components registered in the
+	bucket containing the query point. Components without finite extents
+	(None, infinite or piecewise extents) are kept in a separate list and
+	are visited for every query.
+
+	Attributes:
+		_buckets (list): component indices for each bucket (row-major)
+		_bucketMasks (ndarray): KxB boolean array, True where component k
+			overlaps bucket b
+		_unbounded (list): indices of components without finite extents
+
+	"""
+
+	def __init__(self, extentsList, maxBucketsPerAxis=64):
+		"""Builds the bucket grid
+
+		Args:
+			extentsList (list): extents of each component, in component order
+			maxBucketsPerAxis (int): upper bound on the grid resolution
+
+		"""
+		self._numComponents = len(extentsList)
+		self._unbounded = []
+
+		bounded = []
+		for index, ext in enumerate(extentsList):
+			if (ext is None or ext.xRange is None or ext.yRange is None):
+				self._unbounded.append(index)
+			else:
+				bounded.append((index, ext.xRange, ext.yRange))
+
+		if (len(bounded) < 1):
+			self._xMin = self._yMin = 0.0
+			self._xWidth = self._yWidth = 1.0
+			self._xCount = self._yCount = 0
+			self._buckets = []
+			self._bucketMasks = np.zeros((self._numComponents, 0), dtype=bool)
+			return
+
+		# Grid covers the union of all bounded component extents
+		self._xMin = min(xRange[0] for _, xRange, _ in bounded)
+		self._yMin = min(yRange[0] for _, _, yRange in bounded)
+		xMax = max(xRange[1] for _, xRange, _ in bounded)
+		yMax = max(yRange[1] for _, _, yRange in bounded)
+
+		# Roughly twice as many buckets per axis as components along a side
+		count = int(min(maxBucketsPerAxis, 2 * np.ceil(np.sqrt(len(bounded)))))
+		self._xCount = max(1, count)
+		self._yCount = max(1, count)
+
+		self._xWidth = max(xMax - self._xMin, 1e-12) / self._xCount
+		self._yWidth = max(yMax - self._yMin, 1e-12) / self._yCount
+
+		numBuckets = self._xCount * self._yCount
+		self._buckets = [[] for _ in range(numBuckets)]
+		self._bucketMasks = np.zeros((self._numComponents, numBuckets), dtype=bool)
+
+		for index, xRange, yRange in bounded:
+			if (xRange[0] > xRange[1] or yRange[0] > yRange[1]):
+				# Null extents never contain a point
+				continue
+
+			i0, i1 = self._xCells(np.asarray(xRange, dtype=np.float64))
+			j0, j1 = self._yCells(np.asarray(yRange, dtype=np.float64))
+
+			for i in range(i0, i1 + 1):
+				for j in range(j0, j1 + 1):
+					bucket = i * self._yCount + j
+					self._buckets[bucket].append(index)
+					self._bucketMasks[index, bucket] = True
+
+	def candidates(self, point):
+		"""Returns indices of the components that may contain point, in
+		component order
+
+		"""
+		bucket = self.bucketsOf(np.asarray([point], dtype=np.float64))[0]
+
+		if (bucket < 0):
+			return self._unbounded
+
+		if (len(self._unbounded) < 1):
+			return self._buckets[bucket]
+
+		return sorted(self._unbounded + self._buckets[bucket])
+
+	def bucketsOf(self, points):
+		"""Returns the bucket of each of the Nx2 points, -1 if outside of grid
+
+		"""
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		buckets = np.full(len(points), -1, dtype=np.int64)
+
+		if (self._xCount < 1):
+			return buckets
+
+		xCells = np.floor((points[:, 0] - self._xMin) / self._xWidth).astype(np.int64)
+		yCells = np.floor((points[:, 1] - self._yMin) / self._yWidth).astype(np.int64)
+
+		# Points on the far boundary belong to the last bucket
+		xCells[xCells == self._xCount] = self._xCount - 1
+		yCells[yCells == self._yCount] = self._yCount - 1
+
+		inside = (xCells >= 0) & (xCells < self._xCount) & (yCells >= 0) & (yCells < self._yCount)
+		buckets[inside] = xCells[inside] * self._yCount + yCells[inside]
+
+		return buckets
+
+	def componentMask(self, index, buckets):
+		"""Returns a boolean mask over the points (given by their buckets)
+		which component index needs to evaluate
+
+		"""
+		if (index in self._unbounded):
+			return np.ones(len(buckets), dtype=bool)
+
+		mask = np.zeros(len(buckets), dtype=bool)
+		inside = buckets >= 0
+		mask[inside] = self._bucketMasks[index, buckets[inside]]
+
+		return mask
+
+	def _xCells(self, values):
+		cells = np.floor((values - self._xMin) / self._xWidth).astype(np.int64)
+		return tuple(np.clip(cells, 0, self._xCount - 1))
+
+	def _yCells(self, values):
+		cells = np.floor((values - self._yMin) / self._yWidth).astype(np.int64)
+		return tuple(np.clip(cells, 0, self._yCount - 1))
+
+	@property
+	def unbounded(self):
+		return self._unbounded
+
+	@property
+	def shape(self):
+		return (self._xCount, self._yCount)
@@ -0,0 +1,146 @@
+import numpy as np
+
+from .base import FieldRepresentation
+from .index import ExtentsBucketIndex
+
+class PartitionedVectorFieldRepresentation(FieldRepresentation):
+	"""Vector field blended from local field representations defined on
+	overlapping tiles of the field extents
+
+	Each tile has a weight which is 1 on its interior and falls smoothly
+	(smoothstep) to 0 across the overlap towards each edge shared with a
+	neighbouring tile, edges on the boundary of the field extents are not
+	tapered. Weights are normalized to sum to 1 at every point (a partition
+	of unity), so the blended field is continuous across tiles and equal
+	to the local field where a single tile covers a point.
+
+	Queries only evaluate the local fields of the tiles containing the
+	point, found through an ExtentsBucketIndex over the tile extents, so
+	their cost does not grow with the number of tiles.
+
+	"""
+
+	def __init__(self, tiles, fieldExtents, undefinedValue=(0.0, 0.0)):
+		"""Stores tiles and builds the bucket index over their extents
+
+		Args:
+			tiles (list): (tileExtents, taper, fieldRep) of each tile, where
+				taper (4-Tuple) holds the widths of the weight ramps at the
+				(xMin, xMax, yMin, yMax) edges, 0 for an untapered edge
+			fieldExtents (FieldExtents): extents covered by the tiles
+			undefinedValue (2-Tuple): value to return when sampling outside of extents
+
+		"""
+		self._tileExtents = [tileExtents for tileExtents, _, _ in tiles]
+		self._tapers = [taper for _, taper, _ in tiles]
+		self._tileFields = [fieldRep for _, _, fieldRep in tiles]
+
+		self._validExtents = fieldExtents
+		self._undefinedVal = undefinedValue
+
+		self._index = ExtentsBucketIndex(self._tileExtents)
+
+	def __getitem__(self, index):
+		value = self.sampleAtPoints([index])[0]
+		return (float(value[0]), float(value[1]))
+
+	def sampleAtPoints(self, points):
+		mean, var = self._blend(points, False)
+
+		return mean
+
+	def predict(self, points):
+		""" Blends mean and variance of the local fields, variances are
+			combined as those of a weighted sum of independent predictions.
+			Local fields without a predict method report zero variance
+
+		"""
+		return self._blend(points, True)
+
+	def getVar(self, index):
+		mean, var = self.predict([index])
+
+		return (var[0][0], var[0][1])
+
+	def _blend(self, points, withVariance):
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		mean = np.empty((len(points), 2), dtype=np.float64)
+		mean[:] = self._undefinedVal
+		var = np.zeros((len(points), 2), dtype=np.float64)
+
+		mask = self._validExtents.containPoints(points)
+		if (not mask.any()):
+			return (mean, var)
+
+		validPoints = points[mask]
+		weightedMean = np.zeros((len(validPoints), 2), dtype=np.float64)
+		weightedVar = np.zeros((len(validPoints), 2), dtype=np.float64)
+		totalWeight = np.zeros(len(validPoints), dtype=np.float64)
+
+		buckets = self._index.bucketsOf(validPoints)
+
+		for tileIndex, field in enumerate(self._tileFields):
+			selected = self._index.componentMask(tileIndex, buckets)
+			selected[selected] = self._tileExtents[tileIndex].containPoints(validPoints[selected])
+
+			if (not selected.any()):
+				continue
+
+			tilePoints = validPoints[selected]
+			weights = self._weights(tileIndex, tilePoints)
+
+			if (withVariance and hasattr(field, 'predict')):
+				tileMean, tileVar = field.predict(tilePoints)
+				weightedVar[selected] += weights[:, np.newaxis]**2 * tileVar
+			else:
+				tileMean = field.sampleAtPoints(tilePoints)
+
+			weightedMean[selected] += weights[:, np.newaxis] * tileMean
+			totalWeight[selected] += weights
+
+		# Points in no tile (gaps in the tiling) are undefined
+		covered = totalWeight > 0
+		totalWeight = totalWeight[covered, np.newaxis]
+
+		blendedMean = mean[mask]
+		blendedMean[covered] = weightedMean[covered] / totalWeight
+		mean[mask] = blendedMean
+
+		blendedVar = var[mask]
+		blendedVar[covered] = weightedVar[covered] / totalWeight**2
+		var[mask] = blendedVar
+
+		return (mean, var)
+
+	def _weights(self, tileIndex, points):
+		""" Smoothstep weight of the tile at points within its extents
+
+		"""
+		tileExtents = self._tileExtents[tileIndex]
+		xMinTaper, xMaxTaper, yMinTaper, yMaxTaper = self._tapers[tileIndex]
+		(xMin, xMax), (yMin, yMax) = tileExtents.xRange, tileExtents.yRange
+
+		weights = np.ones(len(points), dtype=np.float64)
+
+		for distance, taper in ((points[:, 0] - xMin, xMinTaper), (xMax - points[:, 0], xMaxTaper),
+								(points[:, 1] - yMin, yMinTaper), (yMax - points[:, 1], yMaxTaper)):
+			if (taper > 0):
+				t = np.clip(distance / taper, 0.0, 1.0)
+				weights *= t * t * (3.0 - 2.0 * t)
+
+		return weights
+
+	def isDefinedAt(self, point):
+		return self._validExtents.contain(point)
+
+	@property
+	def validExtents(self):
+		return self._validExtents
+
+	@property
+	def undefinedValue(self):
+		return self._undefinedVal
+
+	@property
+	def tiles(self):
+		return list(zip(self._tileExtents, self._tapers, self._tileFields))
@@ -0,0 +1,212 @@
+import numpy as np
+import pickle
+
+from . import extents
+from .base import FieldRepresentation
+
+class RasterizedFieldRepresentation(FieldRepresentation):
+	"""Vector field stored as samples on a regular lattice and reconstructed
+	by bilinear or bicubic (Catmull-Rom) interpolation
+
+	The lattice is a contiguous float32 array of shape (nx, ny, 2) whose
+	nodes span the field extents, node (i, j) lying at
+	(xMin + i * dx, yMin + j * dy). It may be a read-only memory map, in which
+	case pickling only stores the file name so worker processes share the
+	same pages instead of receiving a copy.
+
+	Error bound:
+		For a source field with continuous second derivatives, bilinear
+		interpolation error on each component is at most
+		(dx^2 * max|f_xx| + dy^2 * max|f_yy|) / 8. Bicubic error is O(h^3)
+		away from the lattice border, where the clamped neighbourhood
+		reduces it to bilinear order.
+		Source fields built from piecewise components (e.g. compound
+		scenarios) are discontinuous at component boundaries, where error
+		is only bounded by the jump in the field within one lattice cell.
+		errorBound holds the measured maximum component error against the
+		source at the cell midpoints, where interpolation error peaks, and
+		includes float32 rounding.
+
+	"""
+
+	def __init__(self, lattice, xRange, yRange, interpolation='bilinear',
+		undefinedValue=(0.0, 0.0), errorBound=None):
+		"""Stores lattice and the extents it spans
+
+		Args:
+			lattice (ndarray): (nx, ny, 2) array of field samples, nx, ny >= 2
+			xRange (2-Tuple): (xMin, xMax) spanned by the lattice
+			yRange (2-Tuple): (yMin, yMax) spanned by the lattice
+			interpolation (string): 'bilinear' or 'bicubic'
+			undefinedValue (2-Tuple): value to return when sampling outside of extents
+			errorBound (double): measured interpolation error against the source
+
+		"""
+		self._lattice = lattice
+		self._fileName = None
+
+		self._xMin, self._xMax = xRange
+		self._yMin, self._yMax = yRange
+		self._xCount, self._yCount = lattice.shape[:2]
+		self._dx = (self._xMax - self._xMin) / (self._xCount - 1)
+		self._dy = (self._yMax - self._yMin) / (self._yCount - 1)
+
+		self._validExtents = extents.FieldExtents(xRange, yRange)
+		self._undefinedVal = undefinedValue
+		self._errorBound = errorBound
+
+		self.setInterpolation(interpolation)
+
+	def setInterpolation(self, interpolation):
+		self._interpolation = interpolation
+		interpFuncName = '_' + interpolation
+		self._interpFunc = getattr(self, interpFuncName, self._bilinear)
+
+	def setErrorBound(self, errorBound):
+		self._errorBound = errorBound
+
+	def __getitem__(self, index):
+		value = self.sampleAtPoints([index])[0]
+		return (float(value[0]), float(value[1]))
+
+	def sampleAtPoints(self, points):
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		values = np.empty((len(points), 2), dtype=np.float64)
+		values[:] = self._undefinedVal
+
+		mask = self._validExtents.containPoints(points)
+		if (mask.any()):
+			values[mask] = self._interpFunc(points[mask])
+
+		return values
+
+	def _bilinear(self, points):
+		i, tx = self._cellCoordinates(points[:, 0], self._xMin, self._dx, self._xCount)
+		j, ty = self._cellCoordinates(points[:, 1], self._yMin, self._dy, self._yCount)
+
+		tx = tx[:, np.newaxis]
+		ty = ty[:, np.newaxis]
+		lattice = self._lattice
+
+		return ((1 - tx) * (1 - ty) * lattice[i, j] + tx * (1 - ty) * lattice[i + 1, j] +
+				(1 - tx) * ty * lattice[i, j + 1] + tx * ty * lattice[i + 1, j + 1])
+
+	def _bicubic(self, points):
+		i, tx = self._cellCoordinates(points[:, 0], self._xMin, self._dx, self._xCount)
+		j, ty = self._cellCoordinates(points[:, 1], self._yMin, self._dy, self._yCount)
+
+		xWeights = self._catmullRomWeights(tx)
+		yWeights = self._catmullRomWeights(ty)
+
+		values = np.zeros((len(points), 2), dtype=np.float64)
+
+		# Clamp the 4x4 neighbourhood at the lattice border
+		for a in range(4):
+			xi = np.clip(i + a - 1, 0, self._xCount - 1)
+			for b in range(4):
+				yj = np.clip(j + b - 1, 0, self._yCount - 1)
+				weight = (xWeights[a] * yWeights[b])[:, np.newaxis]
+				values += weight * self._lattice[xi, yj]
+
+		return values
+
+	def _cellCoordinates(self, coords, origin, spacing, count):
+		""" Returns lower node index of the cell containing each coordinate and
+			the fractional position within that cell
+
+		"""
+		position = (coords - origin) / spacing
+		cells = np.clip(np.floor(position).astype(np.int64), 0, count - 2)
+
+		return (cells, position - cells)
+
+	def _catmullRomWeights(self, t):
+		t2 = t * t
+		t3 = t2 * t
+
+		return (0.5 * (-t3 + 2 * t2 - t),
+				0.5 * (3 * t3 - 5 * t2 + 2),
+				0.5 * (-3 * t3 + 4 * t2 + t),
+				0.5 * (t3 - t2))
+
+	def save(self, fileName):
+		""" Saves lattice as a .npy file which can be memory mapped, with the
+			remaining parameters pickled alongside it in fileName.meta.
+			.npy is appended to fileName if missing, as np.save does
+
+		"""
+		fileName = self._npyName(fileName)
+		np.save(fileName, self._lattice)
+
+		with open(fileName + '.meta', 'wb') as f:
+			pickle.dump(self._metadata(), f)
+
+	@classmethod
+	def load(cls, fileName, mmap=True):
+		""" Loads a lattice saved with save, memory mapped read-only by default
+
+		"""
+		fileName = cls._npyName(fileName)
+
+		with open(fileName + '.meta', 'rb') as f:
+			metadata = pickle.load(f)
+
+		lattice = np.load(fileName, mmap_mode='r' if mmap else None)
+
+		rep = cls(lattice, **metadata)
+
+		if (mmap):
+			rep._fileName = fileName
+
+		return rep
+
+	@staticmethod
+	def _npyName(fileName):
+		if (not fileName.endswith('.npy')):
+			fileName += '.npy'
+
+		return fileName
+
+	def _metadata(self):
+		return {'xRange':(self._xMin, self._xMax), 'yRange':(self._yMin, self._yMax),
+				'interpolation':self._interpolation, 'undefinedValue':self._undefinedVal,
+				'errorBound':self._errorBound}
+
+	def __getstate__(self):
+		if (self._fileName is None):
+			state = self.__dict__.copy()
+			# Bound interpolation method is restored from its name
+			del state['_interpFunc']
+			return state
+
+		return {'_fileName':self._fileName, '_metadata':self._metadata()}
+
+	def __setstate__(self, state):
+		if ('_metadata' in state):
+			# Memory mapped lattice, reopen file instead of copying data
+			fileName = self._npyName(state['_fileName'])
+			lattice = np.load(fileName, mmap_mode='r')
+			self.__init__(lattice, **state['_metadata'])
+			self._fileName = fileName
+		else:
+			self.__dict__.update(state)
+			self.setInterpolation(self._interpolation)
+
+	def isDefinedAt(self, point):
+		return self._validExtents.contain(point)
+
+	@property
+	def validExtents(self):
+		return self._validExtents
+
+	@property
+	def lattice(self):
+		return self._lattice
+
+	@property
+	def spacing(self):
+		return (self._dx, self._dy)
+
+	@property
+	def errorBound(self):
+		return self._errorBound
@@ -1,4 +1,7 @@
+import numpy as np
+
 from . import extents
+from .index import ExtentsBucketIndex
 from .base import FieldRepresentation
 
 class ScalarFieldRepresenation(FieldRepresentation):
@@ -33,28 +36,59 @@ class VectorFieldRepresentation(FieldRepresentation):
 
 	"""
 
-	def __init__(self, function, fieldExtents, undefinedValue=(0.0, 0.0)):
+	def __init__(self, function, fieldExtents, undefinedValue=(0.0, 0.0), vectorized=False):
 		"""Stores closed form represenation of vector field and valid extents
 
 		Args:
 			function (func): function mapping points in the field to vector values
 			extents (FieldExtents): extents over which function is valid/applies
 			undefinedValue (2-Tuple): value to return when sampling outside of extents
+			vectorized (bool): whether function accepts coordinate arrays in place
+				of scalars and returns a pair of arrays (or broadcastable values)
 
 		"""
 		self._fieldFunc = function
 		self._validExtents = fieldExtents
 		self._undefinedVal = undefinedValue
+		self._vectorized = vectorized
 
 	def __getitem__(self, index):
 		if (self._validExtents.contain(index)):
 			# if in valid region, return function value
 			x, y = index
+
+			if (getattr(self, '_vectorized', False)):
+				# Vectorized functions return 0-d arrays for scalar inputs
+				vx, vy = self._fieldFunc(x, y)
+				return (float(vx), float(vy))
+
 			return self._fieldFunc(x, y)
 		else:
 			# not in valid region, return default value
 			return self._undefinedVal
 
+	def sampleAtPoints(self, points):
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		values = np.empty((len(points), 2), dtype=np.float64)
+		values[:] = self._undefinedVal
+
+		mask = self._validExtents.containPoints(points)
+		if (not mask.any()):
+			return values
+
+		x = points[mask, 0]
+		y = points[mask, 1]
+
+		# Representations unpickled from older scenario files lack the flag
+		if (getattr(self, '_vectorized', False)):
+			vx, vy = self._fieldFunc(x, y)
+			values[mask, 0] = vx
+			values[mask, 1] = vy
+		else:
+			values[mask] = [self._fieldFunc(xi, yi) for xi, yi in zip(x, y)]
+
+		return values
+
 	def isDefinedAt(self, point):
 		return self._validExtents.contain(point)
 
@@ -62,6 +96,10 @@ class VectorFieldRepresentation(FieldRepresentation):
 	def validExtents(self):
 		return self._validExtents
 
+	@property
+	def undefinedValue(self):
+		return self._undefinedVal
+
 
 class CompoundVectorFieldRepresentation(FieldRepresentation):
 	"""Class implementation for  a vector field made up of a group of component
@@ -98,6 +136,8 @@ class CompoundVectorFieldRepresentation(FieldRepresentation):
 			# Define extents which emcompass all component extents
 			self._validExtents = extents.EncompassingExtents(validExtents)
 
+		self._buildIndex()
+
 	def __getitem__(self, index):
 		value = self._undefinedVal
 
@@ -110,11 +150,51 @@ class CompoundVectorFieldRepresentation(FieldRepresentation):
 				# initialize None value to (0,0), will be overwritten by component
 				value = (0.0, 0.0)
 
-			for field in self._componentFields:
-				value = tuple(map(lambda x,y: x + y, value, field[index]))
+			vx, vy = value
+
+			# Only visit components whose extents may contain the point
+			for componentIndex in self._spatialIndex().candidates(index):
+				cx, cy = self._componentFields[componentIndex][index]
+				vx += cx
+				vy += cy
+
+			value = (vx, vy)
 
 		return value
 
+	def sampleAtPoints(self, points):
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		values = np.empty((len(points), 2), dtype=np.float64)
+
+		# Points outside of piecewise extents have no defined value
+		undefinedVal = self._undefinedVal
+		values[:] = np.nan if undefinedVal is None else undefinedVal
+
+		mask = self._validExtents.containPoints(points)
+		if (not mask.any()):
+			return values
+
+		validPoints = points[mask]
+		summed = np.zeros((len(validPoints), 2), dtype=np.float64)
+
+		if (undefinedVal is not None):
+			summed[:] = undefinedVal
+
+		spatialIndex = self._spatialIndex()
+		buckets = spatialIndex.bucketsOf(validPoints)
+
+		for componentIndex, field in enumerate(self._componentFields):
+			selected = spatialIndex.componentMask(componentIndex, buckets)
+
+			if (selected.all()):
+				summed += field.sampleAtPoints(validPoints)
+			elif (selected.any()):
+				summed[selected] += field.sampleAtPoints(validPoints[selected])
+
+		values[mask] = summed
+
+		return values
+
 	def addField(self, fieldRep):
 		# todo: check for mixing piecewise and encompassing exents
 
@@ -128,10 +208,44 @@ class CompoundVectorFieldRepresentation(FieldRepresentation):
 
 		self._validExtents.addExtents(fieldRep.validExtents)
 
+		self._buildIndex()
+
+	def _buildIndex(self):
+		""" Rebuilds the bucket index over component extents
+
+		"""
+		indexedExtents = [self._indexedExtents(field) for field in self._componentFields]
+		self._index = ExtentsBucketIndex(indexedExtents)
+
+	def _indexedExtents(self, fieldRep):
+		""" Components can only be skipped outside of their extents if they
+			contribute nothing there, all others are visited for every point
+
+		"""
+		if (not isinstance(fieldRep, (VectorFieldRepresentation, CompoundVectorFieldRepresentation))):
+			return None
+
+		undefinedVal = fieldRep.undefinedValue
+		if (undefinedVal is not None and any(undefinedVal)):
+			return None
+
+		return fieldRep.validExtents
+
+	def _spatialIndex(self):
+		# Representations unpickled from older scenario files have no index
+		if (getattr(self, '_index', None) is None):
+			self._buildIndex()
+
+		return self._index
+
 	@property
 	def validExtents(self):
 		return self._validExtents
 
+	@property
+	def undefinedValue(self):
+		return self._undefinedVal
+
 	@property
 	def components(self):
 		return self._componentFields
\ No newline at end of file
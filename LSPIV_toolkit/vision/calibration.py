@@ -1,8 +1,11 @@
 import cv2
+import os
 import pickle
 import glob
 import numpy as np
 
+from ..core.vf.raster_representation import RasterizedFieldRepresentation
+
 class FisheyeCameraModel(object):
 	""" Class for loading calibration settings and rectifying images accordingly
 
@@ -19,15 +22,38 @@ class FisheyeCameraModel(object):
 		self._imgSize = imgSize
 		self._initialized = False
 
+		# Calibration file the model was loaded from, rectify maps are
+		# persisted next to it
+		self._modelFile = None
+
+		# Rectify maps, the cropped ones are built at initialize and the full
+		# image ones only if undistortImage is used
+		self._cropMaps = None
+		self._fullMaps = None
+
+		# Optional lattice of undistorted positions of sensor points
+		self._undistortionLUT = None
+
 	def loadModel(self, fileName):
 		with open(fileName, 'rb') as f:
 			(self._K, self._D) = pickle.load(f)
 
+		self._modelFile = fileName
+
 	def saveModel(self, fileName):
 		with open(fileName, 'wb') as f:
 			pickle.dump((self._K, self._D), f)
 
-	def initialize(self, imgSize):
+	def initialize(self, imgSize, mapFile=None):
+		""" Computes the undistorted camera matrix, the crop bounds of the
+			undistorted image and the rectify maps cropped to them
+
+			Maps are loaded from mapFile (by default the calibration file
+			name with .maps.npz appended, .npz is appended to names without
+			it) if it was saved for the same model and image size,
+			otherwise they are computed and saved there
+
+		"""
 		# Todo: store this as part of the model
 		self._imgSize = imgSize
 
@@ -41,28 +67,244 @@ class FisheyeCameraModel(object):
 		newK[1,2] = self._imgSize[1] / 2
 
 		self._newK = newK
+		self._fullMaps = None
+		self._undistortionLUT = None
+
+		self._cropBounds = self._computeCropBounds()
+
+		if (mapFile is None and self._modelFile is not None):
+			mapFile = self._modelFile + '.maps.npz'
+		elif (mapFile is not None and not mapFile.endswith('.npz')):
+			# np.savez appends .npz, load from the file actually written
+			mapFile += '.npz'
+
+		if (mapFile is None or not self._loadMaps(mapFile)):
+			self._cropMaps = self._buildCropMaps()
+
+			if (mapFile is not None):
+				self._saveMaps(mapFile)
 
 		self._initialized = True
 
-	def undistortPoints(self, points):
+	def _computeCropBounds(self):
+		height, width = self._imgSize
+
+		corners = [[0,0], [0, height], [width, 0], [width, height]]
+
+		pts = self.undistortPoints(corners, exact=True)
+
+		#todo: change to crop to smallest rectangle enclosing all corners
+		x, y = pts[0]
+		r, b = pts[3]
+
+		return [int(x), int(y), int(r), int(b)]
+
+	def _buildFullMaps(self):
+		return cv2.fisheye.initUndistortRectifyMap(self._K, self._D, np.eye(3),
+			self._newK, self._imgSize, cv2.CV_16SC2)
+
+	def _buildCropMaps(self):
+		""" Full image rectify maps restricted to the crop bounds. Remap is a
+			per pixel lookup, so remapping with these equals cropping the
+			full undistorted image
+
+		"""
+		x, y, r, b = self._cropBounds
+		map1, map2 = self._buildFullMaps()
+
+		return (np.ascontiguousarray(map1[y:b, x:r]), np.ascontiguousarray(map2[y:b, x:r]))
+
+	def _saveMaps(self, fileName):
+		try:
+			np.savez(fileName, map1=self._cropMaps[0], map2=self._cropMaps[1],
+				K=self._K, D=self._D, newK=self._newK, imgSize=np.asarray(self._imgSize),
+				cropBounds=np.asarray(self._cropBounds))
+		except (IOError, OSError) as e:
+			print("Warning: Could not save rectify maps to ", fileName, e)
+
+	def _loadMaps(self, fileName):
+		""" Loads cropped rectify maps, returns False if the file does not
+			exist or was saved for a different model or image size
+
+		"""
+		if (not os.path.exists(fileName)):
+			return False
+
+		with np.load(fileName) as data:
+			valid = (np.array_equal(data['K'], self._K) and np.array_equal(data['D'], self._D) and
+					np.array_equal(data['newK'], self._newK) and
+					np.array_equal(data['imgSize'], np.asarray(self._imgSize)) and
+					np.array_equal(data['cropBounds'], np.asarray(self._cropBounds)))
+
+			if (not valid):
+				return False
+
+			self._cropMaps = (data['map1'], data['map2'])
+
+		return True
+
+	def undistortPoints(self, points, exact=False):
+		""" Undistorts Nx2 image points. Uses the undistortion lookup table
+			if one has been enabled (and exact is not set), falling back to
+			the iterative solver for points outside of the image
+
+		"""
 		points = np.asarray(points)
 		assert points.ndim == 2 and points.shape[1] == 2
 
+		if (self._undistortionLUT is not None and not exact):
+			return np.squeeze(self._lookupPoints(points))
+
+		return np.squeeze(self._solvePoints(points))
+
+	def _solvePoints(self, points):
 		if points.ndim == 2:
 			points = np.expand_dims(points, 0)
 
 		undistorted = cv2.fisheye.undistortPoints(points.astype(np.float32), self._K, self._D, R=np.eye(3), P=self._newK)
 
-		return np.squeeze(undistorted)
+		return undistorted.reshape(-1, 2)
 
-	def undistortImage(self, img):
-		map1, map2 = cv2.fisheye.initUndistortRectifyMap(self._K, self._D, np.eye(3),
-			self._newK, self._imgSize, cv2.CV_16SC2)
+	def _lookupPoints(self, points):
+		undistorted = self._undistortionLUT.sampleAtPoints(points)
+
+		# Points outside of the lattice are solved exactly
+		outside = np.isnan(undistorted[:, 0])
+		if (outside.any()):
+			undistorted[outside] = self._solvePoints(points[outside])
+
+		return undistorted.astype(np.float32)
+
+	def enableUndistortionLUT(self, spacing=2.0, fileName=None):
+		""" Replaces the iterative point undistortion solver with bilinear
+			lookup in a lattice of undistorted sensor positions covering the
+			image, with nodes spacing pixels apart
+
+			The lattice is loaded from fileName (by default the calibration
+			file name with .lut.npz appended) if it was saved for the same
+			model, image size and spacing, otherwise it is built and saved
+			there. Its maximum error against the solver, measured at the
+			lattice cell midpoints, is available as undistortionLUTError.
+			Must be called after initialize. Only pays off where the solver
+			is slow, recent OpenCV builds solve about as fast as the lookup
+
+		"""
+		if (not self._initialized):
+			print("Error: Camera model must be initialized before enabling LUT")
+			return None
+
+		if (fileName is None and self._modelFile is not None):
+			fileName = self._modelFile + '.lut.npz'
+		elif (fileName is not None and not fileName.endswith('.npz')):
+			# np.savez appends .npz, load from the file actually written
+			fileName += '.npz'
+
+		if (fileName is None or not self._loadLUT(fileName, spacing)):
+			self._undistortionLUT = self._buildLUT(spacing)
+
+			if (fileName is not None):
+				self._saveLUT(fileName, spacing)
+
+		return self._undistortionLUT.errorBound
+
+	def disableUndistortionLUT(self):
+		self._undistortionLUT = None
+
+	def _buildLUT(self, spacing):
+		height, width = self._imgSize
+		xCount = int(np.ceil(width / spacing)) + 1
+		yCount = int(np.ceil(height / spacing)) + 1
+
+		xs = np.linspace(0, width, xCount)
+		ys = np.linspace(0, height, yCount)
+		nodes = np.stack(np.meshgrid(xs, ys, indexing='ij'), axis=-1).reshape(-1, 2)
+
+		lattice = self._solvePoints(nodes).reshape(xCount, yCount, 2)
+
+		lut = RasterizedFieldRepresentation(lattice, (0, width), (0, height),
+			undefinedValue=(np.nan, np.nan))
+
+		# Interpolation error peaks at the cell midpoints
+		midX = 0.5 * (xs[:-1] + xs[1:])
+		midY = 0.5 * (ys[:-1] + ys[1:])
+		midpoints = np.stack(np.meshgrid(midX, midY, indexing='ij'), axis=-1).reshape(-1, 2)
+
+		error = np.linalg.norm(lut.sampleAtPoints(midpoints) - self._solvePoints(midpoints), axis=-1)
+		lut.setErrorBound(float(error.max()))
+
+		return lut
+
+	def _saveLUT(self, fileName, spacing):
+		lut = self._undistortionLUT
+
+		try:
+			np.savez(fileName, lattice=lut.lattice, K=self._K, D=self._D, newK=self._newK,
+				imgSize=np.asarray(self._imgSize), spacing=spacing, maxError=lut.errorBound)
+		except (IOError, OSError) as e:
+			print("Warning: Could not save undistortion LUT to ", fileName, e)
+
+	def _loadLUT(self, fileName, spacing):
+		if (not os.path.exists(fileName)):
+			return False
+
+		with np.load(fileName) as data:
+			valid = (np.array_equal(data['K'], self._K) and np.array_equal(data['D'], self._D) and
+					np.array_equal(data['newK'], self._newK) and
+					np.array_equal(data['imgSize'], np.asarray(self._imgSize)) and
+					float(data['spacing']) == spacing)
+
+			if (not valid):
+				return False
+
+			height, width = self._imgSize
+			self._undistortionLUT = RasterizedFieldRepresentation(data['lattice'],
+				(0, width), (0, height), undefinedValue=(np.nan, np.nan),
+				errorBound=float(data['maxError']))
+
+		return True
+
+	def undistortImage(self, img, out=None):
+		""" Undistorts full image, written into out if given
+
+		"""
+		if (self._fullMaps is None):
+			self._fullMaps = self._buildFullMaps()
+
+		map1, map2 = self._fullMaps
+
+		return cv2.remap(img, map1, map2, interpolation=cv2.INTER_LINEAR, dst=out,
+			borderMode=cv2.BORDER_CONSTANT)
+
+	def undistortCroppedImage(self, img, out=None):
+		""" Undistorts image and crops it to cropBounds in a single remap,
+			written into out (e.g. a buffer reused across frames) if given
+
+		"""
+		map1, map2 = self._cropMaps
+
+		return cv2.remap(img, map1, map2, interpolation=cv2.INTER_LINEAR, dst=out,
+			borderMode=cv2.BORDER_CONSTANT)
+
+	def croppedImageBuffer(self, img):
+		""" Allocates an output buffer for undistortCroppedImage of img
+
+		"""
+		return np.empty(self._cropMaps[0].shape[:2] + img.shape[2:], dtype=img.dtype)
+
+	@property
+	def cropBounds(self):
+		return self._cropBounds
+
+	@property
+	def undistortionLUTError(self):
+		""" Max distance (pixels) between lookup and solver results, None
+			if no lookup table is enabled
 
-		undistorted = cv2.remap(img, map1, map2,
-			interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+		"""
+		if (self._undistortionLUT is None):
+			return None
 
-		return undistorted
+		return self._undistortionLUT.errorBound
 
 	@property
 	def initialized(self):
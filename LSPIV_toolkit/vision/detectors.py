@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+
 class GridFeatureDetector(object):
 	""" Class to run feature detector on an image in order to generate uniform
 		number of measurements in each grid cell across image. Used to deal with
@@ -10,9 +12,10 @@ class GridFeatureDetector(object):
 
 	"""
 
-	def __init__(self, detector, gridDim=(2,2), partitionMethod='subimage', borderBuffer=0):
+	def __init__(self, detector, gridDim=(2,2), partitionMethod='subimage', borderBuffer=0, numThreads=1):
 		# only supports cv2.goodFeaturesToTrack right now
-		# partitionMethod subimage is fastest method
+		# partitionMethod subimage is fastest serial method, tiled runs the
+		# subimage cells on a pool of numThreads threads
 		# buffer describes region around image border to ignore
 		# todo: add support for ORB
 		self._featureDetector = detector
@@ -22,12 +25,27 @@ class GridFeatureDetector(object):
 
 		self._buffer = borderBuffer
 
+		# Thread pool is only created the first time tiled detection runs
+		self._numThreads = numThreads
+		self._executor = None
+
 		self.setGrid(gridDim)
 
 	def setGrid(self, gridDim):
 		self._gridDimensions = gridDim
 		self._numCells = gridDim[0] * gridDim[1]
 
+		# Cell layouts depend on the grid, drop those computed for the old one
+		self._cellLayouts = {}
+
+	def close(self):
+		""" Shuts down the thread pool used by tiled detection
+
+		"""
+		if (self._executor is not None):
+			self._executor.shutdown()
+			self._executor = None
+
 	def detect(self, img, mask, params, numFeatures=None):
 		if ('maxCorners' in params):
 			# goodFeaturesToTrack parameter
@@ -87,26 +105,90 @@ class GridFeatureDetector(object):
 		# Set desired number of features to features per cell
 		params['maxCorners'] = self._numFeaturesPerCell
 
-		# Declare features array
-		features = None
-		
-		for i in np.arange(self._buffer, img.shape[0]-heightStep-self._buffer+1, heightStep):
-			for j in np.arange(self._buffer, img.shape[1]-widthStep-self._buffer+1, widthStep):
-				#print(i, i+heightStep, j, j+widthStep)
-				searchMask = mask[i:(i+heightStep), j:(j+widthStep)]
-				subImg = img[i:(i+heightStep), j:(j+widthStep)]
+		cells = self._cellLayout(img.shape, heightStep, widthStep)
+		cellFeatures = (self._detectCell(img, mask, params, cell) for cell in cells)
 
-				newFeatures = self._featureDetector(subImg, mask=searchMask, **params)
+		return self._mergeCells(cellFeatures, len(cells))
 
-				if (newFeatures is not None):
-					newFeatures += np.array([j, i])
+	def _tiled(self, img, mask, params, heightStep, widthStep):
+		""" Runs the subimage partition with the cells dispatched to a thread
+			pool. OpenCV releases the GIL while detecting, so cells run
+			concurrently. Results are merged in cell order and are identical
+			to those of the subimage method
 
-					if (features is None):
-						features = newFeatures
-					else:
-						features = np.concatenate((features, newFeatures))
+		"""
+		if (self._numThreads is None or self._numThreads < 2):
+			return self._subimage(img, mask, params, heightStep, widthStep)
 
-		return features
+		if (self._executor is None):
+			self._executor = ThreadPoolExecutor(max_workers=self._numThreads)
+
+		# Set desired number of features to features per cell
+		params['maxCorners'] = self._numFeaturesPerCell
+
+		cells = self._cellLayout(img.shape, heightStep, widthStep)
+		cellFeatures = self._executor.map(lambda cell: self._detectCell(img, mask, params, cell), cells)
+
+		return self._mergeCells(cellFeatures, len(cells))
+
+	def _cellLayout(self, shape, heightStep, widthStep):
+		""" Returns the cells of the grid as a list of (rowSlice, colSlice,
+			offset) tuples, cached per image shape
+
+		"""
+		key = (shape[0], shape[1])
+		layout = self._cellLayouts.get(key)
+
+		if (layout is None):
+			layout = []
+			for i in np.arange(self._buffer, shape[0]-heightStep-self._buffer+1, heightStep):
+				for j in np.arange(self._buffer, shape[1]-widthStep-self._buffer+1, widthStep):
+					offset = np.array([j, i], dtype=np.float32)
+					layout.append((slice(i, i+heightStep), slice(j, j+widthStep), offset))
+
+			self._cellLayouts[key] = layout
+
+		return layout
+
+	def _detectCell(self, img, mask, params, cell):
+		rows, cols, offset = cell
+
+		searchMask = None if mask is None else mask[rows, cols]
+		newFeatures = self._featureDetector(img[rows, cols], mask=searchMask, **params)
+
+		if (newFeatures is not None):
+			newFeatures += offset
+
+		return newFeatures
+
+	def _mergeCells(self, cellFeatures, numCells):
+		""" Copies per cell features, in cell order, into a single buffer sized
+			for the per cell feature quota
+
+		"""
+		features = np.empty((numCells * max(self._numFeaturesPerCell, 0), 1, 2), dtype=np.float32)
+		count = 0
+
+		for newFeatures in cellFeatures:
+			if (newFeatures is None or len(newFeatures) < 1):
+				continue
+
+			newFeatures = newFeatures.reshape(-1, 1, 2)
+			end = count + len(newFeatures)
+
+			if (end > len(features)):
+				# Detector returned more than its quota (e.g. unlimited maxCorners)
+				grown = np.empty((max(end, 2 * len(features)), 1, 2), dtype=np.float32)
+				grown[:count] = features[:count]
+				features = grown
+
+			features[count:end] = newFeatures
+			count = end
+
+		if (count < 1):
+			return None
+
+		return features[:count]
 
 	def _nopartition(self, img, mask, params, heightStep, widthStep):
 		params['maxCorners'] = self._numTotalFeatures
@@ -0,0 +1,416 @@
+import cv2
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from ..core import tracking
+from . import trackers
+
+def _trackChunk(chunk):
+	""" Runs an independent LK tracker over one chunk of an image sequence.
+		Defined at module level so it can be sent to worker processes
+
+		Returns (frames, positions) arrays for every track in the chunk with
+		at least two observations, frames being global frame indices
+
+	"""
+	fileNames, firstFrame, timestep, lkParams, featureParams, trackerArgs = chunk
+
+	tracker = trackers.LKOpticalFlowTracker(lkParams, featureParams,
+		retainLostTracks=True, **trackerArgs)
+
+	try:
+		for index, fileName in enumerate(fileNames):
+			img = cv2.imread(fileName)
+
+			if (img is None):
+				print("Error: Could not read image ", fileName)
+				continue
+
+			tracker.processImage(img, (firstFrame + index) * timestep)
+	finally:
+		tracker.close()
+
+	chunkTracks = []
+	for track in tracker.getLostTracks() + tracker.getTracks():
+		if (track.size() < 2):
+			continue
+
+		frames = np.rint(track.times / timestep).astype(np.int64)
+		chunkTracks.append((frames, np.array(track.positions)))
+
+	return chunkTracks
+
+
+class ChunkedTrackingPipeline(object):
+	""" Runs LK tracking over a long image sequence split into overlapping
+		temporal chunks, each tracked independently in a process pool
+
+		Tracks are stitched across chunk boundaries: a track which starts in
+		the overlap of a chunk with the previous one is joined to the
+		previous chunk track at the same location when the two keep a
+		constant offset over the frames both cover. The joined track follows
+		the previous track to its end and continues with the new one shifted
+		by that offset, so no spurious displacement appears at the join.
+		Stitched tracks are converted to measurements and merged into a
+		single MeasurementProcessor
+
+		A new track which starts next to a previous track but does not
+		move with it is not joined. As both chunks may have followed the
+		same feature through the overlap, the new track is cut to the
+		frames after the previous chunk, so the overlap is only measured
+		once. Tracks which start in the overlap away from any previous
+		track are kept whole
+
+		Fresh trackers only detect the strongest features at the start of a
+		chunk, so the fraction of tracks carried across a boundary grows with
+		the number of detection intervals the overlap spans
+
+	"""
+
+	def __init__(self, lkParams, featureParams, timestep, chunkSize=900, overlap=30,
+		numProcesses=None, trackerArgs=None, stitchTolerance=2.0):
+		""" Sets up pipeline parameters
+
+		Args:
+			lkParams (dict): parameters for cv2.calcOpticalFlowPyrLK
+			featureParams (dict): parameters for cv2.goodFeaturesToTrack
+			timestep (double): time between consecutive images
+			chunkSize (int): number of images per chunk, including overlap
+			overlap (int): number of images shared by consecutive chunks,
+				should span at least one detection interval
+			numProcesses (int): worker processes, defaults to number of cores
+			trackerArgs (dict): extra keyword arguments for LKOpticalFlowTracker
+			stitchTolerance (double): max distance in pixels between tracks
+				of consecutive chunks, and max variation of their offset, for
+				them to be stitched
+
+		"""
+		if (overlap >= chunkSize):
+			raise ValueError('Chunk overlap must be smaller than chunk size')
+
+		self._lkParams = lkParams
+		self._featureParams = featureParams
+		self._timestep = timestep
+		self._chunkSize = chunkSize
+		self._overlap = overlap
+		self._numProcesses = numProcesses
+		self._trackerArgs = {} if trackerArgs is None else trackerArgs
+		self._stitchTolerance = stitchTolerance
+
+	def run(self, fileNames, measurementProcessor, frameTransformation=None, minTrackAge=0.5):
+		""" Tracks the image sequence and adds measurements of all stitched
+			tracks to measurementProcessor. Returns the stitched tracks
+
+		"""
+		tracks = self.trackSequence(fileNames)
+		self.addMeasurements(tracks, measurementProcessor, frameTransformation, minTrackAge)
+
+		return tracks
+
+	def chunks(self, numFrames):
+		""" Returns (start, end) frame bounds of each chunk
+
+		"""
+		bounds = []
+		start = 0
+
+		while (start < numFrames):
+			end = min(start + self._chunkSize, numFrames)
+			bounds.append((start, end))
+
+			if (end >= numFrames):
+				break
+
+			start = end - self._overlap
+
+		return bounds
+
+	def trackSequence(self, fileNames):
+		""" Tracks all chunks in parallel and returns the stitched tracks as
+			Track objects with timestamps frameIndex * timestep
+
+		"""
+		bounds = self.chunks(len(fileNames))
+		jobs = [(fileNames[start:end], start, self._timestep, self._lkParams,
+				self._featureParams, self._trackerArgs) for (start, end) in bounds]
+
+		if (self._numProcesses == 1):
+			stitched = self._stitchChunks(map(_trackChunk, jobs))
+		else:
+			with ProcessPoolExecutor(max_workers=self._numProcesses) as executor:
+				# Chunks are delivered in order, so stitching overlaps with tracking
+				stitched = self._stitchChunks(executor.map(_trackChunk, jobs))
+
+		tracks = []
+		for frames, positions in stitched:
+			track = tracking.Track()
+			track.addObservations(positions, frames * self._timestep)
+			tracks.append(track)
+
+		return tracks
+
+	def addMeasurements(self, tracks, measurementProcessor, frameTransformation=None, minTrackAge=0.5):
+		stage = MeasurementStage(frameTransformation, minTrackAge)
+		stage.process(tracks, measurementProcessor)
+
+	def _stitchChunks(self, chunkResults):
+		finished = []
+		openTracks = []
+
+		for chunkTracks in chunkResults:
+			openTracks = self._stitch(openTracks, chunkTracks, finished)
+
+		finished.extend(openTracks)
+
+		return finished
+
+	def _stitch(self, prevTracks, chunkTracks, finished):
+		""" Joins tracks of a chunk to the still open tracks of the previous
+			chunk. Previous tracks which are not continued are moved to
+			finished, returns the tracks of the chunk (stitched where matched)
+
+		"""
+		if (len(prevTracks) < 1):
+			return list(chunkTracks)
+
+		prevLastFrames = np.array([frames[-1] for frames, _ in prevTracks])
+		firstFrames = np.array([frames[0] for frames, _ in chunkTracks], dtype=np.int64)
+
+		# Only tracks starting before the previous chunk ended can be continuations
+		prevEnd = prevLastFrames.max()
+
+		candidatePairs = []
+		for frame in np.unique(firstFrames[firstFrames <= prevEnd]):
+			newIndices = np.flatnonzero(firstFrames == frame)
+			prevIndices, prevPositions = self._positionsAt(prevTracks, frame)
+
+			if (len(prevIndices) < 1):
+				continue
+
+			newPositions = np.array([chunkTracks[i][1][0] for i in newIndices])
+			dist = np.linalg.norm(newPositions[:, np.newaxis, :] - prevPositions[np.newaxis, :, :], axis=-1)
+
+			for n, p in zip(*np.nonzero(dist <= self._stitchTolerance)):
+				candidatePairs.append((dist[n, p], newIndices[n], prevIndices[p]))
+
+		candidates = set(newIndex for _, newIndex, _ in candidatePairs)
+
+		# Greedy one to one assignment, closest pairs first
+		candidatePairs.sort(key=lambda pair: pair[0])
+		stitchedNew = {}
+		stitchedPrev = set()
+
+		for _, newIndex, prevIndex in candidatePairs:
+			if (newIndex in stitchedNew or prevIndex in stitchedPrev):
+				continue
+
+			offset = self._offset(prevTracks[prevIndex], chunkTracks[newIndex])
+
+			if (offset is None):
+				continue
+
+			stitchedNew[newIndex] = (prevIndex, offset)
+			stitchedPrev.add(prevIndex)
+
+		for prevIndex, track in enumerate(prevTracks):
+			if (prevIndex not in stitchedPrev):
+				finished.append(track)
+
+		openTracks = []
+		for newIndex, (frames, positions) in enumerate(chunkTracks):
+			if (newIndex in stitchedNew):
+				prevIndex, offset = stitchedNew[newIndex]
+				prevFrames, prevPositions = prevTracks[prevIndex]
+
+				# Previous track is kept whole and continued by the new one,
+				# shifted onto it so the join adds no displacement
+				keep = frames > prevFrames[-1]
+				frames = np.concatenate((prevFrames, frames[keep]))
+				positions = np.concatenate((prevPositions, positions[keep] - offset))
+			elif (newIndex in candidates):
+				# Unjoined neighbour of a previous track, drop the frames the
+				# previous chunk already measured
+				keep = frames > prevEnd
+				if (np.count_nonzero(keep) < 2):
+					continue
+
+				frames = frames[keep]
+				positions = positions[keep]
+
+			openTracks.append((frames, positions))
+
+		return openTracks
+
+	def _positionsAt(self, tracks, frame):
+		""" Returns indices and positions of the tracks observed at frame
+
+		"""
+		indices = []
+		positions = []
+
+		for index, (frames, trackPositions) in enumerate(tracks):
+			if (frames[0] > frame or frames[-1] < frame):
+				continue
+
+			i = np.searchsorted(frames, frame)
+			if (frames[i] == frame):
+				indices.append(index)
+				positions.append(trackPositions[i])
+
+		return (np.array(indices, dtype=np.int64), np.array(positions).reshape(-1, 2))
+
+	def _offset(self, prevTrack, newTrack):
+		""" Returns the median offset of newTrack from prevTrack over their
+			common frames, None if the tracks do not move together within
+			tolerance (i.e. follow different features)
+
+		"""
+		prevFrames, prevPositions = prevTrack
+		newFrames, newPositions = newTrack
+
+		common, prevIdx, newIdx = np.intersect1d(prevFrames, newFrames, return_indices=True)
+
+		if (len(common) < 1):
+			return None
+
+		diff = newPositions[newIdx] - prevPositions[prevIdx]
+		offset = np.median(diff, axis=0)
+
+		if (np.linalg.norm(diff - offset, axis=-1).max() > self._stitchTolerance):
+			return None
+
+		return offset
+
+
+class MeasurementStage(object):
+	""" Turns a batch of tracks into measurements in a single vectorized pass
+		over their concatenated observations: tracks younger than
+		minTrackAge are dropped, the rest are transformed to the field frame
+		in one call, and velocities, localization and scores are computed
+		for all consecutive observation pairs at once. The results are
+		handed to a MeasurementProcessor as arrays, so no per measurement
+		objects are created
+
+		Points FrameTransformation has already undistorted for a track id
+		are reused, so each step only undistorts new observations
+
+		Produces the same measurements as calling transformTrack and
+		getMeasurements on each track
+
+	"""
+
+	def __init__(self, frameTransformation=None, minTrackAge=0.5, method='midpoint', scoring='time'):
+		self._frameTransformation = frameTransformation
+		self._minTrackAge = minTrackAge
+
+		methodFuncName = "_" + method
+		self._methodFunc = getattr(self, methodFuncName, self._first)
+
+		scoringFuncName = "_" + scoring
+		self._scoringFunc = getattr(self, scoringFuncName, lambda ages, lengths: 0.0)
+
+	def process(self, tracks, measurementProcessor):
+		""" Adds measurements of tracks to measurementProcessor. tracks is
+			either a TrackStore (whose active tracks are used) or a list of
+			Track objects. Returns the number of measurements added
+
+		"""
+		points, vectors, scores = self.measurementArrays(*self._history(tracks))
+		measurementProcessor.addMeasurementArrays(points, vectors, scores)
+
+		return len(scores)
+
+	def _history(self, tracks):
+		if (isinstance(tracks, tracking.TrackStore)):
+			return tracks.history() + (tracks.ids(),)
+
+		if (len(tracks) < 1):
+			return (np.empty((0, 2)), np.empty(0), np.empty(0, dtype=np.int64), None)
+
+		positions = np.concatenate([track.positions for track in tracks])
+		times = np.concatenate([track.times for track in tracks])
+		lengths = np.array([track.size() for track in tracks], dtype=np.int64)
+		trackIds = [track.trackId for track in tracks]
+
+		# Tracks without ids are always transformed in full
+		if (None in trackIds):
+			trackIds = None
+
+		return (positions, times, lengths, trackIds)
+
+	def measurementArrays(self, positions, times, lengths, trackIds=None):
+		""" Computes measurements from the observations of several tracks
+			given as flat arrays grouped by track (see TrackStore.history).
+			With trackIds, only observations not yet undistorted for a track
+			are transformed (see FrameTransformation.undistortTrackHistories)
+
+			Returns (points, vectors, scores), one row per pair of
+			consecutive observations of a track
+		"""
+		positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+		times = np.asarray(times, dtype=np.float64)
+		lengths = np.asarray(lengths, dtype=np.int64)
+
+		ends = np.cumsum(lengths)
+		starts = ends - lengths
+
+		# Skip tracks that are too young (or too short to measure)
+		ages = np.zeros(len(lengths))
+		nonEmpty = lengths > 0
+		ages[nonEmpty] = times[ends[nonEmpty] - 1] - times[starts[nonEmpty]]
+
+		keep = (lengths > 1) & (ages >= self._minTrackAge)
+
+		if (not keep.any()):
+			return (np.empty((0, 2)), np.empty((0, 2)), np.empty(0))
+
+		keptObservations = np.repeat(keep, lengths)
+		positions = positions[keptObservations]
+		times = times[keptObservations]
+		lengths = lengths[keep]
+		ages = ages[keep]
+
+		if (self._frameTransformation is not None):
+			if (trackIds is None):
+				transformedPts = self._frameTransformation.transformPoints(positions)
+			else:
+				keptIds = np.asarray(trackIds, dtype=np.int64)[keep]
+				transformedPts = self._frameTransformation.undistortTrackHistories(keptIds, positions, lengths)
+
+			positions = self._frameTransformation.toFieldFrame(transformedPts).astype(np.float64)
+
+		# Pairs of consecutive observations within the same track
+		pairs = np.ones(len(times) - 1, dtype=bool)
+		pairs[np.cumsum(lengths)[:-1] - 1] = False
+
+		deltaT = np.diff(times)[pairs][:, np.newaxis]
+		vectors = np.diff(positions, axis=0)[pairs] / deltaT
+		points = self._methodFunc(positions[:-1][pairs], positions[1:][pairs])
+
+		trackScores = np.broadcast_to(np.asarray(self._scoringFunc(ages, lengths), dtype=np.float64), (len(lengths),))
+		scores = np.repeat(trackScores, lengths - 1)
+
+		return (points, vectors, scores)
+
+	# Method Functions
+	def _first(self, p1, p2):
+		return p1
+
+	def _last(self, p1, p2):
+		return p2
+
+	def _midpoint(self, p1, p2):
+		return (p1 + p2) / 2
+
+	# Scoring Functions
+	def _time(self, ages, lengths):
+		# Length of track in time
+		return ages
+
+	def _length(self, ages, lengths):
+		# Length of track in number of measurements
+		return lengths
+
+	def _constant(self, ages, lengths):
+		return 999999
@@ -18,99 +18,311 @@ class Tracker(metaclass=ABCMeta):
 
 class LKOpticalFlowTracker(Tracker):
 
-	def __init__(self, lkParams, featureParams, detectionInterval=0.1):
+	# Shadow regions of the survey footage, as (rowStart, rowStop, colStart,
+	# colStop) slice bounds which may be None or negative
+	defaultMaskRegions = [(None, 300, -1200, None),
+						(300, 850, -1100, None),
+						(None, None, -300, None),
+						(850, 1100, -800, -400)]
+
+	def __init__(self, lkParams, featureParams, detectionInterval=0.1, detectionThreads=1,
+		maskRegions=None, exclusionRadius=5, roi=None, scale=1.0, frameStride=1,
+		adaptiveStride=False, maxStride=30, maxDisplacement=None, retainLostTracks=False):
+		""" LK tracker with optional region of interest, downscaling and frame
+			skipping. Tracks are always reported in full resolution image
+			coordinates with the timestamps of the frames they were measured
+			in, so velocities are unaffected by the processing mode
+
+		Args:
+			lkParams (dict): parameters for cv2.calcOpticalFlowPyrLK
+			featureParams (dict): parameters for cv2.goodFeaturesToTrack
+			detectionInterval (double): time between feature detections
+			detectionThreads (int): threads used for tiled feature detection
+			maskRegions (list): regions excluded from detection, see setMaskRegions
+			exclusionRadius (int): radius around track endpoints excluded from detection
+			roi (4-Tuple): (x0, y0, x1, y1) crop of the image to process
+			scale (double): downscale factor applied after cropping
+			frameStride (int): process every frameStride-th frame
+			adaptiveStride (bool): adapt frameStride to observed feature motion
+			maxStride (int): upper bound on the adaptive stride
+			maxDisplacement (double): target displacement between processed
+				frames in processed pixels, defaults to half the LK window
+			retainLostTracks (bool): keep history of lost tracks for getLostTracks
+
+		"""
 		self._lkParams = lkParams
 		self._featureParams = featureParams
 
+		self._roi = roi
+		self._roiOffset = np.zeros(2) if roi is None else np.array(roi[:2], dtype=np.float64)
+		self._scale = float(scale)
+
+		self._frameStride = max(1, int(frameStride))
+		self._framesSinceProcessed = 0
+		self._adaptiveStride = adaptiveStride
+		self._maxStride = maxStride
+
+		if (maxDisplacement is None):
+			maxDisplacement = lkParams.get('winSize', (21, 21))[0] / 2.0
+		self._maxDisplacement = maxDisplacement
+
 		self._prevImg = None
 		self._prevTimestamp = None
 
-		self._activeTracks = []
+		self._trackStore = tracking.TrackStore(retainLost=retainLostTracks)
 		self._detectionInterval = detectionInterval
 		self._prevDetectionTime = None
 
 		self._deviationThreshold = 1
 
-	def processImage(self, img, timestamp):
-		# Todo: Check if input is already grayscale
-		grayImg = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-		trackEndpoints = self.getTrackEndpoints()
-
-		newTracks = []
+		# Detector is kept across frames so its cell layout is only computed once
+		partitionMethod = 'tiled' if detectionThreads > 1 else 'subimage'
+		self._gridDetector = detectors.GridFeatureDetector(cv2.goodFeaturesToTrack, (15,20),
+			partitionMethod=partitionMethod, borderBuffer=35, numThreads=detectionThreads)
+
+		# Static search mask is built once per image size, the endpoint
+		# exclusion is stamped onto a reused copy of it at each detection
+		self._staticMasks = {}
+		self._searchMaskBuffer = None
+		self._searchMaskShape = None
+		self.setMaskRegions(self.defaultMaskRegions if maskRegions is None else maskRegions)
+		self.setExclusionRadius(exclusionRadius)
+
+	def setMaskRegions(self, maskRegions):
+		""" Sets the image regions excluded from feature detection
+
+		Args:
+			maskRegions (list): (rowStart, rowStop, colStart, colStop) slice
+				bounds of each region, None or negative values are interpreted
+				as in numpy slicing
+
+		"""
+		self._maskRegions = list(maskRegions)
+		self._staticMasks = {}
+
+	def setExclusionRadius(self, radius):
+		""" Sets radius of the disk around each track endpoint in which no new
+			features are detected
+
+		"""
+		self._exclusionRadius = radius
+
+		# Pixel offsets of the disk, flattened against the padded mask buffer
+		# when it is allocated
+		r = int(radius)
+		dy, dx = np.mgrid[-r:r+1, -r:r+1]
+		inside = dx**2 + dy**2 <= radius**2
+		self._diskOffsets = (dx[inside], dy[inside])
+		self._searchMaskBuffer = None
 
-		gridDetector = detectors.GridFeatureDetector(cv2.goodFeaturesToTrack, (15,20), borderBuffer=35)
+	def processImage(self, img, timestamp):
+		# Frames within the current stride are skipped before any processing
+		self._framesSinceProcessed += 1
+		if (self._prevImg is not None and self._framesSinceProcessed < self._frameStride):
+			return
+
+		framesElapsed = self._framesSinceProcessed
+		self._framesSinceProcessed = 0
+
+		# Grayscale input (e.g. from a frame cache) is used as is
+		if (img.ndim == 2):
+			grayImg = img
+		else:
+			grayImg = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+		fullShape = grayImg.shape
+		grayImg = self._prepareImage(grayImg)
+
+		# Tracks alive at the previous frame, propagated below with LK. Tracks
+		# are stored in full resolution coordinates
+		activeSlots = self._trackStore.activeSlots()
+		trackEndpoints = self._toProcessed(self._trackStore.endpoints(activeSlots))
 
 		# If features have never been detected or detectionInverval has lapsed
 		if (self._prevDetectionTime is None or timestamp - self._prevDetectionTime > self._detectionInterval):
 			#print("Finding New Features")
 			self._prevDetectionTime = timestamp
-			searchMask = np.zeros_like(grayImg)
-			searchMask[:] = 255
-
-			# Masks right side of image
-			#searchMask[:, -320:] = 0
-
-			# Masks shadow region
-			
-			searchMask[:300, -1200:] = 0
-			searchMask[300:850, -1100:] = 0
-			searchMask[:, -300:] = 0
-			searchMask[850:1100, -800:-400] = 0
-			
+			searchMask = self._searchMask(fullShape, grayImg.shape, trackEndpoints)
 
-			# Mask all the current track end points
-			for (x,y) in trackEndpoints:
-				cv2.circle(searchMask, (x,y), 5, 0, -1)
-
-			p = gridDetector.detect(grayImg, searchMask, self._featureParams)
+			p = self._gridDetector.detect(grayImg, searchMask, self._featureParams)
 
 			if (p is not None):
-				for x, y in np.float32(p).reshape(-1, 2):
-					newTracks.append(tracking.Track((x,y), timestamp))
+				self._trackStore.addTracks(self._toFull(np.float32(p).reshape(-1, 2)), timestamp)
 
-		if (self._prevImg is not None):
+		if (self._prevImg is not None and len(activeSlots) > 0):
 			prevPoints = np.float32(trackEndpoints).reshape(-1,1,2)
 
 			# Run LK forwards
 			nextPoints, status, error = cv2.calcOpticalFlowPyrLK(self._prevImg,
 				grayImg, prevPoints, None, **self._lkParams)
 
-			# Run LK in reverse
-			prevPointsRev, status, error = cv2.calcOpticalFlowPyrLK(grayImg,
-				self._prevImg, nextPoints, None, **self._lkParams)
+			# Points lost by the forward pass are dropped without running the
+			# reverse pass on them
+			matchQuality = status.reshape(-1) == 1
+
+			if (matchQuality.any()):
+				# Run LK in reverse
+				prevPointsRev, status, error = cv2.calcOpticalFlowPyrLK(grayImg,
+					self._prevImg, nextPoints[matchQuality], None, **self._lkParams)
 
-			# Compute deviation between original points and back propagation
-			dev = abs(prevPoints-prevPointsRev).reshape(-1,2)
+				# Compute deviation between original points and back propagation
+				dev = abs(prevPoints[matchQuality]-prevPointsRev).reshape(-1,2)
 
-			# For each pair of points, take max deviation in either axis
-			maxDev = dev.max(-1)
+				# For each pair of points, take max deviation in either axis
+				maxDev = dev.max(-1)
 
-			# Check against max deviation threshold allowed
-			matchQuality = maxDev < self._deviationThreshold
+				# Check against max deviation threshold allowed
+				matchQuality[matchQuality] = maxDev < self._deviationThreshold
 
-			for (track, point, match) in zip(self._activeTracks, nextPoints.reshape(-1,2), matchQuality):
-				if (match):
-					track.addObservation(point, timestamp)
-					newTracks.append(track)
+			nextPoints = nextPoints.reshape(-1,2)
 
-				# Todo: Handle tracks that have been lost
+			if (self._adaptiveStride):
+				displacement = nextPoints[matchQuality] - prevPoints.reshape(-1,2)[matchQuality]
+				self._updateStride(displacement, framesElapsed)
 
+			# Extend matched tracks and drop the rest in bulk
+			self._trackStore.extendTracks(activeSlots[matchQuality],
+				self._toFull(nextPoints[matchQuality]), timestamp)
+			self._trackStore.killTracks(activeSlots[~matchQuality])
 
-		self._activeTracks = newTracks
+			# Reclaim storage of lost tracks once they dominate the store
+			self._trackStore.compact()
 
 		self._prevImg = grayImg
 		self._prevTimestamp = timestamp
 
+	def _prepareImage(self, grayImg):
+		""" Crops grayscale image to the region of interest and downscales it
 
-	def getTrackEndpoints(self):
-		endpoints = []
+		"""
+		if (self._roi is not None):
+			x0, y0, x1, y1 = self._roi
+			grayImg = grayImg[y0:y1, x0:x1]
+
+		if (self._scale != 1.0):
+			grayImg = cv2.resize(grayImg, None, fx=self._scale, fy=self._scale,
+				interpolation=cv2.INTER_AREA)
+
+		return grayImg
+
+	def _toProcessed(self, points):
+		""" Maps full resolution image coordinates to the processed image
+
+		"""
+		return (np.asarray(points, dtype=np.float64).reshape(-1, 2) - self._roiOffset) * self._scale
+
+	def _toFull(self, points):
+		""" Maps processed image coordinates back to full resolution
+
+		"""
+		return np.asarray(points, dtype=np.float64).reshape(-1, 2) / self._scale + self._roiOffset
+
+	def _updateStride(self, displacement, framesElapsed):
+		""" Picks the number of frames to advance so that the expected
+			displacement between processed frames stays within maxDisplacement
+
+		"""
+		if (len(displacement) < 1):
+			return
+
+		# High percentile of per frame displacement guards against the
+		# fastest features leaving the LK window
+		speed = np.percentile(np.abs(displacement).max(-1), 90) / framesElapsed
+
+		if (speed > 0):
+			stride = int(self._maxDisplacement / speed)
+		else:
+			stride = self._maxStride
+
+		# Stride is allowed to halve immediately but only double per update
+		stride = min(stride, 2 * self._frameStride)
+		self._frameStride = int(np.clip(stride, 1, self._maxStride))
+
+	def _staticMask(self, fullShape, shape):
+		mask = self._staticMasks.get(fullShape)
 
-		for track in self._activeTracks:
-			(time, position) = track.getLastObservation()
-			endpoints.append(position)
+		if (mask is None):
+			# Regions are given in full resolution coordinates
+			mask = np.full(fullShape, 255, dtype=np.uint8)
 
-		return endpoints
+			for (rowStart, rowStop, colStart, colStop) in self._maskRegions:
+				mask[rowStart:rowStop, colStart:colStop] = 0
+
+			if (self._roi is not None):
+				x0, y0, x1, y1 = self._roi
+				mask = mask[y0:y1, x0:x1]
+
+			if (mask.shape != shape):
+				mask = cv2.resize(mask, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+
+			mask = np.ascontiguousarray(mask)
+			self._staticMasks[fullShape] = mask
+
+		return mask
+
+	def _searchMask(self, fullShape, shape, trackEndpoints):
+		""" Returns static mask with disks around all track endpoints cleared
+
+			Disks are stamped with a single scatter into a buffer padded by
+			more than the disk diameter, so endpoints near or beyond the image
+			border need no bounds checks
+
+		"""
+		staticMask = self._staticMask(fullShape, shape)
+		r = int(self._exclusionRadius)
+		pad = 2 * r + 1
+
+		if (self._searchMaskBuffer is None or self._searchMaskShape != shape):
+			self._searchMaskShape = shape
+			self._searchMaskBuffer = np.empty((shape[0] + 2*pad, shape[1] + 2*pad), dtype=np.uint8)
+
+			dx, dy = self._diskOffsets
+			self._diskFlatOffsets = dy.astype(np.int64) * self._searchMaskBuffer.shape[1] + dx
+
+		searchMask = self._searchMaskBuffer[pad:-pad, pad:-pad]
+		np.copyto(searchMask, staticMask)
+
+		if (len(trackEndpoints) > 0):
+			endpoints = np.int32(trackEndpoints)
+
+			# Endpoints further than the radius outside the image are moved
+			# to just beyond reach of it
+			x = np.clip(endpoints[:, 0], -(r+1), shape[1]+r).astype(np.int64) + pad
+			y = np.clip(endpoints[:, 1], -(r+1), shape[0]+r).astype(np.int64) + pad
+
+			centers = y * self._searchMaskBuffer.shape[1] + x
+			pixels = centers[:, np.newaxis] + self._diskFlatOffsets
+
+			self._searchMaskBuffer.ravel()[pixels.ravel()] = 0
+
+		return searchMask
+
+	def close(self):
+		""" Releases the detection thread pool, the tracker can still be
+			used afterwards and recreates it when needed
+
+		"""
+		self._gridDetector.close()
+
+	@property
+	def frameStride(self):
+		return self._frameStride
+
+	def getTrackEndpoints(self):
+		return self._trackStore.endpoints()
 
 	def getTracks(self):
-		return self._activeTracks
\ No newline at end of file
+		""" Materializes Track objects for the active tracks
+
+		"""
+		return self._trackStore.getTracks()
+
+	def getLostTracks(self):
+		""" Materializes Track objects for tracks which have been lost, only
+			complete if the tracker was created with retainLostTracks
+
+		"""
+		return self._trackStore.getLostTracks()
+
+	@property
+	def trackStore(self):
+		return self._trackStore
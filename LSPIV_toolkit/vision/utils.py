@@ -1,5 +1,6 @@
 import numpy as np
-import copy
+
+from ..core import tracking
 
 class FrameTransformation(object):
 	""" Class that can transform between frames (typically image and world)
@@ -11,72 +12,213 @@ class FrameTransformation(object):
 		self._imgHeight, self._imgWidth = imgSize
 		print(self._imgWidth, self._imgHeight)
 
-		corners = [[0,0], [0, self._imgHeight], [self._imgWidth, 0], [self._imgWidth, self._imgHeight]]
-
-		pts = self._camModel.undistortPoints(corners)
+		if (not self._camModel.initialized):
+			self._camModel.initialize(imgSize)
 
-		#todo: change to crop to smallest rectangle enclosing all corners
-		x, y = pts[0]
-		r, b = pts[3]
-		self._cropBounds = [int(x), int(y), int(r), int(b)]
+		# Crop of the undistorted image, the camera model's rectify maps are
+		# already restricted to it
+		self._cropBounds = self._camModel.cropBounds
 		print(self._cropBounds)
 
-	def transformImg(self, img):
-		undistortedImg = self._camModel.undistortImage(img)
+		# Undistorted points of tracks seen so far, keyed by track id, as
+		# (count, last raw point, undistorted points)
+		self._trackPoints = {}
+		self._maxCachedTracks = 10000
 
-		croppedImg = undistortedImg[self._cropBounds[1]:self._cropBounds[3], 
-					self._cropBounds[0]:self._cropBounds[2]]
+		# Undistorted observations of the last batch of tracks, see
+		# undistortTrackHistories
+		self._historyCache = None
 
-		return croppedImg
+	def transformImg(self, img, out=None):
+		""" Undistorts and crops img with a single remap, written into out
+			if given (see allocateImgBuffer)
 
-	def transformTrackForPlotting(self, track):
-		""" Does everything transform track does except for the coordinate flip
-			so tracks can be easily plotted on image
+		"""
+		return self._camModel.undistortCroppedImage(img, out)
+
+	def allocateImgBuffer(self, img):
+		return self._camModel.croppedImageBuffer(img)
+
+	def transformPoints(self, points):
+		""" Undistorts Nx2 image points and adjusts them for cropping
 
 		"""
-		newTrack = copy.deepcopy(track)
+		points = np.asarray(points).reshape(-1, 2)
 
-		ptSeq = newTrack.getPointSequence()
+		if (len(points) < 1):
+			return np.empty((0, 2), dtype=np.float32)
 
-		undistortedPtSeq = self._camModel.undistortPoints(ptSeq)
-		undistortedPtSeq = np.reshape(undistortedPtSeq, (-1,2))
+		undistortedPts = self._camModel.undistortPoints(points)
+		undistortedPts = np.reshape(undistortedPts, (-1,2))
 
 		# Adjust for cropping
 		xOffset, yOffset, _, _ = self._cropBounds
-		undistortedPtSeq[:, 0] -= xOffset
-		undistortedPtSeq[:, 1] -= yOffset
+		undistortedPts[:, 0] -= xOffset
+		undistortedPts[:, 1] -= yOffset
 
-		newTrack.updatePointSequence(undistortedPtSeq)
+		return undistortedPts
 
-		return newTrack
+	def toFieldFrame(self, points):
+		""" Flips y coordinate of undistorted, cropped points to shift origin
+			down to left bottom corner. Returns a new array
 
-	def transformTrack(self, track):
-		""" Applies unwarping, crop, and coordinate flip to put origin in lower
-			left hand corner. Returns a new copy of the track.
 		"""
+		fieldPts = np.array(points).reshape(-1, 2)
 
-		newTrack = copy.deepcopy(track)
+		newImgHeight = self._cropBounds[3] - self._cropBounds[1]
+		fieldPts[:, 1] *= -1.0
+		fieldPts[:, 1] += newImgHeight
 
-		ptSeq = newTrack.getPointSequence()
+		return fieldPts
 
-		undistortedPtSeq = self._camModel.undistortPoints(ptSeq)
-		undistortedPtSeq = np.reshape(undistortedPtSeq, (-1,2))
+	def undistortTrackPoints(self, track):
+		""" Returns undistorted, cropped image points of track (read-only).
+			For tracks with an id, points undistorted on earlier calls are
+			reused and only newly added observations are undistorted
 
-		# Adjust for cropping
-		xOffset, yOffset, _, _ = self._cropBounds
-		undistortedPtSeq[:, 0] -= xOffset
-		undistortedPtSeq[:, 1] -= yOffset
+		"""
+		points = track.getPointSequence()
+		trackId = track.trackId
 
+		if (trackId is None):
+			return self.transformPoints(points)
 
-		# Flip y coordinate to shift origin down to left bottom corner
-		newImgHeight = self._cropBounds[3] - self._cropBounds[1]
-		undistortedPtSeq[:, 1] *= -1.0
-		undistortedPtSeq[:, 1] += newImgHeight
+		entry = self._trackPoints.get(trackId)
+		count = len(points)
+
+		if (entry is not None):
+			cachedCount, lastPoint, undistortedPts = entry
+
+			# Cached prefix is only valid if the history was appended to
+			if (0 < cachedCount <= count and np.array_equal(points[cachedCount-1], lastPoint)):
+				if (cachedCount == count):
+					return undistortedPts
+
+				newPts = self.transformPoints(points[cachedCount:])
+				undistortedPts = np.concatenate((undistortedPts, newPts.astype(undistortedPts.dtype)))
+			else:
+				undistortedPts = self.transformPoints(points)
+		else:
+			undistortedPts = self.transformPoints(points)
+
+			if (len(self._trackPoints) >= self._maxCachedTracks):
+				self._evictTracks()
+
+		undistortedPts.flags.writeable = False
+
+		if (count > 0):
+			self._trackPoints[trackId] = (count, points[count-1].copy(), undistortedPts)
+
+		return undistortedPts
+
+	def undistortTrackHistories(self, trackIds, positions, lengths):
+		""" Batched undistortTrackPoints for tracks given as flat arrays
+			grouped by track (see TrackStore.history). Observations
+			undistorted by the previous call for the same track id are
+			reused, the new ones of all tracks are undistorted in a single
+			call
+
+			Returns the undistorted, cropped points (read-only) in the same
+			order as positions
+		"""
+		trackIds = np.asarray(trackIds, dtype=np.int64)
+		positions = np.asarray(positions).reshape(-1, 2)
+		lengths = np.asarray(lengths, dtype=np.int64)
+		ends = np.cumsum(lengths)
+		starts = ends - lengths
+		lastIndices = np.maximum(ends - 1, 0)
+
+		# Length of the cached prefix of each track, only valid if the
+		# history was appended to
+		cachedCounts = np.zeros(len(lengths), dtype=np.int64)
+		cachedStarts = np.zeros(len(lengths), dtype=np.int64)
+		cache = getattr(self, '_historyCache', None)
+
+		if (cache is not None and len(positions) > 0):
+			cacheIds, cacheCounts, cacheLast, cacheStarts, cachePts = cache
+
+			entries = np.minimum(np.searchsorted(cacheIds, trackIds), len(cacheIds) - 1)
+			counts = np.where(cacheIds[entries] == trackIds, cacheCounts[entries], 0)
+
+			valid = (counts > 0) & (counts <= lengths)
+			valid[valid] = np.all(positions[starts[valid] + counts[valid] - 1] == cacheLast[entries[valid]], axis=1)
 
-		newTrack.updatePointSequence(undistortedPtSeq)
+			cachedCounts[valid] = counts[valid]
+			cachedStarts[valid] = cacheStarts[entries[valid]]
+
+		obsIndices = np.arange(len(positions)) - np.repeat(starts, lengths)
+		isNew = obsIndices >= np.repeat(cachedCounts, lengths)
+
+		newPts = self.transformPoints(positions[isNew])
+		undistortedPts = np.empty((len(positions), 2), dtype=newPts.dtype)
+		undistortedPts[isNew] = newPts
+
+		if (not isNew.all()):
+			cachedIndices = np.repeat(cachedStarts, cachedCounts) + obsIndices[~isNew]
+			undistortedPts[~isNew] = cachePts[cachedIndices]
+
+		undistortedPts.flags.writeable = False
+
+		if (len(positions) > 0):
+			order = np.argsort(trackIds, kind='stable')
+			self._historyCache = (trackIds[order], lengths[order], positions[lastIndices[order]].copy(),
+									starts[order], undistortedPts)
+
+		return undistortedPts
+
+	def _evictTracks(self):
+		""" Drops the oldest half of the cached tracks, most of which belong
+			to tracks which have since been lost
+
+		"""
+		keys = list(self._trackPoints.keys())
+
+		for key in keys[:len(keys) // 2]:
+			del self._trackPoints[key]
+
+	def forgetTracks(self, keepIds=None):
+		""" Drops cached track points, except for tracks in keepIds
+
+		"""
+		self._historyCache = None
+
+		if (keepIds is None):
+			self._trackPoints.clear()
+			return
+
+		keepIds = set(keepIds)
+		for key in [k for k in self._trackPoints if k not in keepIds]:
+			del self._trackPoints[key]
+
+	def _newTrack(self, track, points):
+		newTrack = tracking.Track()
+		newTrack.addObservations(points, track.times)
 
 		return newTrack
 
+	def transformTrackForPlotting(self, track):
+		""" Does everything transform track does except for the coordinate flip
+			so tracks can be easily plotted on image
+
+		"""
+		return self._newTrack(track, self.undistortTrackPoints(track))
+
+	def transformTrack(self, track):
+		""" Applies unwarping, crop, and coordinate flip to put origin in lower
+			left hand corner. Returns a new track.
+		"""
+		return self._newTrack(track, self.toFieldFrame(self.undistortTrackPoints(track)))
+
+	def transformTrackBoth(self, track):
+		""" Returns (plotting track, field frame track) from a single
+			undistortion of the track points
+
+		"""
+		undistortedPts = self.undistortTrackPoints(track)
+
+		return (self._newTrack(track, undistortedPts),
+				self._newTrack(track, self.toFieldFrame(undistortedPts)))
+
 	def getCroppedExtents(self):
 		return [(0, self._cropBounds[2]-self._cropBounds[0]), 
 				(0, self._cropBounds[3]-self._cropBounds[1])]
@@ -16,6 +16,7 @@ import LSPIV_toolkit.vision.calibration as cv_calib
 import LSPIV_toolkit.vision.utils as cv_utils
 import LSPIV_toolkit.vision.detectors as cv_detectors
 import LSPIV_toolkit.vision.trackers as cv_trackers
+import LSPIV_toolkit.vision.pipeline as cv_pipeline
 import LSPIV_toolkit.core.utils as vf_utils
 import LSPIV_toolkit.core.vf.extents as vf_extents
 import LSPIV_toolkit.approx as vf_approx
@@ -106,6 +107,7 @@ for fileName in images:
 		overlayView.changeGrid(displayGrid)
 
 		mFilter = vf_analysis.MeasurementProcessor(xDist, yDist, xGrid, yGrid)
+		measurementStage = cv_pipeline.MeasurementStage(frameTrans, minTrackAge)
 
 	lkTracker.processImage(img, timestamp)
 	timestamp += datasetTimestep
@@ -121,23 +123,20 @@ for fileName in images:
 	undistortedImg = frameTrans.transformImg(img)
 	overlayView.updateImage(undistortedImg)
 
-	# Get latest tracks from Optical flow
-	tracks = lkTracker.getTracks()
+	# Measurements of all active tracks in one batch, only observations
+	# added since the last step are undistorted
+	trackStore = lkTracker.trackStore
+	measurementStage.process(trackStore, mFilter)
 
-	for tr in tracks:
-		# Skip tracks that are too young
-		if (tr.age() < minTrackAge):
-			continue
+	# For Plotting only, reuses the points undistorted for the measurements
+	slots = trackStore.activeSlots()
+	slots = slots[trackStore.ages(slots) >= minTrackAge]
+	positions, _, lengths = trackStore.history(slots)
+	undistortedPts = frameTrans.undistortTrackHistories(trackStore.ids(slots), positions, lengths)
 
-		# For Plotting only
-		track = frameTrans.transformTrackForPlotting(tr)
-
-		newTrack = frameTrans.transformTrack(tr)
-
-		ptSeq = track.getPointSequence()
-		cv2.polylines(undistortedImg, [np.int32(ptSeq)], False, (255,0,0))
-		
-		mFilter.addMeasurements(newTrack.getMeasurements())
+	if (len(slots) > 0):
+		for ptSeq in np.split(undistortedPts, np.cumsum(lengths)[:-1]):
+			cv2.polylines(undistortedImg, [np.int32(ptSeq)], False, (255,0,0))
 
 	# Compute Approximation
 	#vfEstimator.clearMeasurements()
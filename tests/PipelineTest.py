@@ -37,7 +37,10 @@ lkTracker = cv_trackers.LKOpticalFlowTracker(lk_params, feature_params)
 
 timestamp = 0.0
 
-vfEstimator = vf_approx.gp.GPApproximator()
+# Reuse the previous GP models as a warm start at each step
+incremental = False
+
+vfEstimator = vf_approx.gp.GPApproximator(incremental=incremental)
 vfExtents = None
 
 xGrid = 25 #cells
@@ -102,6 +105,10 @@ for fileName in images:
 	mFilter.drawMeasurementGrid()
 	vfApprox = vfEstimator.approximate(vfExtents)
 
+	if (incremental):
+		# Updates which extended the Cholesky factor rather than refactorizing
+		print("Update ", vfEstimator.lastUpdate, " extended/refactorized ", vfEstimator.updateCounts)
+
 	fieldView.changeField(vfApprox)
 
 	cv2.imshow("Input", undistortedImg)
@@ -0,0 +1,50 @@
+import cv2
+import os
+import tempfile
+import numpy as np
+
+from context import LSPIV_toolkit
+
+import LSPIV_toolkit.core.dataset as data_utils
+
+
+# Synthetic image dataset of 10 frames where frame 4 is a corrupt file
+datasetDir = tempfile.mkdtemp()
+numFrames = 10
+corruptFrame = 4
+
+for i in range(numFrames):
+	fileName = datasetDir + '/frame%04d.jpg' % i
+
+	if (i == corruptFrame):
+		with open(fileName, 'wb') as f:
+			f.write(b'not a jpeg')
+	else:
+		cv2.imwrite(fileName, np.full((48, 64, 3), 20 * i, dtype=np.uint8))
+
+# Reader skips the corrupt frame and delivers every good frame in order
+reader = data_utils.PrefetchingReader(sorted(os.listdir(datasetDir)), numThreads=3, bufferSize=4,
+	decoder=lambda name: cv2.imread(datasetDir + '/' + name))
+reader.start()
+
+frames = list(reader)
+reader.close()
+
+values = [int(img[0, 0, 0]) for img in frames]
+print("Reader delivered ", len(frames), " frames, skipped ", reader.framesSkipped)
+
+assert len(frames) == numFrames - 1
+assert reader.framesSkipped == 1
+assert all(abs(value - 20 * i) <= 2 for value, i in zip(values, [i for i in range(numFrames) if i != corruptFrame]))
+
+# Dataset iteration runs to the end of the dataset past the corrupt frame
+d = data_utils.Dataset(datasetDir, 0, numFrames, decoderThreads=3, bufferSize=4)
+d.load()
+
+numRead = len(list(d))
+print("Dataset delivered ", numRead, " frames, more: ", d.more())
+
+assert numRead == numFrames - 1
+assert not d.more()
+
+d.close()